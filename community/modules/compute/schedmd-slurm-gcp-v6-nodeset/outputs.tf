@@ -37,6 +37,11 @@ output "nodeset" {
     error_message = "placement_max_distance requires enable_placement to be set to true."
   }
 
+  precondition {
+    condition     = var.placement_pool_size == 0 || var.enable_placement
+    error_message = "placement_pool_size requires enable_placement to be set to true."
+  }
+
   precondition {
     condition     = !(startswith(var.machine_type, "a3-") && var.placement_max_distance == 1)
     error_message = "A3 machines do not support a placement_max_distance of 1."
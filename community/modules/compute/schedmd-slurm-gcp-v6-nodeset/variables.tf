@@ -633,3 +633,18 @@ variable "placement_max_distance" {
     error_message = "Invalid value for placement_max_distance. Valid values are null, 1, 2, or 3."
   }
 }
+
+variable "placement_pool_size" {
+  description = <<-EOD
+  Number of compact placement policies created in advance and kept unused,
+  so exclusive jobs don't wait for creation of placement policy on start.
+  Requires enable_placement to be true.
+  EOD
+  type        = number
+  default     = 0
+
+  validation {
+    condition     = var.placement_pool_size >= 0
+    error_message = "placement_pool_size must be non-negative."
+  }
+}
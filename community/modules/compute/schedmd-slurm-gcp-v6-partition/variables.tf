@@ -79,6 +79,7 @@ variable "nodeset" {
     enable_confidential_vm           = optional(bool, false)
     enable_placement                 = optional(bool, false)
     placement_max_distance           = optional(number, null)
+    placement_pool_size              = optional(number, 0)
     enable_oslogin                   = optional(bool, true)
     enable_shielded_vm               = optional(bool, false)
     enable_maintenance_reservation   = optional(bool, false)
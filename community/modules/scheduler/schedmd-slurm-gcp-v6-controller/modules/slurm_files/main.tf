@@ -42,11 +42,13 @@ resource "random_uuid" "cluster_id" {
 locals {
   config = {
     enable_bigquery_load  = var.enable_bigquery_load
+    bigquery_load_backend = var.bigquery_load_backend
     cloudsql_secret       = var.cloudsql_secret
     cluster_id            = random_uuid.cluster_id.result
     project               = var.project_id
     slurm_cluster_name    = var.slurm_cluster_name
     enable_slurm_auth     = var.enable_slurm_auth
+    enable_resume_broker  = var.enable_resume_broker
     bucket_path           = local.bucket_path
     enable_debug_logging  = var.enable_debug_logging
     extra_logging_flags   = var.extra_logging_flags
@@ -60,6 +62,10 @@ locals {
     controller_startup_scripts_timeout = var.controller_startup_scripts_timeout
     compute_startup_scripts_timeout    = var.compute_startup_scripts_timeout
 
+    # slurmsync
+    slurmsync_interval  = var.slurmsync_interval
+    slurmsync_cache_ttl = var.slurmsync_cache_ttl
+
     munge_mount     = local.munge_mount
     slurm_key_mount = var.slurm_key_mount
 
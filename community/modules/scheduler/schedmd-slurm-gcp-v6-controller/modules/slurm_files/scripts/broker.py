@@ -0,0 +1,292 @@
+#!/slurm/python/venv/bin/python3.13
+
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Optional broker of ResumeProgram / SuspendProgram requests, enabled by `enable_resume_broker`.
+
+During bursts (e.g. job array storms) Slurm invokes ResumeProgram many times within seconds,
+each invocation warms up its own `Lookup` and sends its own small bulkInserts.
+Instead, wrappers hand nodelists over to the broker through Unix socket (see `broker_client.py`).
+Broker merges requests received within a short window, so `resume.group_nodes_bulk`
+can form the largest valid bulk chunks per nodeset / placement / job.
+If broker is not running, wrappers fall back to `resume.py` / `suspend.py`.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import argparse
+import fcntl
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from pathlib import Path
+
+import util
+from util import lookup, to_hostlist, cfg_timedelta
+import broker_client
+import metrics
+import resume
+import suspend
+import slurmsync
+import tracing
+
+import logging
+log = logging.getLogger()
+
+COALESCE_WINDOW = timedelta(seconds=1)
+# Max number of requests with operations in flight, waits for them don't hold back next windows
+OPS_CONCURRENCY = 32
+
+
+@dataclass(frozen=True)
+class Request:
+    op: str # one of `broker_client.OPS`
+    nodes: List[str]
+    resume_data: Optional[resume.ResumeData] = None
+
+    @classmethod
+    def decode(cls, line: bytes) -> "Request":
+        jo = json.loads(line)
+        if (op := jo.get("op")) not in broker_client.OPS:
+            raise ValueError(f"unknown operation: {op}")
+        resume_data = None
+        if resume_file := jo.get("resume_file"):
+            # copy made by resume_wrapper.sh for this request only, it's deleted by wrapper
+            # once request is accepted, otherwise it's still needed by fallback to `resume.py`
+            resume_data = resume.read_resume_data(resume_file)
+        return cls(
+            op=op,
+            nodes=util.to_hostnames(jo["nodelist"]),
+            resume_data=resume_data,
+        )
+
+
+def _merge_resume_data(a: Optional[resume.ResumeData], b: Optional[resume.ResumeData]) -> Optional[resume.ResumeData]:
+    if a is None or b is None:
+        return a or b
+    jobs = {j.job_id: j for j in a.jobs}
+    for j in b.jobs:
+        if (prev := jobs.get(j.job_id)) is not None:
+            j = replace(prev, nodes_alloc=list(dict.fromkeys(prev.nodes_alloc + j.nodes_alloc)))
+        jobs[j.job_id] = j
+    return resume.ResumeData(jobs=list(jobs.values()))
+
+
+def coalesce(requests: List[Request]) -> List[Request]:
+    """
+    Merges requests of the same operation, while preserving order of
+    operations on the same node, e.g. `[resume a, suspend b, resume c, suspend a]`
+    -> `[resume a+c, suspend b+a]`, but `[resume a, suspend a, resume a]` stays as is.
+    """
+    res: List[Request] = []
+    for req in requests:
+        nodes = set(req.nodes)
+        for i in reversed(range(len(res))):
+            if res[i].op == req.op:
+                res[i] = Request(
+                    op=req.op,
+                    nodes=list(dict.fromkeys(res[i].nodes + req.nodes)),
+                    resume_data=_merge_resume_data(res[i].resume_data, req.resume_data))
+                break
+            if nodes & set(res[i].nodes):
+                res.append(req) # can't be reordered before operation on the same nodes
+                break
+        else:
+            res.append(req)
+    return res
+
+
+def process(req: Request, submitted: threading.Event) -> None:
+    """
+    Processes coalesced request, `submitted` is set once its operations are submitted,
+    while waits for them and handling of failures may still be in progress.
+    """
+    lkp = lookup()
+    other_nodes, nodes = util.separate(lkp.is_power_managed_node, req.nodes)
+    if other_nodes:
+        log.error(f"Ignoring non-power-managed nodes '{to_hostlist(other_nodes)}'")
+    if not nodes:
+        return
+    log.info(f"{req.op} {to_hostlist(nodes)}")
+    try:
+        with tracing.span(req.op, nodes=to_hostlist(nodes), count=len(nodes)):
+            if req.op == "resume":
+                resume.resume_nodes(nodes, req.resume_data, submitted)
+            else:
+                suspend.suspend_nodes(nodes)
+    except Exception:
+        log.exception(f"failed to {req.op} {to_hostlist(nodes)}")
+
+
+class Broker:
+    """
+    Collects requests within `window` since the first one, merges and submits them together.
+    Windows are processed one at a time, in order of arrival, next one starts as soon as operations
+    of the previous one are submitted, while waits for operations and handling of failures continue
+    in the background. Request on nodes with operations still in flight is deferred until they're done,
+    so operations on the same nodes are never reordered. Requests received while previous window
+    is processed are merged into the next one.
+    """
+
+    def __init__(self, window: timedelta, handler: Callable[[Request, threading.Event], None] = process) -> None:
+        self._window = window
+        self._handler = handler
+        self._lock = threading.Lock()
+        self._pending: List[Request] = []
+        self._deferred: List[Request] = [] # older than pending ones
+        self._inflight: Dict[Future, Set[str]] = {}
+        # single worker: windows don't overlap, and config & caches are refreshed in between
+        self._exe = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broker")
+        self._ops = ThreadPoolExecutor(max_workers=OPS_CONCURRENCY, thread_name_prefix="broker-ops")
+        self._caches = slurmsync.WarmCaches()
+        self._config_mtime: Optional[float] = None
+
+    def add(self, req: Request) -> None:
+        with self._lock:
+            self._pending.append(req)
+            if len(self._pending) == 1:
+                timer = threading.Timer(self._window.total_seconds(), self._exe.submit, args=(self._process,))
+                timer.daemon = True
+                timer.start()
+
+    def handle(self, conn: socket.socket) -> None:
+        conn.settimeout(broker_client.TIMEOUT)
+        with conn, conn.makefile("rwb") as f:
+            try:
+                self.add(Request.decode(f.readline()))
+                resp: Dict[str, Any] = dict(ok=True)
+            except Exception as e:
+                log.exception("failed to accept request")
+                resp = dict(ok=False, error=str(e))
+            f.write(json.dumps(resp).encode() + b"\n")
+            f.flush()
+
+    def _refresh(self) -> None:
+        """Picks up config updated by slurmsync, expires cached data"""
+        mtime = util.CONFIG_FILE.stat().st_mtime
+        if self._config_mtime is not None and mtime != self._config_mtime:
+            util.update_config(util.NSDict(util.yaml_load(util.CONFIG_FILE.read_text())))
+        self._config_mtime = mtime
+        self._caches.expire(lookup())
+
+    def _process(self) -> None:
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+            pending, self._pending = self._pending, []
+        if not deferred and not pending: # already taken by previous window, that was delayed
+            return
+        try:
+            self._refresh()
+        except Exception:
+            log.exception("failed to refresh config and caches")
+        log.debug(f"processing {len(pending)} requests, {len(deferred)} deferred")
+        ready: List[Request] = []
+        with self._lock:
+            busy = set().union(*self._inflight.values())
+            for req in deferred + pending:
+                if busy & set(req.nodes): # operations on its nodes are still in flight
+                    self._deferred.append(req)
+                    busy.update(req.nodes) # later requests on these nodes go after it
+                else:
+                    ready.append(req)
+        for req in coalesce(ready):
+            try:
+                # e.g. resume and suspend of the same node within this window
+                wait([f for f, nodes in self._inflight_snapshot() if nodes & set(req.nodes)])
+                self._submit(req)
+            except Exception:
+                log.exception(f"failed to process {req.op} request")
+        metrics.flush() # broker doesn't exit, so `atexit` flush is never reached
+
+    def _inflight_snapshot(self) -> List[Tuple[Future, Set[str]]]:
+        with self._lock:
+            return list(self._inflight.items())
+
+    def _submit(self, req: Request) -> None:
+        """Hands request over to ops worker, returns once its operations are submitted"""
+        submitted = threading.Event()
+        fut = self._ops.submit(tracing.propagate(self._handler), req, submitted)
+        with self._lock:
+            self._inflight[fut] = set(req.nodes)
+        fut.add_done_callback(self._done)
+        fut.add_done_callback(lambda _: submitted.set()) # e.g. nothing was submitted
+        submitted.wait()
+
+    def _done(self, fut: Future) -> None:
+        if (exc := fut.exception()) is not None:
+            log.error("failed to process request", exc_info=exc)
+        with self._lock:
+            nodes = self._inflight.pop(fut)
+            retry = any(nodes & set(req.nodes) for req in self._deferred)
+        if retry: # deferred requests may be unblocked now
+            self._exe.submit(self._process)
+        metrics.flush()
+
+
+def _socket_dir(path: Path) -> None:
+    """Creates directory of socket, only accessible by SlurmUser"""
+    path.mkdir(mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{path} must be a directory owned by broker user")
+    os.chmod(path, 0o700)
+
+
+def serve(broker: Broker, path: Path = broker_client.SOCKET_PATH) -> None:
+    _socket_dir(path.parent)
+    path.unlink(missing_ok=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as srv:
+        umask = os.umask(0o177) # socket is never accessible by others, not even briefly
+        try:
+            srv.bind(str(path))
+        finally:
+            os.umask(umask)
+        srv.listen(128)
+        log.info(f"Listening on {path}")
+        while True:
+            conn, _ = srv.accept()
+            try:
+                broker.handle(conn)
+            except Exception:
+                log.exception("failed to handle connection")
+
+
+def main() -> None:
+    lkp = lookup()
+    if not lkp.is_controller:
+        log.error("Broker can only run on controller")
+        return
+    util.init_tracing("broker")
+    util.init_metrics("broker")
+    serve(Broker(window=cfg_timedelta(lkp.cfg.resume_broker_window, COALESCE_WINDOW)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = util.init_log_and_parse(parser)
+
+    pid_file = (Path("/tmp") / Path(__file__).name).with_suffix(".pid")
+    with pid_file.open("w") as fp:
+        try:
+            fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            main()
+        except BlockingIOError:
+            sys.exit(0)
@@ -0,0 +1,71 @@
+#!/slurm/python/venv/bin/python3.13
+
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client of resume/suspend broker (see `broker.py`), used by `resume_wrapper.sh` and `suspend_wrapper.sh`.
+
+Hands nodelist over to the broker and exits with 0 if broker accepted it,
+exits with non-zero code otherwise (e.g. broker is not running),
+so caller should fall back to running `resume.py` / `suspend.py`.
+
+NOTE: Only depends on standard library to keep startup cheap,
+it's executed on every ResumeProgram / SuspendProgram invocation.
+"""
+
+from typing import Optional
+from pathlib import Path
+import argparse
+import json
+import socket
+import sys
+
+# Under `slurmdirs.state`, directory is only accessible by SlurmUser (see `broker.serve`)
+SOCKET_PATH = Path("/var/spool/slurm/broker/broker.sock")
+TIMEOUT = 5.0 # seconds
+OPS = ("resume", "suspend")
+
+
+def encode(op: str, nodelist: str, resume_file: Optional[str]) -> bytes:
+    return json.dumps(dict(op=op, nodelist=nodelist, resume_file=resume_file)).encode() + b"\n"
+
+
+def submit(op: str, nodelist: str, resume_file: Optional[str] = None, path: Path = SOCKET_PATH) -> bool:
+    """Returns True if broker accepted the request"""
+    if not path.exists():
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT)
+            sock.connect(str(path))
+            sock.sendall(encode(op, nodelist, resume_file))
+            with sock.makefile("rb") as f:
+                resp = json.loads(f.readline() or b"{}")
+    except (OSError, ValueError) as e:
+        print(f"broker is not available: {e}", file=sys.stderr)
+        return False
+    if not resp.get("ok"):
+        print(f"broker rejected request: {resp.get('error')}", file=sys.stderr)
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("op", choices=OPS)
+    parser.add_argument("nodelist")
+    parser.add_argument("--resume-file", help="copy of SLURM_RESUME_FILE")
+    args = parser.parse_args()
+    sys.exit(0 if submit(args.op, args.nodelist, args.resume_file) else 1)
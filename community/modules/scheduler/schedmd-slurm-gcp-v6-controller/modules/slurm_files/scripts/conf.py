@@ -17,6 +17,8 @@
 from typing import List, Optional, Iterable, Dict, Set, Tuple
 from itertools import chain
 from collections import defaultdict
+from enum import IntEnum
+import hashlib
 import json
 from pathlib import Path
 import util
@@ -24,6 +26,9 @@ from util import dirs, slurmdirs
 import tpu
 from addict import Dict as NSDict # type: ignore
 
+import logging
+log = logging.getLogger()
+
 FILE_PREAMBLE = """
 # Warning:
 # This file is managed by a script. Manual modifications will be overwritten.
@@ -31,6 +36,28 @@ FILE_PREAMBLE = """
 
 
 
+class ConfAction(IntEnum):
+    """
+    Action required for slurmctld to pick up changes in generated files,
+    ordered from the lightest to the heaviest one.
+    """
+    NONE = 0
+    RECONFIGURE = 1 # `scontrol reconfigure`
+    RESTART = 2 # `systemctl restart slurmctld` + `scontrol reconfigure`
+
+
+def write_if_changed(path: Path, content: str, mode: int) -> bool:
+    """
+    Writes content to the file, unless file already has exactly the same content.
+    Returns whether file got written.
+    """
+    if path.exists() and path.read_text() == content:
+        return False
+    path.write_text(content)
+    util.chown_slurm(path, mode=mode)
+    return True
+
+
 def dict_to_conf(conf, delim=" ") -> str:
     """convert dict to delimited slurm-style key-value pairs"""
 
@@ -252,29 +279,61 @@ def suspend_exc_lines(lkp: util.Lookup) -> Iterable[str]:
     )
 
 
+# Section of cloud.conf that holds cluster-wide parameters (plugins, programs, etc.),
+# its change requires restart of slurmctld, other sections (nodes, partitions) only reconfigure.
+CLOUD_CONF_GLOBAL_SECTION = "conf"
+
+def cloud_conf_sections(lkp: util.Lookup) -> Dict[str, str]:
+    """Sections of cloud.conf keyed by the entity they describe, in order of appearance"""
+    sections = {
+        "preamble": FILE_PREAMBLE,
+        CLOUD_CONF_GLOBAL_SECTION: conflines(lkp),
+        **{f"nodeset/{n.nodeset_name}": nodeset_lines(n, lkp) for n in lkp.cfg.nodeset.values()},
+        **{f"nodeset_dyn/{n.nodeset_name}": nodeset_dyn_lines(n) for n in lkp.cfg.nodeset_dyn.values()},
+        **{f"nodeset_tpu/{n.nodeset_name}": nodeset_tpu_lines(n, lkp) for n in lkp.cfg.nodeset_tpu.values()},
+        **{f"partition/{p.partition_name}": partitionlines(p, lkp) for p in lkp.cfg.partitions.values()},
+        **{f"suspend_exc/{i}": line for i, line in enumerate(suspend_exc_lines(lkp))},
+    }
+    return {k: v for k, v in sections.items() if v}
+
+
 def make_cloud_conf(lkp: util.Lookup) -> str:
     """generate cloud.conf snippet"""
-    lines = [
-        FILE_PREAMBLE,
-        conflines(lkp),
-        *(nodeset_lines(n, lkp) for n in lkp.cfg.nodeset.values()),
-        *(nodeset_dyn_lines(n) for n in lkp.cfg.nodeset_dyn.values()),
-        *(nodeset_tpu_lines(n, lkp) for n in lkp.cfg.nodeset_tpu.values()),
-        *(partitionlines(p, lkp) for p in lkp.cfg.partitions.values()),
-        *(suspend_exc_lines(lkp)),
-    ]
-    return "\n\n".join(filter(None, lines))
+    return "\n\n".join(cloud_conf_sections(lkp).values())
+
+
+def _sections_hashes(sections: Dict[str, str]) -> Dict[str, str]:
+    return {k: hashlib.sha256(v.encode("utf-8")).hexdigest() for k, v in sections.items()}
 
 
-def gen_cloud_conf(lkp: util.Lookup) -> None:
-    content = make_cloud_conf(lkp)
+def gen_cloud_conf(lkp: util.Lookup) -> ConfAction:
+    sections = cloud_conf_sections(lkp)
+    content = "\n\n".join(sections.values())
+    hashes = _sections_hashes(sections)
 
     conf_file = lkp.etc_dir / "cloud.conf"
-    conf_file.write_text(content)
-    util.chown_slurm(conf_file, mode=0o644)
+    hashes_file = lkp.etc_dir / "cloud.conf.sections.json"
+    try:
+        prev_hashes = json.loads(hashes_file.read_text())
+    except Exception:
+        prev_hashes = None
+
+    if not write_if_changed(conf_file, content, mode=0o644):
+        action = ConfAction.NONE
+    elif prev_hashes is None:
+        action = ConfAction.RESTART # unknown previous state, be conservative
+    else:
+        changed = {k for k in hashes.keys() | prev_hashes.keys() if hashes.get(k) != prev_hashes.get(k)}
+        log.info(f"cloud.conf sections changed: {sorted(changed)}")
+        action = ConfAction.RESTART if CLOUD_CONF_GLOBAL_SECTION in changed else ConfAction.RECONFIGURE
+
+    if hashes != prev_hashes:
+        hashes_file.write_text(json.dumps(hashes, indent=2))
+        util.chown_slurm(hashes_file, mode=0o644)
+    return action
 
 
-def install_slurm_conf(lkp: util.Lookup) -> None:
+def install_slurm_conf(lkp: util.Lookup) -> ConfAction:
     """install slurm.conf"""
     if lkp.cfg.ompi_version:
         mpi_default = "pmi2"
@@ -297,11 +356,10 @@ def install_slurm_conf(lkp: util.Lookup) -> None:
     conf = lkp.cfg.slurm_conf_tpl.format(**conf_options)
 
     conf_file = lkp.etc_dir / "slurm.conf"
-    conf_file.write_text(conf)
-    util.chown_slurm(conf_file, mode=0o644)
+    return ConfAction.RESTART if write_if_changed(conf_file, conf, mode=0o644) else ConfAction.NONE
 
 
-def install_slurmdbd_conf(lkp: util.Lookup) -> None:
+def install_slurmdbd_conf(lkp: util.Lookup) -> ConfAction:
     """install slurmdbd.conf"""
     conf_options = {
         "control_host": lkp.control_host,
@@ -336,36 +394,35 @@ def install_slurmdbd_conf(lkp: util.Lookup) -> None:
     conf = lkp.cfg.slurmdbd_conf_tpl.format(**conf_options)
 
     conf_file = lkp.etc_dir / "slurmdbd.conf"
-    conf_file.write_text(conf)
-    util.chown_slurm(conf_file, 0o600)
+    return ConfAction.RESTART if write_if_changed(conf_file, conf, mode=0o600) else ConfAction.NONE
 
 
-def install_cgroup_conf(lkp: util.Lookup) -> None:
+def install_cgroup_conf(lkp: util.Lookup) -> ConfAction:
     """install cgroup.conf"""
     conf_file = lkp.etc_dir / "cgroup.conf"
-    conf_file.write_text(lkp.cfg.cgroup_conf_tpl)
-    util.chown_slurm(conf_file, mode=0o600)
+    changed = write_if_changed(conf_file, lkp.cfg.cgroup_conf_tpl, mode=0o600)
+    return ConfAction.RESTART if changed else ConfAction.NONE
 
 
-def install_jobsubmit_lua(lkp: util.Lookup) -> None:
+def install_jobsubmit_lua(lkp: util.Lookup) -> ConfAction:
     """install job_submit.lua if there are tpu nodes in the cluster"""
     if not any(
         tpu_nodeset is not None
         for part in lkp.cfg.partitions.values()
         for tpu_nodeset in part.partition_nodeset_tpu
     ):
-        return # No TPU partitions, no need for job_submit.lua
+        return ConfAction.NONE # No TPU partitions, no need for job_submit.lua
 
     scripts_dir = lkp.cfg.slurm_scripts_dir or dirs.scripts
     tpl = (scripts_dir / "job_submit.lua.tpl").read_text()
     conf = tpl.format(scripts_dir=scripts_dir)
 
     conf_file = lkp.etc_dir / "job_submit.lua"
-    conf_file.write_text(conf)
-    util.chown_slurm(conf_file, 0o600)
+    changed = write_if_changed(conf_file, conf, mode=0o600)
+    return ConfAction.RECONFIGURE if changed else ConfAction.NONE
 
 
-def gen_cloud_gres_conf(lkp: util.Lookup) -> None:
+def gen_cloud_gres_conf(lkp: util.Lookup) -> ConfAction:
     """generate cloud_gres.conf"""
 
     gpu_nodes = defaultdict(list)
@@ -389,8 +446,8 @@ def gen_cloud_gres_conf(lkp: util.Lookup) -> None:
     content = FILE_PREAMBLE + "\n".join(lines)
 
     conf_file = lkp.etc_dir / "cloud_gres.conf"
-    conf_file.write_text(content)
-    util.chown_slurm(conf_file, mode=0o600)
+    changed = write_if_changed(conf_file, content, mode=0o600)
+    return ConfAction.RECONFIGURE if changed else ConfAction.NONE
 
 
 def install_gres_conf(lkp: util.Lookup) -> None:
@@ -440,10 +497,12 @@ class TopologySummary:
             physical_host: Optional[Dict[str, str]] = None,
             down_nodes: Optional[Iterable[str]] = None,
             tpu_nodes: Optional[Iterable[str]] = None,
+            conf_hash: str = "",
         ) -> None:
         self.physical_host = physical_host or {}
         self.down_nodes = set(down_nodes or [])
         self.tpu_nodes = set(tpu_nodes or [])
+        self.conf_hash = conf_hash # of rendered topology.conf
 
 
     @classmethod
@@ -457,6 +516,7 @@ class TopologySummary:
             physical_host=d.get("physical_host"),
             down_nodes=d.get("down_nodes"),
             tpu_nodes=d.get("tpu_nodes"),
+            conf_hash=d.get("conf_hash", ""),
         )
 
     @classmethod
@@ -472,6 +532,7 @@ class TopologySummary:
                 "physical_host": self.physical_host,
                 "down_nodes": list(self.down_nodes),
                 "tpu_nodes": list(self.tpu_nodes),
+                "conf_hash": self.conf_hash,
             },
             indent=2)
 
@@ -483,10 +544,12 @@ class TopologySummary:
 
     def requires_reconfigure(self, prev: "TopologySummary") -> bool:
         """
-        Reconfigure IFF one of the following occurs:
+        Reconfigure IFF rendered topology.conf changed and one of the following occurs:
         * A node is added
         * A node get a non-empty physicalHost
         """
+        if self.conf_hash and self.conf_hash == prev.conf_hash:
+            return False
         if len(self._nodenames() - prev._nodenames()) > 0:
             return True
         for n, ph in self.physical_host.items():
@@ -506,6 +569,26 @@ class TopologyBuilder:
             n = n.switches.setdefault(p, Switch(p))
         n.nodes = [*n.nodes, *nodes]
 
+    def remove(self, path: List[str], nodes: Set[str]) -> None:
+        """Removes nodes from switch, switches left without nodes and sub-switches are removed too"""
+        trail = [self._r]
+        for p in path:
+            if p not in trail[-1].switches:
+                return
+            trail.append(trail[-1].switches[p])
+        trail[-1].nodes = [n for n in trail[-1].nodes if n not in nodes]
+        for parent, sw in zip(reversed(trail[:-1]), reversed(trail[1:])):
+            if sw.nodes or sw.switches:
+                break
+            del parent.switches[sw.name]
+
+    @classmethod
+    def from_paths(cls, paths: Dict[str, Tuple[str, ...]]) -> "TopologyBuilder":
+        bldr = cls()
+        for path, nodes in _group_by_path(paths.items()).items():
+            bldr.add(list(path), nodes)
+        return bldr
+
     def render_conf_lines(self) -> Iterable[str]:
         if not self._r.switches:
             return [] # type: ignore
@@ -528,11 +611,97 @@ class TopologyBuilder:
         return compressed
 
 
+def _group_by_path(items: Iterable[Tuple[str, Tuple[str, ...]]]) -> Dict[Tuple[str, ...], List[str]]:
+    res: Dict[Tuple[str, ...], List[str]] = defaultdict(list)
+    for node, path in items:
+        res[path].append(node)
+    return res
+
+
+class _PathCollector(TopologyBuilder):
+    """Collects switch path of every node instead of building the tree"""
+    def __init__(self) -> None:
+        super().__init__()
+        self.paths: Dict[str, Tuple[str, ...]] = {}
+
+    def add(self, path: List[str], nodes: Iterable[str]) -> None:
+        p = tuple(path)
+        for n in nodes:
+            self.paths[n] = p
+
+
+class TopologyIndex:
+    """
+    Switch path of every node in (uncompressed) topology tree, as of the last rendered topology.conf.
+    Kept on disk, so only changed nodes are applied to the tree, and nothing is rendered
+    if no node got added, removed or moved.
+    """
+    def __init__(
+            self,
+            paths: Optional[Dict[str, Tuple[str, ...]]] = None,
+            tpu_hash: str = "",
+            conf_hash: str = "",
+            generation: int = 0,
+        ) -> None:
+        self.paths = paths or {}
+        self.tpu_hash = tpu_hash # of TPU nodesets config, TPU part of tree depends only on it
+        self.conf_hash = conf_hash
+        self.generation = generation
+
+    @classmethod
+    def path(cls, lkp: util.Lookup) -> Path:
+        return lkp.etc_dir / "cloud_topology.index.json"
+
+    @classmethod
+    def load(cls, lkp: util.Lookup) -> "TopologyIndex":
+        p = cls.path(lkp)
+        if not p.exists():
+            return cls()
+        try:
+            d = json.loads(p.read_text())
+            return cls(
+                paths={n: tuple(path) for n, path in d["paths"].items()},
+                tpu_hash=d["tpu_hash"],
+                conf_hash=d["conf_hash"],
+                generation=d["generation"],
+            )
+        except Exception:
+            log.exception(f"Failed to load {p}, topology will be regenerated")
+            return cls()
+
+    def dump(self, lkp: util.Lookup) -> None:
+        TopologyIndex.path(lkp).write_text(json.dumps({
+            "paths": self.paths,
+            "tpu_hash": self.tpu_hash,
+            "conf_hash": self.conf_hash,
+            "generation": self.generation,
+        }))
+
+    def apply(self, bldr: TopologyBuilder, paths: Dict[str, Tuple[str, ...]]) -> bool:
+        """Applies difference with `paths` to the tree built from this index, returns whether there was any"""
+        gone = [(n, p) for n, p in self.paths.items() if paths.get(n) != p]
+        new = [(n, p) for n, p in paths.items() if self.paths.get(n) != p]
+        for path, nodes in _group_by_path(gone).items():
+            bldr.remove(list(path), set(nodes))
+        for path, nodes in _group_by_path(new).items():
+            bldr.add(list(path), nodes)
+        if gone or new:
+            log.debug(f"topology changes: {len(gone)} nodes removed or moved, {len(new)} added or moved")
+        self.paths = paths
+        return bool(gone or new)
+
+
+# Tree of the last index generation, reused by long-running slurmsync
+_tree_cache: Dict[Path, Tuple[int, TopologyBuilder]] = {}
+
+
+_TPU_TOPO_ROOT = "tpu-root"
+
 def add_tpu_nodeset_topology(nodeset: NSDict, bldr: TopologyBuilder, lkp: util.Lookup):
     tpuobj = tpu.TPU.make(nodeset.nodeset_name, lkp)
     static, dynamic = lkp.nodenames(nodeset)
 
-    pref = ["tpu-root",  f"ns_{nodeset.nodeset_name}"]
+    pref = [_TPU_TOPO_ROOT, f"ns_{nodeset.nodeset_name}"]
     if tpuobj.vmcount == 1:  # Put all nodes in one switch
         all_nodes = list(chain(static, dynamic))
         bldr.add(pref, all_nodes)
@@ -596,23 +765,69 @@ def gen_topology(lkp: util.Lookup) -> TopologyBuilder:
         add_nodeset_topology(ns, bldr, lkp)
     return bldr
 
+def _tpu_hash(lkp: util.Lookup) -> str:
+    return hashlib.md5(json.dumps(lkp.cfg.nodeset_tpu, sort_keys=True, default=str).encode()).hexdigest()
+
+def _collect_paths(lkp: util.Lookup, index: TopologyIndex) -> _PathCollector:
+    """
+    Paths of all nodes, TPU ones are taken from index if their config didn't change.
+    NOTE: walks instances of every nodeset, only applying and rendering of the tree is incremental.
+    """
+    coll = _PathCollector()
+    if index.tpu_hash == _tpu_hash(lkp):
+        for n, p in index.paths.items():
+            if p[0] == _TPU_TOPO_ROOT:
+                coll.paths[n] = p
+                coll.summary.tpu_nodes.add(n)
+    else:
+        for ns in lkp.cfg.nodeset_tpu.values():
+            add_tpu_nodeset_topology(ns, coll, lkp)
+    for ns in lkp.cfg.nodeset.values():
+        add_nodeset_topology(ns, coll, lkp)
+    return coll
+
+def _render(topo: TopologyBuilder) -> str:
+    lines = [FILE_PREAMBLE + "\n"]
+    for line in topo.render_conf_lines():
+        lines.append(line)
+        lines.append("\n")
+    lines.append("\n")
+    return "".join(lines)
+
 def gen_topology_conf(lkp: util.Lookup) -> Tuple[bool, TopologySummary]:
     """
     Generates slurm topology.conf.
     Returns whether the topology.conf got updated.
+    Changes of node paths since the last run are applied to the tree,
+    topology.conf is only rendered if there are any.
     """
-    topo = gen_topology(lkp).compress()
     conf_file = lkp.etc_dir / "cloud_topology.conf"
-
-    with open(conf_file, "w") as f:
-        f.writelines(FILE_PREAMBLE + "\n")
-        for line in topo.render_conf_lines():
-            f.write(line)
-            f.write("\n")
-        f.write("\n")
-
+    index = TopologyIndex.load(lkp)
+    coll = _collect_paths(lkp, index)
+    summary = coll.summary
     prev_summary = TopologySummary.load(lkp)
-    return topo.summary.requires_reconfigure(prev_summary), topo.summary
+
+    tpu_hash = _tpu_hash(lkp)
+    # taken out while being changed, so the tree is rebuilt from index if render or write fails
+    gen, cached = _tree_cache.pop(conf_file, (-1, None))
+    if cached is None or gen != index.generation:
+        cached = TopologyBuilder.from_paths(index.paths)
+    changed = index.apply(cached, coll.paths)
+
+    if changed or not index.conf_hash or not conf_file.exists():
+        text = _render(cached.compress())
+        conf_hash = hashlib.sha256(text.encode()).hexdigest()
+        if conf_hash != index.conf_hash or not conf_file.exists():
+            conf_file.write_text(text)
+        index.conf_hash = conf_hash
+    if changed or index.tpu_hash != tpu_hash or not TopologyIndex.path(lkp).exists():
+        index.tpu_hash = tpu_hash
+        index.generation += 1
+        index.dump(lkp)
+    _tree_cache[conf_file] = (index.generation, cached)
+
+    summary.conf_hash = index.conf_hash
+    return summary.requires_reconfigure(prev_summary), summary
 
 def install_topology_conf(lkp: util.Lookup) -> None:
     conf_file = lkp.etc_dir / "cloud_topology.conf"
@@ -624,18 +839,28 @@ def install_topology_conf(lkp: util.Lookup) -> None:
 
     util.chown_slurm(conf_file, mode=0o600)
     util.chown_slurm(summary_file, mode=0o600)
+    util.chown_slurm(TopologyIndex.path(lkp), mode=0o600)
 
 
-def gen_controller_configs(lkp: util.Lookup) -> None:
-    install_slurm_conf(lkp)
-    install_slurmdbd_conf(lkp)
-    gen_cloud_conf(lkp)
-    gen_cloud_gres_conf(lkp)
+def gen_controller_configs(lkp: util.Lookup) -> ConfAction:
+    """
+    Generates all controller configs, only files with changed content get written.
+    Returns the lightest action that makes slurmctld pick up all changes.
+    """
+    actions = [
+        install_slurm_conf(lkp),
+        install_slurmdbd_conf(lkp),
+        gen_cloud_conf(lkp),
+        gen_cloud_gres_conf(lkp),
+        install_cgroup_conf(lkp),
+        install_jobsubmit_lua(lkp),
+    ]
     install_gres_conf(lkp)
-    install_cgroup_conf(lkp)
-    install_jobsubmit_lua(lkp)
 
     if topology_plugin(lkp) == TOPOLOGY_PLUGIN_TREE:
-        _, summary = gen_topology_conf(lkp)
+        updated, summary = gen_topology_conf(lkp)
         summary.dump(lkp)
         install_topology_conf(lkp)
+        if updated:
+            actions.append(ConfAction.RECONFIGURE)
+    return max(actions)
@@ -12,10 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any
+from typing import Any, Callable, Iterator, Optional, Set
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import timedelta
 from pathlib import Path
+from time import time
+import fcntl
+import json
+import os
 import shutil
 import pickle
+import threading
 
 import logging
 log = logging.getLogger()
@@ -26,8 +35,16 @@ def _chown_slurm(path: Path) -> None:
     shutil.chown(path, user="slurm", group="slurm")
 
 class FileCache:
+    FILE_MODE = 0o666 # before umask
+
     def __init__(self, path: Path):
         self.path = path
+
+    def _load(self, f) -> Any:
+        return pickle.load(f)
+
+    def _dump(self, data: Any, f) -> None:
+        pickle.dump(data, f)
     
     def get(self, key: str) -> Any | None:
         p = self.path / key
@@ -36,7 +53,7 @@ class FileCache:
         
         try:
             with p.open("rb") as f:
-                return pickle.load(f)
+                return self._load(f)
             
         except Exception as e:
             log.warning(f"Failed to read cached value at {p}: {e}")
@@ -44,28 +61,73 @@ class FileCache:
         
     def set(self, key: str, data: Any) -> None:
         p = self.path / key
+        # Write to temporary file first then perform atomic move,
+        # so concurrent readers (e.g. resume & slurmsync) never see partial writes.
+        tmp = self.path / f".{key}.{os.getpid()}.tmp"
         
         try:
             # Create & chown before writing to minimize chances
             # of ending up with root-owned corrupted file that can't be cleaned up
             # TODO: restrict usage of cache by root to avoid all this complexity
             # or have a cache per user.
-            p.touch(exist_ok=True)
-            _chown_slurm(p)
-            with p.open("wb") as f:
-                pickle.dump(data, f)
+            os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT, self.FILE_MODE))
+            _chown_slurm(tmp)
+            with tmp.open("wb") as f:
+                self._dump(data, f)
+            tmp.replace(p)
             
         except Exception as e:
             log.warning(f"Failed to write cached value at {p}: {e}")
+            tmp.unlink(missing_ok=True)
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """Exclusive lock of `key` across processes, for read-modify-write of its value"""
+        p = self.path / f".{key}.lock"
+        fd = os.open(p, os.O_RDWR | os.O_CREAT, 0o664)
+        try:
+            try:
+                _chown_slurm(p)
+            except Exception:
+                pass # lock works regardless, file is only created once
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd) # releases lock
     
 
+class PrivateFileCache(FileCache):
+    """
+    Cache for data that root-run scripts (setup, slurmsync) trust, e.g. config.
+    Lives in slurm-owned directory, so unprivileged users can't plant or read entries,
+    and stores values as JSON, so a tampered entry is bad data rather than code.
+    """
+    FILE_MODE = 0o600
+
+    def _load(self, f) -> Any:
+        return json.load(f)
+
+    def _dump(self, data: Any, f) -> None:
+        f.write(json.dumps(data).encode())
+
+
 class NoCache:
+    _warned = False
+
+    def _warn(self) -> None:
+        if not NoCache._warned: # reason is logged by `cache`, don't flood the log
+            NoCache._warned = True
+            log.warning("No cache used")
+
     def get(self, key: str) -> Any:
-        log.warning("No cache used")
+        self._warn()
         return None
     
     def set(self, key: str, data: Any) -> None:
-        log.warning("No cache used")
+        self._warn()
+
+    def lock(self, key: str):
+        return nullcontext()
 
 
 def cache(name: str) -> FileCache | NoCache:
@@ -78,3 +140,89 @@ def cache(name: str) -> FileCache | NoCache:
     except:
         log.exception(f"Failed to create cache, fallback to NoCache")
         return NoCache()
+
+
+def private_cache(path: Path) -> PrivateFileCache | NoCache:
+    """`path` is expected to be under slurm-owned directory, e.g. `slurmdirs.state`"""
+    try:
+        if not path.exists():
+            path.mkdir(mode=0o700, parents=True)
+            _chown_slurm(path)
+        return PrivateFileCache(path)
+    except:
+        log.exception(f"Failed to create cache, fallback to NoCache")
+        return NoCache()
+
+
+@dataclass(frozen=True)
+class _Entry:
+    version: str
+    created: float # unix time
+    value: Any
+
+
+# Revalidates stale entries in background, its threads are joined on interpreter exit,
+# so refresh started by short-living script (e.g. resume) is not lost.
+_revalidator: Optional[Executor] = None
+_revalidator_lock = threading.Lock()
+
+
+def _revalidate_executor() -> Executor:
+    global _revalidator
+    with _revalidator_lock:
+        if _revalidator is None:
+            _revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix="revalidate")
+        return _revalidator
+
+
+class VersionedCache:
+    """
+    Values tagged with `version` they were produced for (e.g. hash of config),
+    entries of other versions are ignored.
+    Entries older than `ttl` are returned as is while refetched in background
+    (stale-while-revalidate), entries older than `max_stale` are refetched in place.
+    """
+    def __init__(self, cache: FileCache | NoCache, version: str, ttl: timedelta, max_stale: timedelta) -> None:
+        self._cache = cache
+        self.version = version
+        self.ttl = ttl.total_seconds()
+        self.max_stale = max(ttl, max_stale).total_seconds()
+        self._revalidating: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        entry = self._cache.get(key)
+        if isinstance(entry, _Entry) and entry.version == self.version:
+            age = time() - entry.created
+            if 0 <= age < self.ttl:
+                return entry.value
+            if 0 <= age < self.max_stale:
+                self._revalidate(key, fetch)
+                return entry.value
+        return self._fetch(key, fetch)
+
+    def _fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        value = fetch()
+        self._cache.set(key, _Entry(version=self.version, created=time(), value=value))
+        return value
+
+    def _revalidate(self, key: str, fetch: Callable[[], Any]) -> None:
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run() -> None:
+            try:
+                self._fetch(key, fetch)
+            except Exception:
+                log.warning(f"Failed to revalidate cached {key}, keep using stale value", exc_info=True)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        try:
+            _revalidate_executor().submit(run)
+        except RuntimeError: # interpreter is shutting down
+            with self._lock:
+                self._revalidating.discard(key)
@@ -0,0 +1,96 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Expansion of Slurm hostlist expressions without invoking `scontrol`.
+
+Supports the subset of syntax produced by Slurm and `util.to_hostlist`:
+* comma separated hosts: `a1,b2`
+* bracketed ranges and lists: `node-[1-3,7]`
+* zero padding, width of range is taken from its lower bound: `node-[008-010]`
+* multiple bracket groups per host (cartesian product): `r[1-2]-n[01-02]`
+
+NOTE: Only depends on standard library, since it's used by `sort_nodes.py`.
+"""
+
+from typing import Iterator, List
+import re
+
+_GROUP = re.compile(r"\[([^\[\]]*)\]")
+
+
+def _split_hosts(hostlist: str) -> Iterator[str]:
+    """Splits expression by commas that are not enclosed in brackets"""
+    depth, start = 0, 0
+    for i, c in enumerate(hostlist):
+        if c == "[":
+            depth += 1
+            if depth > 1:
+                raise ValueError(f"Nested brackets in hostlist: '{hostlist}'")
+        elif c == "]":
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f"Unbalanced brackets in hostlist: '{hostlist}'")
+        elif c == "," and depth == 0:
+            if i > start:
+                yield hostlist[start:i]
+            start = i + 1
+    if depth != 0:
+        raise ValueError(f"Unbalanced brackets in hostlist: '{hostlist}'")
+    if len(hostlist) > start:
+        yield hostlist[start:]
+
+
+def _expand_ranges(spec: str) -> Iterator[str]:
+    """Expands content of brackets, e.g. `01-03,7` -> 01, 02, 03, 7"""
+    for r in spec.split(","):
+        lo, sep, hi = r.partition("-")
+        if not lo.isdigit() or (sep and not hi.isdigit()):
+            raise ValueError(f"Invalid range in hostlist: '[{spec}]'")
+        if not sep:
+            yield lo
+            continue
+        width = len(lo)
+        if int(hi) < int(lo):
+            raise ValueError(f"Invalid range in hostlist: '[{spec}]'")
+        for n in range(int(lo), int(hi) + 1):
+            yield f"{n:0{width}d}"
+
+
+def _expand_host(pattern: str) -> Iterator[str]:
+    # literal, group, literal, group, ..., literal
+    parts = _GROUP.split(pattern)
+
+    def gen(i: int, acc: str) -> Iterator[str]:
+        acc += parts[i]
+        if i == len(parts) - 1:
+            yield acc
+            return
+        for s in _expand_ranges(parts[i + 1]):
+            yield from gen(i + 2, acc + s)
+
+    return gen(0, "")
+
+
+def expand(hostlist: str) -> Iterator[str]:
+    """
+    Lazily yields hostnames of hostlist expression, in order of the expression,
+    behaves as `scontrol show hostnames`.
+    """
+    for pattern in _split_hosts(hostlist.strip()):
+        yield from _expand_host(pattern)
+
+
+def to_hostnames(hostlist: str) -> List[str]:
+    return list(expand(hostlist))
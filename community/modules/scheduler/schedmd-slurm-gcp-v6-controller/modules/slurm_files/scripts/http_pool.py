@@ -0,0 +1,129 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pool of keep-alive HTTP connections for `googleapiclient` requests.
+
+`httplib2.Http` is not thread-safe, so previously every request got its own
+`Http` and paid for TCP and TLS handshake. Pool hands out every `Http`
+to one request at a time, and takes it back once response is received,
+so connections are reused by subsequent requests from any thread.
+"""
+
+from typing import Any, Callable, Iterator, List, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from urllib.parse import urlsplit
+import threading
+
+import httplib2
+import google_auth_httplib2 # type: ignore
+from googleapiclient.http import set_user_agent # type: ignore
+
+import logging
+log = logging.getLogger()
+
+
+@dataclass
+class PoolStats:
+    created: int = 0 # `Http` objects created
+    discarded: int = 0 # `Http` objects closed after failed request
+    requests: int = 0
+    reused: int = 0 # requests sent over already open connection
+
+
+class HttpPool:
+    # Max number of idle `Http` kept open, roughly max concurrency of requests
+    MAX_IDLE = 32
+
+    def __init__(self, factory: Callable[[], Any], max_idle: Optional[int] = None) -> None:
+        self._factory = factory
+        self._max_idle = max_idle or self.MAX_IDLE
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self._stats = PoolStats()
+
+    @classmethod
+    def authorized(cls, credentials: Any, user_agent: str) -> "HttpPool":
+        def factory() -> Any:
+            http = set_user_agent(httplib2.Http(), user_agent)
+            if credentials is not None:
+                http = google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+            return http
+        return cls(factory)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(**asdict(self._stats))
+
+    @contextmanager
+    def checkout(self, uri: str) -> Iterator[Any]:
+        with self._lock:
+            http = self._idle.pop() if self._idle else None
+            self._stats.requests += 1
+            if http is None:
+                self._stats.created += 1
+            elif _has_open_connection(http, uri):
+                self._stats.reused += 1
+        if http is None:
+            http = self._factory()
+
+        try:
+            yield http
+        except Exception:
+            # connection may be left in broken state, don't reuse it
+            _close(http)
+            with self._lock:
+                self._stats.discarded += 1
+            raise
+
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(http)
+                return
+        _close(http)
+
+
+class PooledHttp:
+    """
+    Stands for `httplib2.Http` in `googleapiclient.http.HttpRequest`,
+    every request is sent through `Http` checked out from the pool.
+    """
+    def __init__(self, pool: HttpPool, credentials: Any = None) -> None:
+        self._pool = pool
+        # used by `googleapiclient` to authorize requests in batches
+        self.credentials = credentials
+
+    def request(self, uri: str, *args, **kwargs) -> Any:
+        with self._pool.checkout(uri) as http:
+            return http.request(uri, *args, **kwargs)
+
+
+def _connections(http: Any) -> dict:
+    return getattr(http, "connections", None) or {}
+
+
+def _has_open_connection(http: Any, uri: str) -> bool:
+    # `httplib2.Http` keys connections by "<scheme>:<authority>"
+    parts = urlsplit(uri)
+    conn = _connections(http).get(f"{parts.scheme}:{parts.netloc}")
+    return conn is not None and getattr(conn, "sock", None) is not None
+
+
+def _close(http: Any) -> None:
+    for conn in list(_connections(http).values()):
+        try:
+            conn.close()
+        except Exception:
+            log.debug("failed to close connection", exc_info=True)
@@ -13,13 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, Callable, Any
+from typing import Dict, Callable, Any, Iterable, Iterator, List, Optional, Set, Tuple
 import argparse
+import hashlib
+import json
 import os
 import shelve
+import sqlite3
+import tempfile
 import uuid
-from collections import namedtuple
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from pprint import pprint
 
@@ -37,6 +44,13 @@ timestamp_file = Path(os.environ.get("TIMESTAMP_FILE", DEFAULT_TIMESTAMP_FILE))
 # The maximum request to insert_rows is 10MB, each sacct row is about 1200 bytes or ~ 8000 rows.
 # Set to 5000 for a little wiggle room.
 BQ_ROW_BATCH_SIZE = 5000
+# Load jobs have a daily quota per table rather than a request size limit, so batch more rows per job.
+BQ_LOAD_JOB_BATCH_SIZE = 100_000
+# Time window is split into shards of at least SACCT_SHARD, at most SACCT_MAX_SHARDS of them,
+# `sacct` of up to SACCT_PARALLELISM shards runs concurrently.
+SACCT_SHARD = timedelta(days=1)
+SACCT_MAX_SHARDS = 64
+SACCT_PARALLELISM = 4
 
 # cluster_id_file = script.parent / 'cluster_uuid'
 # try:
@@ -45,7 +59,11 @@ BQ_ROW_BATCH_SIZE = 5000
 # cluster_id = uuid.uuid4().hex
 # cluster_id_file.write_text(cluster_id)
 
+job_idx_db_path = script.parent / "bq_job_idx.sqlite3"
+# shelve based cache used by earlier versions, migrated into `job_idx_db_path`
 job_idx_cache_path = script.parent / "bq_job_idx_cache"
+# time window overlaps the previous one by that much, jobs reported again are filtered out by the job index
+WINDOW_OVERLAP = timedelta(minutes=10)
 
 SLURM_TIME_FORMAT = r"%Y-%m-%dT%H:%M:%S"
 
@@ -178,20 +196,14 @@ job_schema = {field.name: field for field in schema_fields}
 Job = namedtuple("Job", job_schema.keys()) # type: ignore 
 # ... see https://github.com/python/mypy/issues/848
 
-client = bq.Client(
-    project=lookup().cfg.project,
-    credentials=util.default_credentials(),
-    client_options=util.create_client_options(util.ApiEndpoint.BQ),
-)
-dataset_id = f"{lookup().cfg.slurm_cluster_name}_job_data"
-dataset = bq.DatasetReference(project=lookup().project, dataset_id=dataset_id)
-table = bq.Table(
-    bq.TableReference(dataset, f"jobs_{lookup().cfg.slurm_cluster_name}"), schema_fields
-)
-
 
-class JobInsertionFailed(Exception):
-    pass
+@lru_cache(maxsize=1)
+def client() -> bq.Client:
+    return bq.Client(
+        project=lookup().cfg.project,
+        credentials=util.default_credentials(),
+        client_options=util.create_client_options(util.ApiEndpoint.BQ),
+    )
 
 
 def make_job_row(job):
@@ -200,13 +212,15 @@ def make_job_row(job):
         for field_name, field in job_schema.items()
         if field_name in job
     }
-    job_row["entry_uuid"] = uuid.uuid4().hex
+    # same row gets same entry_uuid when submitted again, used to not insert it twice
+    job_row["entry_uuid"] = uuid.uuid5(
+        uuid.NAMESPACE_URL, f"slurm-gcp://{lookup().cfg.cluster_id}/jobs/{job['job_db_uuid']}").hex
     job_row["cluster_id"] = lookup().cfg.cluster_id
     job_row["cluster_name"] = lookup().cfg.slurm_cluster_name
     return job_row
 
 
-def load_slurm_jobs(start, end):
+def sacct_cmd(start: datetime, end: datetime) -> str:
     states = ",".join(
         (
             "BOOT_FAIL",
@@ -226,62 +240,296 @@ def load_slurm_jobs(start, end):
     end_iso = end.isoformat(timespec="seconds")
     # slurm_fields and bq_fields will be in matching order
     slurm_fields = ",".join(slurm_field_map.values())
-    bq_fields = slurm_field_map.keys()
-    cmd = (
+    return (
         f"{SACCT} --start {start_iso} --end {end_iso} -X -D --format={slurm_fields} "
         f"--state={states} --parsable2 --noheader --allusers --duplicates"
     )
-    text = run(cmd).stdout.splitlines()
-    # zip pairs bq_fields with the value from sacct
-    jobs = [dict(zip(bq_fields, line.split("|"))) for line in text]
-
-    # The job index cache allows us to avoid sending duplicate jobs. This avoids a race condition with updating the database.
-    with shelve.open(str(job_idx_cache_path), flag="r") as job_idx_cache:
-        job_rows = [
-            make_job_row(job)
-            for job in jobs
-            if str(job["job_db_uuid"]) not in job_idx_cache
-        ]
-    return job_rows
-
-
-def init_table():
-    global dataset
-    global table
-    dataset = client.create_dataset(dataset, exists_ok=True) # type: ignore
-    table = client.create_table(table, exists_ok=True)
+
+
+def shard_window(start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    """Splits time window into consecutive shards"""
+    step = max(SACCT_SHARD, (end - start) / SACCT_MAX_SHARDS)
+    shards = []
+    while start < end:
+        shards.append((start, min(start + step, end)))
+        start += step
+    return shards
+
+
+def _spool_sacct(start: datetime, end: datetime):
+    """Runs sacct for the shard, output is spooled to a temporary file to not hold it in memory"""
+    out = tempfile.TemporaryFile(mode="w+")
+    try:
+        run(sacct_cmd(start, end), stdout=out)
+    except Exception:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def stream_jobs(shards: List[Tuple[datetime, datetime]]) -> Iterator[Tuple[datetime, Optional[Dict[str, str]]]]:
+    """
+    Yields `(shard end, job)` for jobs of shards in order, each shard is followed by `(shard end, None)`.
+    sacct of next shards runs concurrently with consumption of the current one.
+    """
+    bq_fields = list(slurm_field_map.keys())
+    with ThreadPoolExecutor(max_workers=SACCT_PARALLELISM) as exe:
+        pending: deque[Tuple[datetime, Future]] = deque()
+        queued = iter(shards)
+        try:
+            for start, end in queued:
+                pending.append((end, exe.submit(_spool_sacct, start, end)))
+                if len(pending) >= SACCT_PARALLELISM:
+                    break
+            while pending:
+                end, fut = pending.popleft()
+                if (nxt := next(queued, None)) is not None:
+                    pending.append((nxt[1], exe.submit(_spool_sacct, *nxt)))
+                with fut.result() as out:
+                    for line in out:
+                        # zip pairs bq_fields with the value from sacct
+                        yield end, dict(zip(bq_fields, line.rstrip("\n").split("|")))
+                yield end, None
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+                if not fut.cancelled() and fut.exception() is None:
+                    fut.result().close()
+
+
+def init_table() -> bq.Table:
+    dataset_id = f"{lookup().cfg.slurm_cluster_name}_job_data"
+    dataset = bq.DatasetReference(project=lookup().project, dataset_id=dataset_id)
+    table = bq.Table(
+        bq.TableReference(dataset, f"jobs_{lookup().cfg.slurm_cluster_name}"), schema_fields
+    )
+    client().create_dataset(dataset, exists_ok=True)
+    table = client().create_table(table, exists_ok=True)
     until_found = retry.Retry(predicate=retry.if_exception_type(exceptions.NotFound))
-    table = client.get_table(table, retry=until_found)
+    table = client().get_table(table, retry=until_found)
     # cannot add required fields to an existing schema
     table.schema = schema_fields
-    table = client.update_table(table, ["schema"])
+    return client().update_table(table, ["schema"])
+
+
+class JobIndex:
+    """
+    Index of submitted jobs (by `job_db_uuid`) in SQLite, lookups and inserts
+    are done per batch of jobs, and expired entries are purged by indexed range delete.
+    Each entry is stamped with the end of time window the job was reported in,
+    so it's kept as long as windows starting before that stamp can report the job again.
+    """
+    # keep number of bound parameters well under SQLITE_MAX_VARIABLE_NUMBER
+    QUERY_CHUNK = 500
+
+    def __init__(self, path: Path) -> None:
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_db_uuid TEXT PRIMARY KEY, reported REAL NOT NULL) WITHOUT ROWID")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_reported ON jobs (reported)")
+
+    def __enter__(self) -> "JobIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._conn.close()
+
+    def known(self, job_idxs: Iterable[str]) -> Set[str]:
+        """Subset of `job_idxs` that was already submitted"""
+        res: Set[str] = set()
+        for chunk in util.chunked(job_idxs, self.QUERY_CHUNK):
+            marks = ",".join("?" * len(chunk))
+            rows = self._conn.execute(f"SELECT job_db_uuid FROM jobs WHERE job_db_uuid IN ({marks})", chunk)
+            res.update(r[0] for r in rows)
+        return res
+
+    def add(self, job_idxs: Iterable[str], stamp: datetime) -> None:
+        ts = stamp.timestamp()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO jobs (job_db_uuid, reported) VALUES (?, ?)",
+                ((idx, ts) for idx in job_idxs))
+
+    def purge(self, before: datetime) -> int:
+        """Deletes entries of jobs that can't be reported by time window starting at `before`"""
+        with self._conn:
+            return self._conn.execute("DELETE FROM jobs WHERE reported < ?", (before.timestamp(),)).rowcount
+
+
+def _migrate_job_idx_cache(index: JobIndex) -> None:
+    """Moves entries of shelve based cache into `index`"""
+    files = list(job_idx_cache_path.parent.glob(f"{job_idx_cache_path.name}*"))
+    if not files:
+        return
+    try:
+        with shelve.open(str(job_idx_cache_path), flag="r") as cache:
+            by_stamp: Dict[datetime, List[str]] = {}
+            for idx, stamp in cache.items():
+                by_stamp.setdefault(stamp, []).append(idx)
+        for stamp, idxs in by_stamp.items():
+            index.add(idxs, stamp)
+        print(f"migrated {sum(map(len, by_stamp.values()))} entries of {job_idx_cache_path}")
+    except Exception as e:
+        print(f"failed to migrate {job_idx_cache_path}, dropping it: {e}")
+    for f in files:
+        f.unlink()
+
+
+def open_job_index() -> JobIndex:
+    index = JobIndex(job_idx_db_path)
+    _migrate_job_idx_cache(index)
+    return index
+
+
+RowErrors = List[Tuple[Dict[str, Any], Any]]
+
 
+class SubmitBackend(ABC):
+    """Writes batches of job rows to the table"""
 
-def purge_job_idx_cache():
-    purge_time = datetime.now() - timedelta(minutes=30)
-    with shelve.open(str(job_idx_cache_path), writeback=True) as cache:
-        to_delete = []
-        for idx, stamp in cache.items():
-            if stamp < purge_time:
-                to_delete.append(idx)
-        for idx in to_delete:
-            del cache[idx]
+    @property
+    def batch_size(self) -> int:
+        return BQ_ROW_BATCH_SIZE
 
+    @abstractmethod
+    def submit(self, table, rows: List[Dict[str, Any]]) -> RowErrors:
+        """
+        Writes rows, returns rejected rows with their errors, the rest of rows is written.
+        Raises if nothing could be written, e.g. table is not found.
+        """
 
-def bq_submit(jobs):
+
+class StreamingBackend(SubmitBackend):
+    """Streaming inserts, `entry_uuid` is used as insert id for best-effort deduplication"""
+
+    def submit(self, table, rows: List[Dict[str, Any]]) -> RowErrors:
+        errors = client().insert_rows(
+            table, rows, row_ids=[r["entry_uuid"] for r in rows], skip_invalid_rows=True)
+        return [(rows[e["index"]], e["errors"]) for e in errors]
+
+
+class LoadJobBackend(SubmitBackend):
+    """
+    Load jobs of newline-delimited JSON staged in a local file. Unlike streaming inserts,
+    load jobs are free and are committed atomically. Each batch is loaded into its own staging table,
+    which is merged into the table on `entry_uuid`, so every row is written once, even if it's
+    submitted again in another batch (e.g. after failure to record it as submitted).
+    Invalid rows are skipped by the load job and reported from its errors.
+    """
+    # staging tables left behind by failed runs are dropped by BigQuery
+    STAGING_TTL = timedelta(days=1)
+    MERGE = (
+        "MERGE `{table}` T USING `{staging}` S ON T.entry_uuid = S.entry_uuid "
+        "WHEN NOT MATCHED THEN INSERT ROW"
+    )
+
+    @property
+    def batch_size(self) -> int:
+        return BQ_LOAD_JOB_BATCH_SIZE
+
+    @staticmethod
+    def job_id(rows: List[Dict[str, Any]]) -> str:
+        digest = hashlib.sha256("\n".join(sorted(r["entry_uuid"] for r in rows)).encode()).hexdigest()
+        return f"slurm_job_data_{lookup().cfg.slurm_cluster_name}_{digest[:40]}"
+
+    @staticmethod
+    def _json_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        # DATETIME columns take civil time, without offset
+        return {
+            k: v.replace(tzinfo=None).isoformat() if isinstance(v, datetime) else v
+            for k, v in row.items()
+        }
+
+    @staticmethod
+    def _run(job_id: str, start: Callable[[str], Any]) -> Any:
+        """
+        Runs job started by `start(job_id)`, or waits for the one already submitted with this id.
+        Job that already failed is not picked up again, it's retried with suffixed id instead.
+        """
+        attempt = 0
+        while True:
+            jid = f"{job_id}_{attempt}" if attempt else job_id
+            job: Any
+            try:
+                job = start(jid)
+            except exceptions.Conflict:
+                job = client().get_job(jid)
+                if job.done() and job.error_result:
+                    print(f"job {jid} was already submitted and failed: {job.error_result}")
+                    attempt += 1
+                    continue
+                print(f"job {jid} was already submitted")
+            job.result() # raises if job failed
+            return job
+
+    def submit(self, table, rows: List[Dict[str, Any]]) -> RowErrors:
+        if not rows:
+            return []
+        job_id = self.job_id(rows)
+        dataset = bq.DatasetReference(table.project, table.dataset_id)
+        staging = bq.Table(bq.TableReference(dataset, job_id), schema_fields)
+        staging.expires = datetime.now(timezone.utc) + self.STAGING_TTL
+        client().create_table(staging, exists_ok=True)
+
+        config = bq.LoadJobConfig(
+            source_format=bq.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bq.WriteDisposition.WRITE_TRUNCATE,
+            schema=schema_fields,
+            max_bad_records=len(rows),
+        )
+        with tempfile.TemporaryFile() as staged:
+            for row in rows:
+                staged.write(json.dumps(self._json_row(row)).encode() + b"\n")
+            load = self._run(f"{job_id}_load", lambda jid: client().load_table_from_file(
+                staged, staging, rewind=True, job_id=jid, job_config=config))
+        errors: RowErrors = []
+        if load.errors:
+            loaded = {r["entry_uuid"] for r in client().list_rows(staging, selected_fields=[job_schema["entry_uuid"]])}
+            errors = [(row, load.errors) for row in rows if row["entry_uuid"] not in loaded]
+
+        merge = self.MERGE.format(
+            table=f"{table.project}.{table.dataset_id}.{table.table_id}",
+            staging=f"{staging.project}.{staging.dataset_id}.{staging.table_id}")
+        self._run(f"{job_id}_merge", lambda jid: client().query(merge, job_id=jid))
+        client().delete_table(staging, not_found_ok=True)
+        return errors
+
+
+SUBMIT_BACKENDS: Dict[str, Callable[[], SubmitBackend]] = {
+    "streaming": StreamingBackend,
+    "load_job": LoadJobBackend,
+}
+
+
+def submit_backend() -> SubmitBackend:
+    """Backend selected by `bigquery_load_backend` in config, streaming inserts by default"""
+    name = lookup().cfg.bigquery_load_backend or "streaming"
+    if name not in SUBMIT_BACKENDS:
+        raise ValueError(f"unknown bigquery_load_backend '{name}', expected one of {list(SUBMIT_BACKENDS)}")
+    return SUBMIT_BACKENDS[name]()
+
+
+def bq_submit(backend: SubmitBackend, table, jobs) -> List[Dict[str, Any]]:
+    """Submits rows, returns the accepted ones"""
     try:
-        result = client.insert_rows(table, jobs)
+        errors = backend.submit(table, jobs)
     except exceptions.NotFound as e:
         print(f"failed to upload job data, table not yet found: {e}")
         raise e
     except Exception as e:
         print(f"failed to upload job data: {e}")
         raise e
-    if result:
-        pprint(jobs)
-        pprint(result)
-        raise JobInsertionFailed("failed to upload job data to big query")
-    print(f"successfully loaded {len(jobs)} jobs")
+    if errors:
+        # rejected rows won't get better on retry, don't hold back the rest
+        print(f"failed to upload {len(errors)} of {len(jobs)} jobs:")
+        pprint(errors)
+    rejected = {id(row) for row, _ in errors}
+    print(f"successfully loaded {len(jobs) - len(rejected)} jobs")
+    return [row for row in jobs if id(row) not in rejected]
 
 
 def get_time_window():
@@ -291,8 +539,8 @@ def get_time_window():
         timestamp = datetime.strptime(
             timestamp_file.read_text().rstrip(), SLURM_TIME_FORMAT
         )
-        # time window will overlap the previous by 10 minutes. Duplicates will be filtered out by the job_idx_cache
-        start = timestamp - timedelta(minutes=10)
+        # time window will overlap the previous by 10 minutes. Duplicates will be filtered out by the job index
+        start = timestamp - WINDOW_OVERLAP
     except ValueError:
         # timestamp 1 is 1 second after the epoch; timestamp 0 is special for sacct
         start = datetime.fromtimestamp(1)
@@ -305,34 +553,67 @@ def write_timestamp(time):
     timestamp_file.write_text(time.isoformat(timespec="seconds"))
 
 
-def update_job_idx_cache(jobs, timestamp):
-    with shelve.open(str(job_idx_cache_path), writeback=True) as job_idx_cache:
-        for job in jobs:
-            job_idx = str(job["job_db_uuid"])
-            job_idx_cache[job_idx] = timestamp
+def load_slurm_jobs(backend: SubmitBackend, table, start: datetime, end: datetime) -> int:
+    """
+    Streams jobs finished in the time window to BigQuery in batches of `backend.batch_size`,
+    returns number of loaded jobs.
+    After every batch, submitted jobs are recorded in the job index and timestamp file
+    is moved to the end of the last shard which is fully submitted, so interrupted
+    backfill resumes from there without sending duplicates.
+    """
+    shards = shard_window(start, end)
+    print(f"loading jobs from {start} to {end} in {len(shards)} shards")
+    loaded = 0
+    checkpoint: Optional[datetime] = None # end of the last shard that is fully read
+    batch: Dict[str, Dict[str, str]] = {} # job_db_uuid -> job
+
+    # The job index allows us to avoid sending duplicate jobs. This avoids a race condition with updating the database.
+    with open_job_index() as job_index:
+        def submit(reported: datetime) -> None:
+            nonlocal loaded
+            for job_idx in job_index.known(batch):
+                del batch[job_idx]
+            if batch:
+                accepted = bq_submit(backend, table, [make_job_row(job) for job in batch.values()])
+                # rejected jobs are not retried either
+                job_index.add(batch, reported)
+                loaded += len(accepted)
+                batch.clear()
+            if checkpoint:
+                write_timestamp(checkpoint)
+
+        for shard_end, job in stream_jobs(shards):
+            if job is None:
+                checkpoint = shard_end
+                if not batch:
+                    write_timestamp(checkpoint)
+                continue
+            # adjacent shards may both report jobs running across their boundary
+            batch[str(job["job_db_uuid"])] = job
+            if len(batch) >= backend.batch_size:
+                submit(shard_end)
+        if batch:
+            submit(end)
+    write_timestamp(end)
+    return loaded
 
 
 def main():
     if not lookup().cfg.enable_bigquery_load:
         print("bigquery load is not currently enabled")
         exit(0)
-    init_table()
-
     start, end = get_time_window()
-    jobs = load_slurm_jobs(start, end)
-    # on failure, an exception will cause the timestamp not to be rewritten. So
-    # it will try again next time. If some writes succeed, we don't currently
-    # have a way to not submit duplicates next time.
-    if jobs:
-        num_batches = (len(jobs) - 1) // BQ_ROW_BATCH_SIZE + 1
-        print(
-            f"loading {num_batches} batches of BigQuery data in batches of size : {BQ_ROW_BATCH_SIZE}"
-        )
-        for batch_indx, job_indx in enumerate(range(0, len(jobs), BQ_ROW_BATCH_SIZE)):
-            print(f"loading BigQuery data batch {batch_indx} of {num_batches}")
-            bq_submit(jobs[job_indx : job_indx + BQ_ROW_BATCH_SIZE])
-    write_timestamp(end)
-    update_job_idx_cache(jobs, end)
+    # keep jobs of the whole window, it may resume from the middle of a long backfill shard
+    with open_job_index() as job_index:
+        job_index.purge(start)
+    backend = submit_backend()
+    table = init_table()
+
+    # on failure, an exception will cause the timestamp not to be moved past the
+    # last fully submitted shard, so it will try again next time from there.
+    # Jobs submitted since then are filtered out by the job index.
+    loaded = load_slurm_jobs(backend, table, start, end)
+    print(f"loaded {loaded} jobs")
 
 
 parser = argparse.ArgumentParser(description="submit slurm job data to big query")
@@ -344,7 +625,6 @@ parser.add_argument(
     help="specify timestamp file for reading and writing the time window start. Precedence over TIMESTAMP_FILE env var.",
 )
 
-purge_job_idx_cache()
 if __name__ == "__main__":
     args = parser.parse_args()
     if args.timestamp_file:
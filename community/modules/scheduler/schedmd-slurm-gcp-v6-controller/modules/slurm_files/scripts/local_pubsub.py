@@ -19,29 +19,47 @@ Implementation of message queue that mimics interface of GCP (PubSub)[https://cl
 Messages are stored on controller state disk (to survive controller re-creation) with following layout:
 
 /<controller_state_disk_mount>/<pubsub_folder>
-├- <TOPIC>
-|  └- <MESSAGE_ID>
-└- .staging
-   └- <TOPIC>
-      └- <MESSAGE_ID>
-
-One message is one immutable file, that will be deleted after acknowledgement.
-NOTE: Implementation assumes that both `<TOPIC>` and `.staging/<TOPIC>` are on the same disk device,
-so it can rely on atomic "move / rename" operation.
+└- <TOPIC>
+   ├- segment-<FIRST_OFFSET>.log  # append-only, one message per line
+   ├- .acks                       # acknowledgement state of subscription
+   └- .lock
+
+Every message gets next offset of the topic, its id is the zero-padded offset.
+Publishers append whole batch of messages with a single write and one `fsync` under `flock`,
+a line is visible to subscriber only once it's complete (terminated by newline),
+so, as with previous one-file-per-message layout, partial writes are never read.
+Torn tail left by crashed publisher is truncated by the next one.
+
+Subscription keeps "watermark" (all messages below it are acked), position in segment to
+resume reading from and a bitmap of acked messages above watermark. Pull reads from
+that position, so publish and pull are O(batch) rather than O(messages in topic).
+Segments below watermark are deleted, sealed segments that are mostly acked are rewritten
+without acked messages.
 """
-from typing import Any
+from typing import Any, Iterator, Optional
+import metrics
 import util
+import base64
+import fcntl
 import json
-from dataclasses import dataclass
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 import os
-import uuid
 
 import logging
 log = logging.getLogger()
 
 
+SEGMENT_PREFIX = "segment-"
+SEGMENT_MAX_BYTES = 1024 * 1024 # new segment is started once the last one is over
+COMPACT_RATIO = 0.5 # rewrite sealed segment once that share of it got acked
+_ACKS = ".acks"
+_LOCK = ".lock"
+
+
 @dataclass(frozen=True)
 class Message:
     id: str
@@ -53,7 +71,7 @@ class Message:
             id=self.id,
             created=self.created.isoformat(),
             data=self.data)
-    
+
     @classmethod
     def from_json(cls, data: dict[str, str]) -> 'Message':
         return cls(
@@ -61,33 +79,204 @@ class Message:
             created=datetime.fromisoformat(data['created']),
             data=data['data'])
 
+
+def _msg_id(offset: int) -> str:
+    return f"{offset:012d}"
+
+
+def _segment_path(topic: Path, first: int) -> Path:
+    return topic / f"{SEGMENT_PREFIX}{first:012d}.log"
+
+
+def _segments(topic: Path) -> list[tuple[int, Path]]:
+    """(first offset, path) of segments in order"""
+    res = []
+    for name in os.listdir(topic):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(".log"):
+            res.append((int(name[len(SEGMENT_PREFIX):-len(".log")]), topic / name))
+    return sorted(res)
+
+
+def _read_records(seg: Path, pos: int) -> Iterator[tuple[int, dict[str, Any]]]:
+    """(end position, record) of complete lines starting at `pos`"""
+    with open(seg, "rb") as f:
+        f.seek(pos)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return # being written, or torn by crashed publisher
+            pos += len(line)
+            try:
+                yield pos, json.loads(line)
+            except ValueError:
+                log.exception(f"Failed to read message at {seg}:{pos - len(line)}, skipping")
+
+
+def _last_record(f, size: int) -> tuple[int, Optional[dict[str, Any]]]:
+    """Size of complete lines and the last of them, reads segment from the end"""
+    n = 4096
+    while True:
+        start = max(size - n, 0)
+        f.seek(start)
+        buf = f.read(size - start)
+        end = buf.rfind(b"\n")
+        prev = buf.rfind(b"\n", 0, end) if end >= 0 else -1
+        if prev >= 0 or start == 0:
+            if end < 0:
+                return 0, None
+            try:
+                return start + end + 1, json.loads(buf[prev + 1:end + 1])
+            except ValueError:
+                return start + end + 1, None
+        n *= 2
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _locked(topic: Path) -> Iterator[None]:
+    """Serializes writers of the topic, lock is released once file is closed"""
+    lock = topic / _LOCK
+    new = not lock.exists()
+    fd = os.open(lock, os.O_RDONLY | os.O_CREAT, 0o664)
+    if new:
+        util.chown_slurm(lock)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
 class Topic:
     """
     Acts as PubSub topic (https://cloud.google.com/pubsub/docs/reference/rest/v1/projects.topics).
-    We can have multiple instances of 
+    We can have multiple instances of Topic for the same path, including in different processes.
     """
-    def __init__(self, path: Path, staging: Path) -> None:
+    def __init__(self, path: Path) -> None:
         self._path = path
-        self._staging = staging
-    
-    def _gen_id(self, created: datetime) -> str:
-        ts = created.strftime("%Y_%m_%d-%H_%M_%S")
-        suf = str(uuid.uuid4())[:8]
-        return f"{ts}-{suf}"
-    
+
+    def _tail(self) -> tuple[Path, int, int]:
+        """Segment to append to, size of its complete lines and offset of the next message"""
+        segs = _segments(self._path)
+        if not segs:
+            return _segment_path(self._path, 0), 0, 0
+        first, seg = segs[-1]
+        with open(seg, "rb") as f:
+            valid, last = _last_record(f, f.seek(0, os.SEEK_END))
+        if valid and last is None: # unreadable last message, don't reuse offsets
+            last = {"id": max((r["id"] for _, r in _read_records(seg, 0)), default=_msg_id(first - 1))}
+        nxt = int(last["id"]) + 1 if last else first
+        if valid >= SEGMENT_MAX_BYTES:
+            return _segment_path(self._path, nxt), 0, nxt
+        return seg, valid, nxt
+
+    def _append(self, items: list[tuple[datetime, Any]]) -> list[Message]:
+        """Appends messages, should be called under `_locked`"""
+        seg, valid, nxt = self._tail()
+        msgs = [
+            Message(id=_msg_id(nxt + i), created=created, data=data)
+            for i, (created, data) in enumerate(items)
+        ]
+        payload = b"".join(json.dumps(m.to_json()).encode() + b"\n" for m in msgs)
+
+        new = not seg.exists()
+        fd = os.open(seg, os.O_WRONLY | os.O_CREAT, 0o664)
+        try:
+            os.ftruncate(fd, valid) # drop torn tail, if any
+            os.lseek(fd, valid, os.SEEK_SET)
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if new:
+            util.chown_slurm(seg) # shared by suspend (slurm) and slurmsync
+            _fsync_dir(self._path)
+        return msgs
+
     def publish(self, data: Any) -> None:
+        self.publish_batch([data])
+
+    def publish_batch(self, data: list[Any]) -> list[str]:
+        """Publishes messages with single write and fsync, returns their ids"""
+        if not data:
+            return []
         created = util.now()
-        id = self._gen_id(created)
-        msg = Message(id=id, created=created, data=data)
-        
-        staged = self._staging / msg.id
-        dst = self._path / msg.id
+        with _locked(self._path):
+            msgs = self._append([(created, d) for d in data])
+        metrics.PUBSUB_MESSAGES.inc(len(msgs), topic=self._path.name, op="published")
+        return [m.id for m in msgs]
 
-        # Write to stagin area first then perform atomic move
-        # to prevent "reads of partial writes"
-        staged.write_text(json.dumps(msg.to_json()))
-        util.chown_slurm(staged)
-        staged.rename(dst)
+
+@dataclass
+class _AckState:
+    watermark: int = 0 # all messages below are acked
+    segment: int = 0 # segment and position in it to start reading from
+    pos: int = 0
+    acked: int = 0 # bitmap, bit `i` is set if message `watermark + i` is acked
+    compacted: dict[int, int] = field(default_factory=dict) # segment -> acked messages when it was rewritten
+
+    @classmethod
+    def load(cls, path: Path) -> "_AckState":
+        try:
+            jo = json.loads(path.read_text())
+        except FileNotFoundError:
+            return cls()
+        except ValueError:
+            log.exception(f"Failed to read {path}, all messages will be re-delivered")
+            return cls()
+        return cls(
+            watermark=jo["watermark"],
+            segment=jo["segment"],
+            pos=jo["pos"],
+            acked=int.from_bytes(base64.b64decode(jo["acked"]), "little"),
+            compacted={int(k): v for k, v in jo.get("compacted", {}).items()},
+        )
+
+    def save(self, path: Path) -> None:
+        bitmap = self.acked.to_bytes((self.acked.bit_length() + 7) // 8, "little")
+        tmp = path.with_name(f"{path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(dict(
+                watermark=self.watermark,
+                segment=self.segment,
+                pos=self.pos,
+                acked=base64.b64encode(bitmap).decode(),
+                compacted=self.compacted,
+            ), f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.rename(path)
+        _fsync_dir(path.parent)
+
+    def is_acked(self, offset: int) -> bool:
+        return offset < self.watermark or bool(self.acked >> (offset - self.watermark) & 1)
+
+    def count_acked(self, start: int, end: int) -> int:
+        """Number of acked messages in [start, end)"""
+        below = max(min(end, self.watermark) - start, 0)
+        lo, hi = max(start, self.watermark) - self.watermark, max(end, self.watermark) - self.watermark
+        window = self.acked >> lo & ((1 << max(hi - lo, 0)) - 1)
+        return below + bin(window).count("1")
+
+    def ack(self, offset: int) -> None:
+        if offset >= self.watermark:
+            self.acked |= 1 << (offset - self.watermark)
+
+    def advance(self) -> int:
+        """Moves watermark over acked messages, returns previous one"""
+        prev = self.watermark
+        k = (~self.acked & (self.acked + 1)).bit_length() - 1 # number of trailing ones
+        self.acked >>= k
+        self.watermark += k
+        return prev
 
 
 class Subscription:
@@ -97,9 +286,9 @@ class Subscription:
 
     ```
     ackDeadlineSeconds = +Inf     # don't resend message that was already being delivered but not acked yet
-    retainAckedMessages = False   # don't persist messages that were already acked 
+    retainAckedMessages = False   # don't persist messages that were already acked
     enableMessageOrdering = True  # delivers messages in chronoligical order
-    messageRetentionDuration = +Inf # don't expire messages  
+    messageRetentionDuration = +Inf # don't expire messages
     deadLetterPolicy = None         # "deadlettering" is disabled, subscriber should take care of any poisonous messages
     retryPolicy = {                 # NACKed message will be re-delievered after some time
         minimumBackoff = 30s        # NOTE: Practically there is no timer, but Subscription instance will not try to re-deliver NACKed messages.
@@ -107,7 +296,7 @@ class Subscription:
     }
     ```
 
-    IMPORTANT: Should only be run as part of slurmsync, 
+    IMPORTANT: Should only be run as part of slurmsync,
     this is our way to ensure that at most one instance exists at a time.
     There is no concurancy safeguards in place, avoid multithreaded `pull`,
     while multithreaded `ack` & `modify_ack_deadline` are OK.
@@ -115,63 +304,143 @@ class Subscription:
 
     def __init__(self, path: Path) -> None:
         self._path: Path = path
-        # contains ALL messages pulled by this subscription instance
-        # both acked, nacked, and still being processed
+        self._acks = _AckState.load(path / _ACKS)
+        # everything before cursor was pulled by this subscription instance,
         # used to prevent double delivery within lifetime of subscription (slurmsync)
-        self._pulled: set[str] = set()
-
-    def _delete(self, id: str) -> None:
-        log.debug(f"removing {id}")
-        try:
-            os.unlink(self._path / id)
-        except:
-            log.exception(f"Failed to remove message {id}")
-    
-    def _read_msg(self, id: str) -> Message | None:
-        try:
-            with open(self._path / id, 'r') as f:
-                content = json.loads(f.read())
-                return Message.from_json(content)
-        except Exception:
-            log.exception(f"Failed to read message {id}")
-            self._delete(id) # delete message to reduce "deadlettering"
-            return None
+        self._cursor: tuple[int, int] = (self._acks.segment, self._acks.pos)
+        # segment and end position of pulled messages, to move read position of `_acks` on ack
+        self._ends: dict[int, tuple[int, int]] = {}
+        self._lock = threading.Lock()
 
     def pull(self, max_messages: int) -> list[Message]:
         if not self._path.exists():
             log.warning(f"Topic {self._path} does not exist")
             return []
-        res = []
-        ls = sorted(os.listdir(self._path))
-        for name in ls:
-            msg = self._read_msg(name)
-            if msg is not None and msg.id not in self._pulled:
-                self._pulled.add(msg.id)
-                res.append(msg)
-
+        res: list[Message] = []
+        segs = _segments(self._path)
+        for first, seg in segs:
+            cur_seg, cur_pos = self._cursor
             if len(res) >= max_messages:
                 break
+            if first < cur_seg:
+                continue
+            for end, rec in _read_records(seg, cur_pos if first == cur_seg else 0):
+                self._cursor = (first, end)
+                try:
+                    msg = Message.from_json(rec)
+                    offset = int(msg.id)
+                except Exception:
+                    log.exception(f"Failed to parse message {rec}, skipping")
+                    continue
+                if self._acks.is_acked(offset):
+                    continue
+                self._ends[offset] = (first, end)
+                res.append(msg)
+                if len(res) >= max_messages:
+                    break
+        self._update_depth(segs)
         return res
 
+    def _update_depth(self, segs: list[tuple[int, Path]]) -> None:
+        if not segs:
+            return
+        with open(segs[-1][1], "rb") as f:
+            _, last = _last_record(f, f.seek(0, os.SEEK_END))
+        if last is not None:
+            end = int(last["id"]) + 1
+            depth = end - self._acks.watermark - self._acks.count_acked(self._acks.watermark, end)
+            metrics.PUBSUB_QUEUE_DEPTH.set(depth, topic=self._path.name)
 
     def ack(self, ids: list[str]) -> None:
-        for id in ids:
-            self._delete(id)
+        with self._lock:
+            for id in ids:
+                self._acks.ack(int(id))
+            prev = self._acks.advance()
+            if self._acks.watermark != prev and (self._acks.watermark - 1) in self._ends:
+                self._acks.segment, self._acks.pos = self._ends[self._acks.watermark - 1]
+            # otherwise keep the previous position, it's behind the watermark
+            try:
+                self._compact()
+            except OSError:
+                log.exception(f"Failed to compact {self._path}")
+            self._acks.save(self._path / _ACKS)
+        metrics.PUBSUB_MESSAGES.inc(len(ids), topic=self._path.name, op="acked")
+
+    def _compact(self) -> None:
+        """Deletes acked segments, rewrites sealed ones that are mostly acked"""
+        st = self._acks
+        with _locked(self._path):
+            segs = _segments(self._path)
+            # never touch the last segment, publishers append to it
+            for (first, seg), (nxt, _) in zip(segs, segs[1:]):
+                if nxt <= st.watermark:
+                    seg.unlink()
+                    st.compacted.pop(first, None)
+                    self._forget(first)
+                    continue
+                if first >= self._cursor[0]:
+                    break # not fully pulled by this subscription yet, positions in it are in use
+                acked = st.count_acked(first, nxt)
+                if acked - st.compacted.get(first, 0) >= COMPACT_RATIO * (nxt - first):
+                    # persist reset position first, so a crash mid-rewrite can't leave it
+                    # pointing inside the shorter segment and skip unacked messages
+                    self._forget(first)
+                    st.save(self._path / _ACKS)
+                    self._rewrite(seg)
+                    st.compacted[first] = acked
+
 
+    def _forget(self, first: int) -> None:
+        """Positions in rewritten or deleted segment are no longer valid"""
+        if self._acks.segment == first:
+            self._acks.pos = 0
+        self._ends = {o: e for o, e in self._ends.items() if e[0] != first}
+
+    def _rewrite(self, seg: Path) -> None:
+        tmp = seg.with_name(f".{seg.name}.tmp")
+        with open(tmp, "wb") as f:
+            for _, rec in _read_records(seg, 0):
+                if not self._acks.is_acked(int(rec["id"])):
+                    f.write(json.dumps(rec).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        util.chown_slurm(tmp)
+        tmp.rename(seg)
+        log.debug(f"compacted {seg}")
 
     def modify_ack_deadline(self, ids: list[str], deadline: int) -> None:
         """
-        Modifies the ack deadline for a specific message. 
+        Modifies the ack deadline for a specific message.
         IMPORTANT: Only accepts deadline=0, which is a way to NACK
         Any other values are also meaningless due to ackDeadlineSeconds==+Inf
         """
         assert deadline == 0 # no op, next subscriber (slurmsync) will pick this up
 
 
+def _migrate_legacy(path: Path) -> None:
+    """Moves messages of one-file-per-message layout into segment log"""
+    legacy = sorted(n for n in os.listdir(path) if not n.startswith((".", SEGMENT_PREFIX)))
+    if not legacy:
+        return
+    with _locked(path):
+        items = []
+        for name in legacy:
+            try:
+                msg = Message.from_json(json.loads((path / name).read_text()))
+                items.append((msg.created, msg.data))
+            except Exception:
+                log.exception(f"Failed to read message {name}, dropping")
+        if items:
+            Topic(path)._append(items)
+        for name in legacy:
+            os.unlink(path / name)
+    log.info(f"moved {len(items)} messages of {path.name} into segment log")
+
+
 # Topics and Subscriptions are singletons
 # TODO: consider making thread-safe
-_topics = {}
-_subscriptions = {}
+_topics: dict[str, Topic] = {}
+_subscriptions: dict[str, Subscription] = {}
 
 def _make_path(name: str) -> Path:
     p = util.slurmdirs.state / "pubsub" / name
@@ -179,18 +448,22 @@ def _make_path(name: str) -> Path:
     util.chown_slurm(p)
     return p
 
-def _make_staging_path(name: str) -> Path:
-    p = util.slurmdirs.state / "pubsub" / ".staging" / name
-    p.mkdir(parents=True, exist_ok=True)
-    util.chown_slurm(p)
-    return p
-
 def topic(name: str) -> Topic:
     if name not in _topics:
-        _topics[name] = Topic(_make_path(name), _make_staging_path(name))
+        _topics[name] = Topic(_make_path(name))
     return _topics[name]
 
 def subscription(name: str) -> Subscription:
     if name not in _subscriptions:
-        _subscriptions[name] = Subscription(_make_path(name))
+        path = _make_path(name)
+        _migrate_legacy(path)
+        _subscriptions[name] = Subscription(path)
     return _subscriptions[name]
+
+def reset() -> None:
+    """
+    Drops singletons, so NACKed messages are re-delivered.
+    Used between cycles of long-running slurmsync (see `slurmsync --daemon`).
+    """
+    _topics.clear()
+    _subscriptions.clear()
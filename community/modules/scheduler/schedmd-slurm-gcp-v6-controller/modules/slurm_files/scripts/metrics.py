@@ -0,0 +1,287 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Minimal metrics registry, exported in Prometheus text format
+through node_exporter textfile collector.
+
+Scripts are short-lived processes (resume, suspend) or periodic ones (slurmsync),
+so nothing is scraped from them directly. Instead every process records deltas in memory
+and `flush` merges them into a state file of its service, then (re)writes
+`slurm_gcp_<service>.prom` in textfile collector directory with an atomic rename.
+Counters and histograms are therefore cumulative across invocations of a script,
+concurrent processes of same service are serialized by `flock` on the state file.
+Every sample is labeled with `script=<service>`, so files of different services don't collide.
+
+Recording is always on and cheap, nothing is written until `configure` is called.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+import atexit
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+
+import logging
+log = logging.getLogger()
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(ABC):
+    type: str = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labels)
+
+    @abstractmethod
+    def _take(self) -> Dict[LabelValues, Any]:
+        """Recorded since last call"""
+
+    @abstractmethod
+    def _merge(self, old: Any, new: Any) -> Any:
+        """Value saved by previous flushes merged with recorded since"""
+
+    def _samples(self, key: LabelValues, value: Any) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        yield self.name, dict(zip(self.labels, key)), value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, value: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def _take(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            res, self._values = self._values, {}
+        return res
+
+    def _merge(self, old: Any, new: Any) -> Any:
+        return (old or 0) + new
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _take(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            res, self._values = self._values, {}
+        return res
+
+    def _merge(self, old: Any, new: Any) -> Any:
+        return new # last observed value wins
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket (not cumulative) ..., count over last bucket, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        idx = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            v = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            v[idx] += 1
+            v[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observes duration of the block in seconds, also if it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _take(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            res, self._values = self._values, {}
+        return res
+
+    def _merge(self, old: Any, new: Any) -> Any:
+        if not old or len(old) != len(new): # buckets were changed
+            return new
+        return [a + b for a, b in zip(old, new)]
+
+    def _samples(self, key: LabelValues, value: Any) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        labels = dict(zip(self.labels, key))
+        cumulative = 0
+        for b, n in zip(self.buckets, value):
+            cumulative += n
+            yield f"{self.name}_bucket", {**labels, "le": _fmt(b)}, cumulative
+        count = cumulative + value[-2]
+        yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+        yield f"{self.name}_sum", labels, value[-1]
+        yield f"{self.name}_count", labels, count
+
+
+_registry: Dict[str, _Metric] = {}
+
+
+def _fmt(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(state: Dict[str, Dict[str, Any]], service: str) -> str:
+    """Prometheus text exposition of `state`, as saved by `flush`"""
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        values = state.get(name)
+        if not values:
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for key, value in sorted(values.items()):
+            for sample, labels, v in metric._samples(tuple(json.loads(key)), value):
+                labels = {"script": service, **labels}
+                lbl = ",".join(f'{k}="{_escape(lv)}"' for k, lv in labels.items())
+                lines.append(f"{sample}{{{lbl}}} {_fmt(v)}")
+    return "\n".join(lines) + "\n"
+
+
+class _Exporter:
+    def __init__(self, textfile_dir: Path, state_dir: Path, service: str) -> None:
+        self.textfile = textfile_dir / f"slurm_gcp_{service}.prom"
+        self.state = state_dir / f"{service}.json"
+        self.service = service
+        self._lock = threading.Lock()
+
+    def flush(self) -> None:
+        deltas = {name: m._take() for name, m in _registry.items()}
+        with self._lock, os.fdopen(os.open(self.state, os.O_RDWR | os.O_CREAT, 0o664), "r+") as f:
+            # lock is released once file is closed
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or "{}")
+            except json.JSONDecodeError:
+                log.warning(f"Failed to read metrics state {self.state}, starting over")
+                state = {}
+            for name, values in deltas.items():
+                merged = state.setdefault(name, {})
+                for key, value in values.items():
+                    k = json.dumps(key)
+                    merged[k] = _registry[name]._merge(merged.get(k), value)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+
+            # node_exporter must never see a partially written file
+            tmp = self.textfile.with_name(f".{self.textfile.name}.{os.getpid()}")
+            tmp.write_text(render(state, self.service))
+            tmp.chmod(0o644)
+            tmp.rename(self.textfile)
+
+
+_exporter: Optional[_Exporter] = None
+
+
+def configure(textfile_dir: Path, state_dir: Path, service: str) -> None:
+    """Enables export of metrics of `service`, they are flushed on exit and by explicit `flush`"""
+    global _exporter
+    state_dir.mkdir(parents=True, exist_ok=True)
+    if _exporter is None:
+        atexit.register(flush)
+    _exporter = _Exporter(textfile_dir, state_dir, service)
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def flush() -> None:
+    """Writes recorded metrics out, never raises"""
+    if _exporter is None:
+        return
+    try:
+        _exporter.flush()
+    except Exception:
+        log.warning("Failed to export metrics", exc_info=True)
+
+
+API_REQUESTS = Counter(
+    "slurm_gcp_api_requests_total",
+    "Google Cloud API requests by method and outcome, batch HTTP calls are counted with method=\"batch\"",
+    labels=("method", "outcome"))
+API_RETRIES = Counter(
+    "slurm_gcp_api_retries_total",
+    "Google Cloud API requests sent again",
+    labels=("method", "reason"))
+API_THROTTLE_SECONDS = Counter(
+    "slurm_gcp_api_throttle_seconds_total",
+    "Time spent waiting for client-side API rate limiter")
+PHASE_DURATION = Histogram(
+    "slurm_gcp_phase_duration_seconds",
+    "Duration of phases of scripts",
+    labels=("phase",))
+PHASE_STATUS = Counter(
+    "slurm_gcp_phase_runs_total",
+    "Runs of slurmsync phases by status",
+    labels=("phase", "status"))
+NODES = Counter(
+    "slurm_gcp_nodes_total",
+    "Nodes handled by resume and suspend",
+    labels=("op", "outcome"))
+PUBSUB_QUEUE_DEPTH = Gauge(
+    "slurm_gcp_pubsub_queue_depth",
+    "Messages waiting in local pubsub topic when last pulled",
+    labels=("topic",))
+PUBSUB_MESSAGES = Counter(
+    "slurm_gcp_pubsub_messages_total",
+    "Messages of local pubsub topics",
+    labels=("topic", "op"))
@@ -0,0 +1,175 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tracking of compute operations in batches.
+
+Instead of issuing one blocking `wait` or `get` call per operation,
+all tracked operations are polled together through `batch_execute`
+(up to 1000 operations per HTTP batch), reducing number of API calls
+from O(ops) to O(ops/1000) per polling round.
+"""
+
+from typing import Any, Dict, Iterable, Optional, Union
+from concurrent.futures import Future
+from dataclasses import dataclass
+import threading
+
+import util
+
+import logging
+log = logging.getLogger()
+
+
+@dataclass(frozen=True)
+class OperationRef:
+    name: str
+    zone: Optional[str] = None
+    region: Optional[str] = None
+
+    @classmethod
+    def of(cls, op: Dict[str, Any]) -> "OperationRef":
+        return cls(
+            name=op["name"],
+            zone=util.trim_self_link(op["zone"]) if "zone" in op else None,
+            region=util.trim_self_link(op["region"]) if "region" in op else None,
+        )
+
+
+def poll(lkp: util.Lookup, refs: Iterable[OperationRef]) -> Dict[OperationRef, Union[Dict[str, Any], Exception]]:
+    """
+    Gets current state of all given operations using batch requests.
+    Returns either operation resource or exception for each of refs.
+    """
+    refs = list(set(refs))
+    if not refs:
+        return {}
+    requests = {
+        str(i): util.get_operation_req(lkp, r.name, region=r.region, zone=r.zone)
+        for i, r in enumerate(refs)
+    }
+    done, failed = util.batch_execute(requests, log_err=log.debug)
+
+    res: Dict[OperationRef, Union[Dict[str, Any], Exception]] = {}
+    for rid, op in done.items():
+        res[refs[int(rid)]] = op
+    for rid, (_, exc) in failed.items():
+        res[refs[int(rid)]] = exc
+    return res
+
+
+class OperationTracker:
+    """
+    Polls all tracked operations in the background and exposes futures
+    that are resolved with the operation resource once it's DONE.
+
+    Polling interval adapts to progress: it's reset to `MIN_INTERVAL` once
+    any operation completes or a new one gets tracked, and grows up to
+    `MAX_INTERVAL` while nothing changes.
+    Failures to get an operation are retried on next rounds, operation
+    fails after `MAX_POLL_FAILURES` consecutive failures.
+    """
+    MIN_INTERVAL = 1.0
+    MAX_INTERVAL = 10.0
+    BACKOFF = 1.5
+    # Number of consecutive failed polls before operation future fails
+    MAX_POLL_FAILURES = 5
+
+    def __init__(self, lkp: util.Lookup) -> None:
+        self._lkp = lkp
+        self._lock = threading.Lock()
+        self._pending: Dict[OperationRef, Future] = {}
+        self._failures: Dict[OperationRef, int] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, op: Dict[str, Any]) -> Future:
+        if op.get("status") == "DONE":
+            fut: Future = Future()
+            fut.set_result(op)
+            return fut
+
+        ref = OperationRef.of(op)
+        with self._lock:
+            if ref not in self._pending:
+                self._pending[ref] = Future()
+            fut = self._pending[ref]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="op-tracker", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return fut
+
+    def wait(self, op: Dict[str, Any]) -> Dict[str, Any]:
+        """Blocks until operation is DONE, drop-in replacement for `util.wait_for_operation`"""
+        res = self.track(op).result()
+        log_errors = " with errors" if "error" in res else ""
+        log.debug(f"operation complete{log_errors}: type={res.get('operationType')}, name={res['name']}")
+        return res
+
+    def _run(self) -> None:
+        interval = self.MIN_INTERVAL
+        while True:
+            # cleared before snapshot, so ops tracked after it cut the next wait short
+            self._wakeup.clear()
+            with self._lock:
+                refs = list(self._pending.keys())
+                if not refs:
+                    self._thread = None
+                    return
+
+            try:
+                results = poll(self._lkp, refs)
+            except Exception as e:
+                log.exception("Failed to poll operations")
+                results = {r: e for r in refs}
+
+            completed = 0
+            with self._lock:
+                for ref, res in results.items():
+                    if isinstance(res, Exception):
+                        self._failures[ref] = self._failures.get(ref, 0) + 1
+                        if self._failures[ref] < self.MAX_POLL_FAILURES:
+                            continue
+                        self._failures.pop(ref)
+                        self._pending.pop(ref).set_exception(res)
+                        continue
+                    self._failures.pop(ref, None)
+                    if res.get("status") == "DONE":
+                        self._pending.pop(ref).set_result(res)
+                        completed += 1
+
+            interval = self.MIN_INTERVAL if completed else min(interval * self.BACKOFF, self.MAX_INTERVAL)
+            if self._wakeup.wait(interval):
+                interval = self.MIN_INTERVAL
+
+
+_tracker: Optional[OperationTracker] = None
+_tracker_lock = threading.Lock()
+
+def tracker() -> OperationTracker:
+    """
+    Tracker bound to current `util.lookup()`, replaced once config is reloaded (e.g. by broker).
+    Operations of replaced tracker are still polled by it until done.
+    """
+    global _tracker
+    lkp = util.lookup()
+    with _tracker_lock:
+        if _tracker is None or _tracker._lkp is not lkp:
+            _tracker = OperationTracker(lkp)
+        return _tracker
+
+
+def wait_for_operation(op: Dict[str, Any]) -> Dict[str, Any]:
+    return tracker().wait(op)
@@ -0,0 +1,223 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Warm pool of compact placement policies for exclusive jobs.
+
+Creating a placement policy takes an API call and a wait for its operation,
+both on the critical path of job start. For nodesets with `placement_pool_size` set,
+slurmsync keeps that many unassigned policies created in advance (`refill`), and
+resume claims them for exclusive jobs instead of creating new ones (`claim`).
+Claimed policies are deleted by slurmsync once job is over, same as on-demand ones
+(`collect_garbage`).
+
+Pool is kept in a state file shared by resume and slurmsync, updates are serialized by `flock`.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+import fcntl
+import json
+import os
+import re
+import secrets
+
+import util
+from util import NSDict, batch_execute
+import op_tracker
+
+import logging
+log = logging.getLogger()
+
+
+@dataclass(frozen=True)
+class Entry:
+    name: str
+    region: str
+    max_distance: Optional[int]
+
+
+@dataclass
+class PoolState:
+    free: Dict[str, List[Entry]] = field(default_factory=dict) # nodeset -> unassigned policies
+    claimed: Dict[str, str] = field(default_factory=dict) # policy name -> job id
+
+    @classmethod
+    def from_json(cls, jo: Dict[str, Any]) -> "PoolState":
+        return cls(
+            free={ns: [Entry(**e) for e in entries] for ns, entries in jo.get("free", {}).items()},
+            claimed=dict(jo.get("claimed", {})),
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def state_path() -> Path:
+    return util.slurmdirs.state / "placement_pool.json"
+
+
+@contextmanager
+def _locked() -> Iterator[PoolState]:
+    """State of pool, changes are saved on exit"""
+    path = state_path()
+    if not path.exists():
+        util.chown_slurm(path, mode=0o664) # shared by resume (slurm) and slurmsync
+    # lock is released once file is closed
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o664), "r+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            st = PoolState.from_json(json.loads(f.read() or "{}"))
+        except Exception:
+            log.warning(f"Failed to read placement pool state {path}, starting over", exc_info=True)
+            st = PoolState()
+        yield st
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(st.to_json()))
+
+
+def pool_size(nodeset: NSDict) -> int:
+    if not nodeset.enable_placement:
+        return 0
+    return nodeset.placement_pool_size or 0
+
+
+def _entry_spec(nodeset: NSDict) -> Entry:
+    """Entry with empty name, policies of pool must match it to be used for nodeset"""
+    return Entry(
+        name="",
+        region=util.parse_self_link(nodeset.subnetwork).region,
+        max_distance=nodeset.get("placement_max_distance"),
+    )
+
+
+def _matches(e: Entry, spec: Entry) -> bool:
+    return e.region == spec.region and e.max_distance == spec.max_distance
+
+
+def _pool_regex(lkp: util.Lookup) -> re.Pattern:
+    return re.compile(rf"^{lkp.cfg.slurm_cluster_name}-slurmgcp-managed-(?P<ns>[^\s\-]+)-pool-[0-9a-f]+$")
+
+
+def is_pool_policy(lkp: util.Lookup, name: str) -> bool:
+    return _pool_regex(lkp).match(name) is not None
+
+
+def claim(lkp: util.Lookup, nodeset: NSDict, job_id: int, count: int) -> List[str]:
+    """Names of up to `count` policies of nodeset pool, assigned to the job"""
+    if count <= 0 or not pool_size(nodeset):
+        return []
+    spec = _entry_spec(nodeset)
+    try:
+        with _locked() as st:
+            free = st.free.get(nodeset.nodeset_name, [])
+            res = [e for e in free if _matches(e, spec)][:count]
+            st.free[nodeset.nodeset_name] = [e for e in free if e not in res]
+            for e in res:
+                st.claimed[e.name] = str(job_id)
+    except OSError:
+        log.warning("Placement pool is not available", exc_info=True)
+        return []
+    if res:
+        log.info(f"claimed {len(res)} pooled placement policies for job {job_id}: {','.join(e.name for e in res)}")
+    return [e.name for e in res]
+
+
+def collect_garbage(lkp: util.Lookup, policies: Iterable[Dict[str, Any]], keep_jobs: Set[str]) -> List[str]:
+    """
+    Self links of pool `policies` to delete: claimed by finished jobs,
+    in excess of (or not matching) pool of their nodeset, or unknown to the pool.
+    """
+    existing = {p["name"]: p["selfLink"] for p in policies}
+    if not existing and not state_path().exists():
+        return [] # pool is not used
+    to_delete: Set[str] = set()
+    with _locked() as st:
+        for name, job_id in list(st.claimed.items()):
+            if name not in existing or job_id not in keep_jobs:
+                del st.claimed[name]
+                to_delete.add(name)
+
+        for ns_name, entries in list(st.free.items()):
+            nodeset = lkp.cfg.nodeset.get(ns_name)
+            size = pool_size(nodeset) if nodeset else 0
+            keep = [e for e in entries if e.name in existing]
+            if size:
+                spec = _entry_spec(nodeset)
+                keep = [e for e in keep if _matches(e, spec)][:size]
+            to_delete.update(e.name for e in entries if e not in keep)
+            if keep:
+                st.free[ns_name] = keep
+            else:
+                del st.free[ns_name]
+
+        known = set(st.claimed) | {e.name for entries in st.free.values() for e in entries}
+        to_delete.update(name for name in existing if name not in known)
+    return [existing[name] for name in sorted(to_delete) if name in existing]
+
+
+def placement_policy_body(name: str, region: str, max_distance: Optional[int]) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "region": region,
+        "groupPlacementPolicy": {
+            "collocation": "COLLOCATED",
+            "maxDistance": max_distance
+        },
+    }
+
+
+def refill(lkp: util.Lookup) -> int:
+    """Creates policies missing in pools of nodesets, returns number of created ones"""
+    if not any(pool_size(ns) for ns in lkp.cfg.nodeset.values()):
+        return 0
+    requests: Dict[str, Any] = {}
+    pending: Dict[str, Tuple[str, Entry]] = {} # policy name -> (nodeset, entry)
+    with _locked() as st:
+        for ns_name, nodeset in lkp.cfg.nodeset.items():
+            if not (size := pool_size(nodeset)):
+                continue
+            spec = _entry_spec(nodeset)
+            have = sum(1 for e in st.free.get(ns_name, []) if _matches(e, spec))
+            for _ in range(size - have):
+                name = f"{lkp.cfg.slurm_cluster_name}-slurmgcp-managed-{ns_name}-pool-{secrets.token_hex(4)}"
+                pending[name] = (ns_name, Entry(name=name, region=spec.region, max_distance=spec.max_distance))
+                requests[name] = lkp.compute.resourcePolicies().insert(
+                    project=lkp.project, region=spec.region, body=placement_policy_body(name, spec.region, spec.max_distance))
+    if not requests:
+        return 0
+
+    # Don't hold the lock while waiting for operations, new policies become claimable once ready
+    done, failed = batch_execute(requests)
+    for name, (_, err) in failed.items():
+        log.error(f"failed to create pooled placement policy {name}: {err}")
+    tracker = op_tracker.tracker()
+    futures = {name: tracker.track(op) for name, op in done.items()}
+    created = []
+    for name, fut in futures.items():
+        op = fut.result()
+        if "error" in op:
+            log.error(f"failed to create pooled placement policy {name}: {op['error']}")
+        else:
+            created.append(pending[name])
+
+    with _locked() as st:
+        for ns_name, e in created:
+            st.free.setdefault(ns_name, []).append(e)
+    if created:
+        log.info(f"created {len(created)} pooled placement policies ({','.join(e.name for _, e in created)})")
+    return len(created)
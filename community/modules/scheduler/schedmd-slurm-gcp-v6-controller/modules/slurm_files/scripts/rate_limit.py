@@ -0,0 +1,209 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Token buckets for compute API requests, shared by all scripts running on the host.
+
+Resume, suspend and slurmsync draw from the same bucket per method class
+(read, mutate, operations), so together they stay within API quota instead of
+hitting it at the same time. State of every bucket is kept in a file,
+updates are serialized by `flock`.
+
+Refill rate adapts to responses: it's halved once API reports rate limiting
+and recovers linearly back to the configured rate within `RECOVERY`.
+"""
+
+from typing import Dict, Iterable, Optional
+from collections import Counter, defaultdict
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from time import sleep, time
+import fcntl
+import json
+import os
+import shutil
+import threading
+
+import logging
+log = logging.getLogger()
+
+READ = "read"
+MUTATE = "mutate"
+OPERATIONS = "operations"
+
+# Seconds for penalized rate to recover back to configured one
+RECOVERY = 60.0
+# Rate is never lowered below this fraction of configured one
+MIN_RATE_FRACTION = 0.1
+# Max seconds a single `acquire` waits. Debt is never charged beyond it,
+# so a large batch at penalized rate doesn't stall caller for minutes,
+# API rate limiting (and penalty it brings) takes over instead.
+MAX_WAIT = 10.0
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float # requests per second
+    burst: float # max number of requests sent at once
+
+    @classmethod
+    def per_minute(cls, n: float) -> "Limit":
+        # quota of compute API is enforced per minute
+        return cls(rate=n / 60, burst=n)
+
+
+# Default per-project quotas of compute API
+DEFAULT_LIMITS = {
+    READ: Limit.per_minute(1500),
+    MUTATE: Limit.per_minute(1500),
+    OPERATIONS: Limit.per_minute(3000),
+}
+
+
+def method_class(method_id: str) -> str:
+    """e.g. "compute.instances.bulkInsert" -> "mutate", "compute.zoneOperations.get" -> "operations" """
+    resource, _, method = method_id.rpartition(".")
+    if resource.endswith("Operations"):
+        return OPERATIONS
+    if not method or method.startswith(("get", "list", "aggregated")):
+        return READ
+    return MUTATE
+
+
+@dataclass
+class _State:
+    tokens: float
+    rate: float
+    ts: float
+    wait_s: float = 0.0 # total time spent waiting for tokens, by all processes
+    penalties: int = 0
+
+
+@dataclass
+class Stats:
+    """Counters of this process"""
+    acquired: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    wait_s: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    penalties: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+
+class TokenBucket:
+    def __init__(self, path: Path, limit: Limit) -> None:
+        self.path = path
+        self.limit = limit
+
+    def _refill(self, st: _State, now: float) -> None:
+        elapsed = max(now - st.ts, 0)
+        st.rate = min(self.limit.rate, st.rate + self.limit.rate * elapsed / RECOVERY)
+        st.tokens = min(self.limit.burst, st.tokens + st.rate * elapsed)
+        st.ts = now
+
+    def _update(self, fn) -> _State:
+        # lock is released once file is closed
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664), "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            now = time()
+            try:
+                st = _State(**json.loads(f.read()))
+            except Exception: # new or corrupted
+                st = _State(tokens=self.limit.burst, rate=self.limit.rate, ts=now)
+            self._refill(st, now)
+            fn(st)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(asdict(st)))
+        return st
+
+    def acquire(self, n: int = 1) -> float:
+        """
+        Takes `n` tokens, waits until they are refilled if needed. Returns wait time in seconds.
+        Tokens are only charged up to debt of `MAX_WAIT`, so wait never exceeds it.
+        """
+        wait = 0.0
+        def take(st: _State) -> None:
+            nonlocal wait
+            # Go into debt, so requests are served in order of arrival
+            st.tokens -= min(n, max(st.tokens + st.rate * MAX_WAIT, 0))
+            if st.tokens < 0:
+                wait = min(-st.tokens / st.rate, MAX_WAIT)
+                st.wait_s += wait
+        self._update(take)
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def penalize(self) -> None:
+        def slow_down(st: _State) -> None:
+            st.rate = max(self.limit.rate * MIN_RATE_FRACTION, st.rate / 2)
+            st.tokens = min(st.tokens, 0)
+            st.penalties += 1
+        self._update(slow_down)
+
+
+class RateLimiter:
+    """
+    Set of token buckets per method class, stored in `directory`.
+    Never fails requests: if state can't be accessed, requests are not throttled.
+    """
+    def __init__(self, directory: Optional[Path], limits: Dict[str, Limit] = DEFAULT_LIMITS) -> None:
+        self._buckets: Dict[str, TokenBucket] = {}
+        if directory is not None:
+            for cls, limit in limits.items():
+                path = directory / cls
+                _ensure_file(path)
+                self._buckets[cls] = TokenBucket(path, limit)
+        self._lock = threading.Lock()
+        self._stats = Stats()
+
+    def stats(self) -> Stats:
+        with self._lock:
+            return Stats(dict(self._stats.acquired), dict(self._stats.wait_s), dict(self._stats.penalties))
+
+    def acquire(self, method_ids: Iterable[str]) -> float:
+        total = 0.0
+        for cls, n in Counter(method_class(m) for m in method_ids).items():
+            wait = self._call(cls, lambda b: b.acquire(n)) or 0.0
+            if wait > 0:
+                log.debug(f"throttled {n} {cls} requests for {wait:.2f}s")
+            with self._lock:
+                self._stats.acquired[cls] += n
+                self._stats.wait_s[cls] += wait
+            total += wait
+        return total
+
+    def penalize(self, method_id: str) -> None:
+        cls = method_class(method_id)
+        self._call(cls, lambda b: b.penalize())
+        with self._lock:
+            self._stats.penalties[cls] += 1
+
+    def _call(self, cls: str, fn):
+        if (bucket := self._buckets.get(cls)) is None:
+            return None
+        try:
+            return fn(bucket)
+        except OSError:
+            log.warning(f"rate limiter {bucket.path} is not available", exc_info=True)
+            return None
+
+
+def _ensure_file(path: Path) -> None:
+    if path.exists():
+        return
+    try:
+        path.touch(exist_ok=True)
+        # shared by scripts running as root and slurm
+        shutil.chown(path, user="slurm", group="slurm")
+    except (OSError, LookupError):
+        log.debug(f"failed to prepare {path}", exc_info=True)
@@ -15,7 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 import argparse
 from datetime import timedelta
 import shlex
@@ -24,26 +24,31 @@ import logging
 import os
 import yaml
 import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dataclasses import dataclass
 from addict import Dict as NSDict # type: ignore
+from googleapiclient.errors import HttpError # type: ignore
 
 import util
 from util import (
     chunked,
     ensure_execute,
-    execute_with_futures,
     log_api_request,
     map_with_futures,
     run,
     separate,
     to_hostlist,
     trim_self_link,
-    wait_for_operation,
 )
 from util import lookup, ReservationDetails
 import tpu
 import mig_flex
+import metrics
+import op_tracker
+import placement_pool
+import tracing
 
 log = logging.getLogger()
 
@@ -56,6 +61,9 @@ BULK_INSERT_LIMIT = 5000
 # https://cloud.google.com/compute/docs/instance-groups#types_of_managed_instance_groups
 ZONAL_MIG_SIZE_LIMIT = 1000
 
+# Max number of chunks (bulkInserts, TPUs, MIGs) being resumed concurrently
+RESUME_CONCURRENCY = 16
+
 
 @dataclass(frozen=True)
 class ResumeJobData:
@@ -72,6 +80,9 @@ def get_resume_file_data() -> Optional[ResumeData]:
     if not (path := os.getenv("SLURM_RESUME_FILE")):
         log.error("SLURM_RESUME_FILE was not in environment. Cannot get detailed job, node, partition allocation data.")
         return None
+    return read_resume_data(path)
+
+def read_resume_data(path: str) -> ResumeData:
     blob = Path(path).read_text()
     log.debug(f"Resume data: {blob}")
     data = json.loads(blob)
@@ -159,7 +170,7 @@ def dws_flex_duration(dws_flex: NSDict, job_id: Optional[int]) -> int:
             log.info("Job TimeLimit cannot be less than 30 seconds or exceed one week")
     return max_duration
 
-def create_instances_request(nodes: List[str], placement_group: Optional[str], excl_job_id: Optional[int]):
+def create_instances_request(nodes: List[str], placement_group: Optional[str], excl_job_id: Optional[int], traceparent: Optional[str] = None):
     """Call regionInstances.bulkInsert to create instances"""
     assert 0 < len(nodes) <= BULK_INSERT_LIMIT
 
@@ -181,6 +192,9 @@ def create_instances_request(nodes: List[str], placement_group: Optional[str], e
         ),
     )
 
+    if traceparent: # so setup of instances continues trace of resume, see `tracing`
+        _add_metadata(body["instanceProperties"], template, tracing.TRACEPARENT_METADATA_KEY, traceparent)
+
     if placement_group and excl_job_id is not None:
         pass # do not set minCount to force "all or nothing" behavior
     else:
@@ -211,6 +225,12 @@ def create_instances_request(nodes: List[str], placement_group: Optional[str], e
     log_api_request(req)
     return req
 
+def _add_metadata(props: NSDict, template_link: str, key: str, value: str) -> None:
+    # metadata in instanceProperties replaces one of template, carry over its items
+    base = props.get("metadata") or lookup().template_info(template_link).get("metadata") or {}
+    items = [dict(i) for i in base.get("items") or [] if i.get("key") != key]
+    props.metadata = {"items": [*items, {"key": key, "value": value}]}
+
 @dataclass()
 class PlacementAndNodes:
     placement: Optional[str]
@@ -291,9 +311,14 @@ def group_nodes_bulk(nodes: List[str], resume_data: Optional[ResumeData], lkp: u
     return {chunk.name: chunk for chunk in chunks}
 
 
-def resume_nodes(nodes: List[str], resume_data: Optional[ResumeData]):
-    """resume nodes in nodelist"""
+def resume_nodes(nodes: List[str], resume_data: Optional[ResumeData], submitted: Optional[threading.Event] = None):
+    """
+    resume nodes in nodelist.
+    `submitted` is set once bulkInserts of all chunks are submitted, while waits for their
+    operations and handling of failures may still be in progress.
+    """
     lkp = lookup()
+    metrics.NODES.inc(len(nodes), op="resume", outcome="requested")
     # Prevent dormant nodes associated with a future reservation from being resumed
     nodes, dormant_fr_nodes = util.separate(lkp.is_dormant_fr_node, nodes)
     
@@ -311,7 +336,9 @@ def resume_nodes(nodes: List[str], resume_data: Optional[ResumeData]):
         return
 
     nodes = sorted(nodes, key=lkp.node_prefix)
-    grouped_nodes = group_nodes_bulk(nodes, resume_data, lkp)
+    with tracing.span("group_nodes_bulk", nodes=len(nodes)) as sp, metrics.PHASE_DURATION.time(phase="group_nodes_bulk"):
+        grouped_nodes = group_nodes_bulk(nodes, resume_data, lkp)
+        sp.set(chunks=len(grouped_nodes))
 
     if log.isEnabledFor(logging.DEBUG):
         grouped_nodelists = {
@@ -323,6 +350,7 @@ def resume_nodes(nodes: List[str], resume_data: Optional[ResumeData]):
 
     tpu_chunks, flex_chunks = [], []
     bi_inserts = {}
+    spans = {}
 
     for group, chunk in grouped_nodes.items():
         model = chunk.nodes[0]
@@ -332,47 +360,71 @@ def resume_nodes(nodes: List[str], resume_data: Optional[ResumeData]):
         elif lkp.is_flex_node(model):
             flex_chunks.append(chunk)
         else:
+            # started here, so instances can refer to it as parent
+            spans[group] = tracing.start_span(
+                "bulk_insert", chunk=group, nodes=to_hostlist(chunk.nodes), count=len(chunk.nodes))
             bi_inserts[group] = create_instances_request(
-                chunk.nodes, chunk.placement_group, chunk.excl_job_id
+                chunk.nodes, chunk.placement_group, chunk.excl_job_id,
+                traceparent=spans[group].context.traceparent if tracing.enabled() else None,
             )
 
-    for chunk in flex_chunks:
-        mig_flex.resume_flex_chunk(chunk.nodes, chunk.excl_job_id, lkp)
-
-    # execute all bulkInsert requests  with batch
-    bulk_ops = dict(
-        zip(bi_inserts.keys(), map_with_futures(ensure_execute, bi_inserts.values()))
-    )
-    log.debug(f"bulk_ops={yaml.safe_dump(bulk_ops)}")
-    started = {
-        group: op for group, op in bulk_ops.items() if not isinstance(op, Exception)
-    }
-    failed = {
-        group: err for group, err in bulk_ops.items() if isinstance(err, Exception)
-    }
-    if failed:
-        failed_reqs = [str(e) for e in failed.items()]
-        log.error("bulkInsert API failures: {}".format("; ".join(failed_reqs)))
-        for ident, exc in failed.items():
-            down_nodes_notify_jobs(grouped_nodes[ident].nodes, f"GCP Error: {exc._get_reason()}", resume_data) # type: ignore
-
-    if log.isEnabledFor(logging.DEBUG):
-        for group, op in started.items():
-            group_nodes = grouped_nodelists[group]
-            name = op["name"]
-            gid = op["operationGroupId"]
-            log.debug(
-                f"new bulkInsert operation started: group={group} nodes={group_nodes} name={name} operationGroupId={gid}"
-            )
-    # wait for all bulkInserts to complete and log any errors
-    bulk_operations = {group: wait_for_operation(op) for group, op in started.items()}
+    # Each chunk goes through submit -> wait -> handle independently,
+    # so slow zone or failure of one chunk doesn't delay handling of others.
+    chunk_submitted = {group: threading.Event() for group in bi_inserts}
+    with ThreadPoolExecutor(max_workers=RESUME_CONCURRENCY) as exe:
+        futures = {
+            exe.submit(tracing.propagate(_resume_bulk_chunk), grouped_nodes[group], req, resume_data, spans[group], chunk_submitted[group]): group
+            for group, req in bi_inserts.items()
+        }
+        for chunk in flex_chunks:
+            futures[exe.submit(tracing.propagate(mig_flex.resume_flex_chunk), chunk.nodes, chunk.excl_job_id, lkp)] = chunk.name
+        if submitted is not None:
+            for ev in chunk_submitted.values():
+                ev.wait()
+            submitted.set()
+        _log_failed_chunks(futures)
+
+        # Start TPU after regular nodes so that regular nodes are not affected by the slower TPU nodes
+        _log_failed_chunks({
+            exe.submit(tracing.propagate(tpu.start_tpu), nodes): to_hostlist(nodes)
+            for nodes in tpu_chunks
+        })
+
+
+def _log_failed_chunks(futures: Dict[Any, str]) -> None:
+    for future in as_completed(futures):
+        if (exc := future.exception()) is not None:
+            log.error(f"failed to resume {futures[future]}", exc_info=exc)
+
+
+def _resume_bulk_chunk(
+        chunk: BulkChunk, req: Any, resume_data: Optional[ResumeData],
+        span: Optional[tracing.Span] = None, submitted: Optional[threading.Event] = None) -> None:
+    """Submits bulkInsert for the chunk, waits for it to complete and handles failures"""
+    with tracing.use_span(span or tracing.start_span("bulk_insert", chunk=chunk.name)) as sp:
+        try:
+            with tracing.span("bulk_insert.submit"):
+                op = ensure_execute(req)
+        except Exception as e:
+            if submitted is not None:
+                submitted.set()
+            log.error(f"bulkInsert API failure: {chunk.name}: {e}")
+            reason = e._get_reason() if isinstance(e, HttpError) else str(e)
+            sp.error = reason
+            down_nodes_notify_jobs(chunk.nodes, f"GCP Error: {reason}", resume_data)
+            return
+        if submitted is not None:
+            submitted.set()
 
-    # Start TPU after regular nodes so that regular nodes are not affected by the slower TPU nodes
-    execute_with_futures(tpu.start_tpu, tpu_chunks)
+        log.debug(
+            f"new bulkInsert operation started: group={chunk.name} nodes={to_hostlist(chunk.nodes)} name={op['name']} operationGroupId={op['operationGroupId']}"
+        )
+        sp.set(operation=op["name"])
+        with tracing.span("bulk_insert.wait", operation=op["name"]):
+            op = op_tracker.wait_for_operation(op)
+        with tracing.span("bulk_insert.handle"):
+            _handle_bulk_insert_op(op, chunk.nodes, resume_data)
 
-    for group, op in bulk_operations.items():
-        _handle_bulk_insert_op(op, grouped_nodes[group].nodes, resume_data)
-        
 
 def _get_failed_zonal_instance_inserts(bulk_op: Any, zone: str, lkp: util.Lookup) -> list[Any]:
     group_id = bulk_op["operationGroupId"]
@@ -458,6 +510,7 @@ def _handle_bulk_insert_op(op: Dict, nodes: List[str], resume_data: Optional[Res
 
 def down_nodes_notify_jobs(nodes: List[str], reason: str, resume_data: Optional[ResumeData]) -> None:
     """set nodes down with reason"""
+    metrics.NODES.inc(len(nodes), op="resume", outcome="failed")
     nodes_set = set(nodes) # turn into set to speed up intersection
     jobs = resume_data.jobs if resume_data else []
     reason_quoted = shlex.quote(reason)
@@ -476,15 +529,7 @@ def down_nodes_notify_jobs(nodes: List[str], reason: str, resume_data: Optional[
 
 
 def create_placement_request(pg_name: str, region: str, max_distance: Optional[int]):
-    config = {
-        "name": pg_name,
-        "region": region,
-        "groupPlacementPolicy": {
-            "collocation": "COLLOCATED",
-            "maxDistance": max_distance
-        },
-    }
-    
+    config = placement_pool.placement_policy_body(pg_name, region, max_distance)
     request = lookup().compute.resourcePolicies().insert(
         project=lookup().project, region=region, body=config
     )
@@ -569,10 +614,22 @@ def calculate_chunk_size(nodeset: NSDict, lkp: util.Lookup) -> int:
     else:
         return PLACEMENT_MAX_CNT
 
+def _claim_pooled_placements(placements: List[PlacementAndNodes], excl_job_id: int, lkp: util.Lookup) -> Set[str]:
+    """Replaces placements to be created with ones from warm pool, see `placement_pool`"""
+    to_create = [p for p in placements if p.placement]
+    if not to_create:
+        return set()
+    pooled = placement_pool.claim(lkp, lkp.node_nodeset(to_create[0].nodes[0]), excl_job_id, len(to_create))
+    for p, name in zip(to_create, pooled):
+        p.placement = name
+    return set(pooled)
+
+
 def create_nodeset_placements(nodes: List[str], excl_job_id:Optional[int], lkp: util.Lookup) -> List[PlacementAndNodes]:    
     placements = _allocate_nodes_to_placements(nodes, excl_job_id, lkp)
     region = lkp.node_region(nodes[0])
     max_distance = lkp.node_nodeset(nodes[0]).get('placement_max_distance')
+    pooled = _claim_pooled_placements(placements, excl_job_id, lkp) if excl_job_id else set()
 
     if log.isEnabledFor(logging.DEBUG):
         debug_p = {p.placement: to_hostlist(p.nodes) for p in placements}
@@ -581,7 +638,8 @@ def create_nodeset_placements(nodes: List[str], excl_job_id:Optional[int], lkp:
         )
 
     requests = {
-        p.placement: create_placement_request(p.placement, region, max_distance) for p in placements if p.placement
+        p.placement: create_placement_request(p.placement, region, max_distance)
+        for p in placements if p.placement and p.placement not in pooled
     }
     if not requests:
         return placements
@@ -609,7 +667,9 @@ def create_nodeset_placements(nodes: List[str], excl_job_id:Optional[int], lkp:
     if failed:
         reqs = [f"{e}" for _, e in failed.values()]
         log.fatal("failed to create placement policies: {}".format("; ".join(reqs)))
-    operations = {group: wait_for_operation(op) for group, op in submitted.items()}
+    tracker = op_tracker.tracker()
+    futures = {group: tracker.track(op) for group, op in submitted.items()}
+    operations = {group: fut.result() for group, fut in futures.items()}
     for group, op in operations.items():
         if "error" in op:
             msg = "; ".join(
@@ -653,9 +713,12 @@ def main(nodelist: str) -> None:
     if not nodes:
         log.info("No nodes to resume")
         return
-    resume_data = get_resume_file_data()
-    log.info(f"resume {util.to_hostlist(nodes)}")
-    resume_nodes(nodes, resume_data)
+    util.init_tracing("resume")
+    util.init_metrics("resume")
+    with tracing.span("resume", nodes=util.to_hostlist(nodes), count=len(nodes)), metrics.PHASE_DURATION.time(phase="resume"):
+        resume_data = get_resume_file_data()
+        log.info(f"resume {util.to_hostlist(nodes)}")
+        resume_nodes(nodes, resume_data)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -34,6 +34,19 @@ if [ -n "${SLURM_RESUME_FILE-}" ] && [ -f "$SLURM_RESUME_FILE" ]; then
 	cp "$SLURM_RESUME_FILE" "$UNIQUE_RESUME_FILE"
 fi
 
+# Hand nodes over to the broker if it's running, see broker.py
+BROKER_ARGS=(resume "${ALL_ARGS[@]}")
+if [ -n "$UNIQUE_RESUME_FILE" ]; then
+	BROKER_ARGS+=(--resume-file "$UNIQUE_RESUME_FILE")
+fi
+if "${SCRIPT_DIR}/broker_client.py" "${BROKER_ARGS[@]}"; then
+	# broker has read resume data before accepting the request
+	if [ -n "$UNIQUE_RESUME_FILE" ]; then
+		rm -f "$UNIQUE_RESUME_FILE"
+	fi
+	exit 0
+fi
+
 SLURM_RESUME_FILE="${UNIQUE_RESUME_FILE}"
 "${PYTHON_SCRIPT}" "${ALL_ARGS[@]}" &
 disown
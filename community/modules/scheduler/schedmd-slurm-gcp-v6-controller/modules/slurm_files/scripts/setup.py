@@ -36,6 +36,7 @@ from util import (
 )
 import conf
 import slurmsync
+import tracing
 
 from setup_network_storage import (
     setup_network_storage,
@@ -85,6 +86,7 @@ SSSSSSSSSSSS    SSS    SSSSSSSSSSSSS    SSSS        SSSS     SSSS     SSSS
 
 """
 _MAINTENANCE_SBATCH_SCRIPT_PATH = dirs.custom_scripts / "perform_maintenance.sh"
+_BROKER_SERVICE_PATH = Path("/etc/systemd/system/slurm_gcp_broker.service")
 
 def start_motd():
     """advise in motd that slurm is currently configuring"""
@@ -309,6 +311,30 @@ gcloud compute instances perform-maintenance $VM_NAME \
     util.chown_slurm(_MAINTENANCE_SBATCH_SCRIPT_PATH, mode=0o755)
 
 
+def setup_resume_broker():
+    """Runs broker of resume/suspend requests (see broker.py) if enabled"""
+    if not lookup().cfg.enable_resume_broker:
+        if _BROKER_SERVICE_PATH.exists():
+            run("systemctl disable --now slurm_gcp_broker.service", timeout=30)
+        return
+
+    _BROKER_SERVICE_PATH.write_text(f"""[Unit]
+Description=Slurm GCP resume/suspend broker
+After=slurmctld.service
+
+[Service]
+User=slurm
+ExecStart={dirs.scripts}/broker.py
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+""")
+    run("systemctl daemon-reload", timeout=30)
+    run("systemctl enable slurm_gcp_broker.service", timeout=30)
+    run("systemctl restart slurm_gcp_broker.service", timeout=30)
+
+
 def update_system_config(file, content):
     """Add system defaults options for service files"""
     sysconfig = Path("/etc/sysconfig")
@@ -372,16 +398,18 @@ def configure_dirs():
         sl.symlink_to(tgt)
 
     # copy auxiliary scripts
-    for dst_folder, src_file in ((lookup().cfg.slurm_bin_dir,
-                                  Path("sort_nodes.py")),
-                                 (dirs.custom_scripts / "task_prolog.d",
-                                  Path("tools/task-prolog")),
-                                 (dirs.custom_scripts / "task_epilog.d",
-                                  Path("tools/task-epilog"))):
+    for dst_folder, src_file, mode in ((lookup().cfg.slurm_bin_dir,
+                                        Path("sort_nodes.py"), 0o755),
+                                       (lookup().cfg.slurm_bin_dir,
+                                        Path("hostlist.py"), 0o644), # library imported by sort_nodes.py
+                                       (dirs.custom_scripts / "task_prolog.d",
+                                        Path("tools/task-prolog"), 0o755),
+                                       (dirs.custom_scripts / "task_epilog.d",
+                                        Path("tools/task-epilog"), 0o755)):
         dst = Path(dst_folder) / src_file.name
         util.mkdirp(dst.parent)
         shutil.copyfile(util.scripts_dir / src_file, dst)
-        os.chmod(dst, 0o755)
+        os.chmod(dst, mode)
 
 
 def self_report_controller_address(lkp: util.Lookup) -> None:
@@ -459,6 +487,8 @@ def setup_controller():
     run("systemctl start slurm_load_bq.timer", timeout=30)
     run("systemctl status slurm_load_bq.timer", timeout=30)
 
+    setup_resume_broker()
+
     # Add script to perform maintenance
     setup_maintenance_script()
 
@@ -525,22 +555,26 @@ def setup_compute():
 
     sysconf = f"""SLURMD_OPTIONS='{" ".join(slurmd_options)}'"""
     update_system_config("slurmd", sysconf)
-    install_custom_scripts()
+    with tracing.span("setup.install_custom_scripts"):
+        install_custom_scripts()
 
     setup_nss_slurm()
-    setup_network_storage()
+    with tracing.span("setup.network_storage"):
+        setup_network_storage()
 
     has_gpu = run("lspci | grep --ignore-case 'NVIDIA' | wc -l", shell=True).returncode
     if has_gpu:
         run("nvidia-smi")
 
-    run_custom_scripts()
+    with tracing.span("setup.run_custom_scripts"):
+        run_custom_scripts()
 
     setup_sudoers()
-    if not lkp.cfg.enable_slurm_auth:
-      run("systemctl restart munge", timeout=30)
-    run("systemctl enable slurmd", timeout=30)
-    run("systemctl restart slurmd", timeout=30)
+    with tracing.span("setup.start_slurmd"):
+        if not lkp.cfg.enable_slurm_auth:
+          run("systemctl restart munge", timeout=30)
+        run("systemctl enable slurmd", timeout=30)
+        run("systemctl restart slurmd", timeout=30)
     run("systemctl enable --now slurmcmd.timer", timeout=30)
 
     log.info("Check status of cluster services")
@@ -606,7 +640,28 @@ def setup_cloud_ops() -> None:
         raise
 
 
+def _init_tracing(started_ns: int) -> tracing.Span:
+    """
+    Continues trace of resume that created this instance, if any.
+    Spans preceding config fetch (needed to enable tracing) are recorded retroactively.
+    """
+    try:
+        traceparent = util.instance_metadata(f"attributes/{tracing.TRACEPARENT_METADATA_KEY}", silent=True)
+    except util.MetadataNotFoundError:
+        traceparent = None
+    util.init_tracing("setup", parent=tracing.SpanContext.from_traceparent(traceparent))
+
+    # time since kernel start till setup start
+    uptime_s = float(Path("/proc/uptime").read_text().split()[0])
+    boot_ns = time.time_ns() - int(uptime_s * 1e9)
+    tracing.start_span("vm.boot", start_ns=boot_ns).end(started_ns)
+    root = tracing.start_span("setup", start_ns=started_ns, role=lookup().instance_role)
+    tracing.start_span("setup.fetch_config", parent=root.context, start_ns=started_ns).end()
+    return root
+
+
 def main():
+    started_ns = time.time_ns()
     start_motd()
 
     log.info("Starting setup, fetching config")
@@ -622,16 +677,23 @@ def main():
             log.exception(f"unexpected error while fetching config, sleeping for {sleep_seconds}s")
         time.sleep(sleep_seconds)
     log.info("Config fetched")
-    setup_cloud_ops()
-    configure_dirs()
-    # call the setup function for the instance type
-    {
-        "controller": setup_controller,
-        "compute": setup_compute,
-        "login": setup_login,
-    }.get(
-        lookup().instance_role,
-        lambda: log.fatal(f"Unknown node role: {lookup().instance_role}"))()
+    try:
+        root = _init_tracing(started_ns)
+    except Exception:
+        log.exception("failed to initialize tracing")
+        root = tracing.start_span("setup")
+
+    with tracing.use_span(root):
+        setup_cloud_ops()
+        configure_dirs()
+        # call the setup function for the instance type
+        {
+            "controller": setup_controller,
+            "compute": setup_compute,
+            "login": setup_login,
+        }.get(
+            lookup().instance_role,
+            lambda: log.fatal(f"Unknown node role: {lookup().instance_role}"))()
 
     end_motd()
 
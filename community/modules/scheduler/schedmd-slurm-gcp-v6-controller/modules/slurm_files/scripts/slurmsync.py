@@ -24,9 +24,12 @@ import shlex
 from datetime import datetime, timedelta
 from itertools import chain
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Dict, Tuple, List, Optional, Protocol, Any
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Tuple, List, Optional, Protocol, Any
 from functools import lru_cache
+from time import monotonic, sleep
 
 import util
 from util import (
@@ -41,12 +44,16 @@ from util import (
     NodeState,
     chunked,
     dirs,
+    cfg_timedelta,
 )
 from util import lookup
 from suspend import delete_instances
 import tpu
 import conf
 import watch_delete_vm_op
+import local_pubsub
+import metrics
+import placement_pool
 
 log = logging.getLogger()
 
@@ -228,34 +235,26 @@ def _find_tpu_node_action(nodename, state) -> NodeAction:
 
     return NodeActionUnchanged()
 
-def get_node_action(nodename: str) -> NodeAction:
-    """Determine node/instance status that requires action"""
-    lkp = lookup()
-    state = lkp.node_state(nodename)
-
-    if lkp.node_is_fr(nodename):
-        fr = lkp.future_reservation(lkp.node_nodeset(nodename))
-        assert fr
-        if action := get_fr_action(fr, state):
-            return action
-
-    if lkp.node_is_dyn(nodename):
-        return _find_dynamic_node_status()
-
-    if lkp.node_is_tpu(nodename):
-        return _find_tpu_node_action(nodename, state)
-
-    # split below is workaround for VMs whose hostname is FQDN
-    inst = lkp.instance(nodename.split(".")[0])
-    power_flags = frozenset(
-        ("POWER_DOWN", "POWERING_UP", "POWERING_DOWN", "POWERED_DOWN")
-    ) & (state.flags if state is not None else set())
-
-    if (state is None) and (inst is None):
+_POWER_FLAGS = frozenset(("POWER_DOWN", "POWERING_UP", "POWERING_DOWN", "POWERED_DOWN"))
+
+
+def _decide_node_action(
+        state: Optional[NodeState],
+        inst_status: Optional[str],
+        preemptible: bool,
+        is_static: bool) -> Optional[NodeAction]:
+    """
+    Action for node of regular (not TPU, nor dynamic) nodeset.
+    Depends only on a handful of values, so `classify_nodes` tabulates it.
+    Returns None for potential orphans, decision for them depends on instance age, see `_orphan_action`.
+    `inst_status` is None if there is no instance.
+    """
+    if (state is None) and (inst_status is None):
         # Should never happen
         return NodeActionUnknown(None, None)
-    if inst is None:
+    if inst_status is None:
         assert state is not None # to keep type-checker happy
+        power_flags = _POWER_FLAGS & state.flags
         if "POWERING_UP" in state.flags:
             return NodeActionUnchanged()
         if state.base == "DOWN" and "POWERED_DOWN" in state.flags:
@@ -268,34 +267,159 @@ def get_node_action(nodename: str) -> NodeAction:
             return NodeActionDown(reason="Unbacked instance")
         if state.base == "DOWN" and not power_flags:
             return NodeActionPowerDown()
-        if "POWERED_DOWN" in state.flags and lkp.is_static_node(nodename):
+        if "POWERED_DOWN" in state.flags and is_static:
             return NodeActionPowerUp()
     elif (
         state is not None
         and "POWERED_DOWN" not in state.flags
         and "POWERING_DOWN" not in state.flags
-        and inst.status == "TERMINATED"
+        and inst_status == "TERMINATED"
     ):
-        if inst.scheduling.preemptible:
+        if preemptible:
             return NodeActionPrempt()
         if state.base != "DOWN":
             return NodeActionDown(reason="Instance terminated")
-    elif (state is None or "POWERED_DOWN" in state.flags) and inst.status == "RUNNING":
-        log.info("%s is potential orphan node", nodename)
-        threshold = timedelta(seconds=90)
-        age = util.now() - inst.creation_timestamp
-        log.info(f"{nodename} state: {state}, age: {age}")
-        if age < threshold:
-            log.info(f"{nodename} not marked as orphan, it started less than {threshold.seconds}s ago ({age.seconds}s)")
-            return NodeActionUnchanged()
-        return NodeActionDelete()
+    elif (state is None or "POWERED_DOWN" in state.flags) and inst_status == "RUNNING":
+        return None
     elif state is None:
         # if state is None here, the instance exists but it's not in Slurm
-        return NodeActionUnknown(slurm_state=state, instance_state=inst.status)
+        return NodeActionUnknown(slurm_state=state, instance_state=inst_status)
 
     return NodeActionUnchanged()
 
 
+def _orphan_action(nodename: str, state: Optional[NodeState], inst: util.Instance) -> NodeAction:
+    log.info("%s is potential orphan node", nodename)
+    threshold = timedelta(seconds=90)
+    age = util.now() - inst.creation_timestamp
+    log.info(f"{nodename} state: {state}, age: {age}")
+    if age < threshold:
+        log.info(f"{nodename} not marked as orphan, it started less than {threshold.seconds}s ago ({age.seconds}s)")
+        return NodeActionUnchanged()
+    return NodeActionDelete()
+
+
+def get_node_action(nodename: str) -> NodeAction:
+    """Determine node/instance status that requires action"""
+    lkp = lookup()
+    state = lkp.node_state(nodename)
+
+    if lkp.node_is_fr(nodename):
+        fr = lkp.future_reservation(lkp.node_nodeset(nodename))
+        assert fr
+        if action := get_fr_action(fr, state):
+            return action
+
+    if lkp.node_is_dyn(nodename):
+        return _find_dynamic_node_status()
+
+    if lkp.node_is_tpu(nodename):
+        return _find_tpu_node_action(nodename, state)
+
+    # split below is workaround for VMs whose hostname is FQDN
+    inst = lkp.instance(nodename.split(".")[0])
+    action = _decide_node_action(
+        state,
+        inst_status=inst.status if inst else None,
+        preemptible=bool(inst and inst.scheduling.preemptible),
+        is_static=lkp.is_static_node(nodename))
+    if action is None:
+        assert inst
+        return _orphan_action(nodename, state, inst)
+    return action
+
+
+@dataclass(frozen=True)
+class _NodesetTraits:
+    """Properties of nodeset that `get_node_action` would otherwise resolve for every node"""
+    fr: Optional[FutureReservation]
+    is_dyn: bool
+    is_tpu: bool
+    static_end: int # nodes with index below are static
+
+    @classmethod
+    def of(cls, lkp: util.Lookup, nodeset_name: str) -> "_NodesetTraits":
+        if nodeset_name in lkp.cfg.nodeset_tpu:
+            ns = lkp.cfg.nodeset_tpu[nodeset_name]
+        else:
+            ns = lkp.cfg.nodeset[nodeset_name]
+        fr = None
+        if ns.future_reservation:
+            fr = lkp.future_reservation(ns)
+            assert fr
+        static, dynamic = lkp.static_dynamic_sizes(ns)
+        return cls(
+            fr=fr,
+            is_dyn=lkp.cfg.nodeset_dyn.get(nodeset_name) is not None,
+            is_tpu=lkp.cfg.nodeset_tpu.get(nodeset_name) is not None,
+            static_end=min(static, static + dynamic),
+        )
+
+
+def classify_nodes(lkp: util.Lookup, nodes: Iterable[str]) -> Dict[NodeAction, List[str]]:
+    """
+    Batch equivalent of `get_node_action`, nodes grouped by action.
+    Nodeset properties and Slurm states of nodeset nodes are resolved once per nodeset,
+    and actions are memoized in decision tables keyed by (state, instance status, preemptible, static),
+    so per node it costs a regex match and a few dict lookups.
+    """
+    table = lkp.slurm_node_table()
+    instances = lkp.instances()
+    traits: Dict[str, _NodesetTraits] = {}
+    states: Dict[str, Dict[int, NodeState]] = {} # by node prefix, then suffix
+    decisions: Dict[Tuple[Optional[NodeState], Optional[str], bool, bool], Optional[NodeAction]] = {}
+    fr_decisions: Dict[Tuple[str, Optional[NodeState]], Optional[NodeAction]] = {}
+    groups: Dict[NodeAction, List[str]] = defaultdict(list)
+    unchanged = _find_dynamic_node_status()
+
+    for name in nodes:
+        short = name.split(".")[0]
+        m = lkp.node_desc_regex.match(short)
+        if m is None: # not a valid node name, let `get_node_action` handle (fail) it
+            groups[get_node_action(name)].append(name)
+            continue
+        ns_name = m["nodeset"]
+        if (tr := traits.get(ns_name)) is None:
+            tr = traits[ns_name] = _NodesetTraits.of(lkp, ns_name)
+        if (ns_states := states.get(m["prefix"])) is None:
+            ns_states = states[m["prefix"]] = table.by_suffix(m["prefix"])
+        suffix = m["suffix"]
+        state = None
+        if short == name and suffix is not None and suffix.isdecimal():
+            state = ns_states.get(int(suffix))
+        if state is None:
+            state = table.get(name) if name in table else lkp.node_state(name)
+
+        if tr.fr is not None:
+            key = (ns_name, state)
+            if key not in fr_decisions:
+                fr_decisions[key] = get_fr_action(tr.fr, state)
+            if (action := fr_decisions[key]) is not None:
+                groups[action].append(name)
+                continue
+        if tr.is_dyn:
+            groups[unchanged].append(name)
+            continue
+        if tr.is_tpu:
+            groups[_find_tpu_node_action(name, state)].append(name)
+            continue
+
+        inst = instances.get(short)
+        is_static = suffix is not None and suffix.isdecimal() and int(suffix) < tr.static_end
+        dkey = (
+            state,
+            inst.status if inst else None,
+            bool(inst and inst.scheduling.preemptible),
+            is_static)
+        if dkey not in decisions:
+            decisions[dkey] = _decide_node_action(*dkey)
+        if (action := decisions[dkey]) is None:
+            assert inst
+            action = _orphan_action(name, state, inst)
+        groups[action].append(name)
+    return groups
+
+
 def delete_resource_policies(links: list[str], lkp: util.Lookup) -> None:
     requests = {}
     for link in links:
@@ -363,32 +487,41 @@ def sync_placement_groups():
     keep_jobs.add("0")  # Job 0 is a placeholder for static node placement
 
     to_delete = []
+    pool_policies = []
     pg_regex = re.compile(
         rf"{lkp.cfg.slurm_cluster_name}-slurmgcp-managed-(?P<ns>[^\s\-]+)-(?P<job_id>\d+)-(?P<index>\d+)"
     )
     
     for pg in _get_resource_policies(lkp):
         name = pg["name"]
+        if placement_pool.is_pool_policy(lkp, name):
+            pool_policies.append(pg)
+            continue
     
         if (mtch := pg_regex.match(name)) is None:
             log.warning(f"Unexpected resource policy {name=}")
             continue
         if mtch.group("job_id") not in keep_jobs:
             to_delete.append(pg["selfLink"])
+    to_delete.extend(placement_pool.collect_garbage(lkp, pool_policies, keep_jobs))
 
     if to_delete:
         delete_resource_policies(to_delete, lkp)
+    if placement_pool.refill(lkp):
+        # so next cycle sees created policies, even if caches are kept warm
+        _get_resource_policies.cache_clear()
+        _get_resource_policies_in_region.cache_clear()
 
 
 def sync_instances():
     compute_instances = {
         name for name, inst in lookup().instances().items() if inst.role == "compute"
     }
-    slurm_nodes = set(lookup().slurm_nodes().keys())
+    slurm_nodes = set(lookup().slurm_node_table().names)
     log.debug(f"reconciling {len(compute_instances)} GCP instances and {len(slurm_nodes)} Slurm nodes.")
 
-    for action, nodes in util.groupby_unsorted(list(compute_instances | slurm_nodes), get_node_action):
-        action.apply(list(nodes))
+    for action, nodes in classify_nodes(lookup(), compute_instances | slurm_nodes).items():
+        action.apply(nodes)
 
 
 def reconfigure_slurm():
@@ -405,11 +538,16 @@ def reconfigure_slurm():
     util.update_config(cfg_new)
 
     if lookup().is_controller:
-        conf.gen_controller_configs(lookup())
-        log.info("Restarting slurmctld to make changes take effect.")
+        action = conf.gen_controller_configs(lookup())
+        if action == conf.ConfAction.NONE:
+            log.info("Generated Slurm configuration didn't change, nothing to do.")
+            return
         try:
-            # TODO: consider removing "restart" since "reconfigure" should restart slurmctld as well
-            run("sudo systemctl restart slurmctld.service", check=False)
+            if action == conf.ConfAction.RESTART:
+                log.info("Restarting slurmctld to make changes take effect.")
+                run("sudo systemctl restart slurmctld.service", check=False)
+            else:
+                log.info("Reconfiguring slurmctld to make changes take effect.")
             util.scontrol_reconfigure(lookup())
         except Exception:
             log.exception("failed to reconfigure slurmctld")
@@ -594,68 +732,206 @@ def process_messages(lkp: util.Lookup) -> None:
         log.exception("failed during watching delete VM operations")
 
 
-def main():
-    lkp = lookup()
-    if util.should_mount_slurm_bucket() and not lkp.is_controller:
-        return
-    try:
-        reconfigure_slurm()
-    except Exception:
-        log.exception("failed to reconfigure slurm")
-    if lkp.is_controller:
-        try:
-            process_messages(lkp)
-        except:
-            log.exception("failed to process messages")
+SLURMSYNC_DEADLINE = timedelta(minutes=5)
 
-        try:
-            sync_instances()
-        except Exception:
-            log.exception("failed to sync instances")
 
+@dataclass(frozen=True)
+class Phase:
+    name: str
+    fn: Callable[[], Any]
+    err_msg: str
+
+
+def prefetch_tasks(lkp: util.Lookup) -> List[Phase]:
+    """Data shared by phases, fetched concurrently, each fetch fills its own cache"""
+    return [
+        # results are cached by `lkp` and `_get_resource_policies`
+        Phase("instances", lkp.instances, "failed to fetch instances"),
+        Phase("slurm_nodes", lkp.slurm_node_table, "failed to fetch slurm nodes"),
+        Phase("jobs", lkp.get_jobs, "failed to fetch jobs"),
+        Phase("resource_policies", lambda: _get_resource_policies(lkp), "failed to fetch resource policies"),
+    ]
+
+
+def controller_phases(lkp: util.Lookup) -> List[Phase]:
+    """
+    Phases of controller sync, in order. They run one after another,
+    since they share the rest of `lkp` caches, which are not safe to fill from several threads.
+    """
+    return [
+        Phase("process_messages", lambda: process_messages(lkp), "failed to process messages"),
+        # acknowledge observed deletions before issuing new ones
+        Phase("sync_instances", sync_instances, "failed to sync instances"),
+        Phase("sync_flex_migs", lambda: sync_flex_migs(lkp), "failed to sync DWS Flex MIGs"),
+        Phase("sync_placement_groups", sync_placement_groups, "failed to sync placement groups"),
+        Phase("update_topology", lambda: update_topology(lkp), "failed to update topology"),
+        Phase("sync_maintenance_reservation", lambda: sync_maintenance_reservation(lkp),
+              "failed to sync slurm reservation for scheduled maintenance"),
+        Phase("sync_opportunistic_maintenance", lambda: sync_opportunistic_maintenance(lkp),
+              "failed to sync opportunistic reservation for scheduled maintenance"),
+    ]
+
+
+def _warm_shared_caches(lkp: util.Lookup) -> None:
+    """Fills caches used by all prefetch tasks, before they run concurrently"""
+    lkp.compute
+    lkp.instance_inventory
+    util.rate_limiter()
+
+
+def _run_phase(p: Phase) -> str:
+    """Runs phase to completion, returns its status"""
+    with metrics.PHASE_DURATION.time(phase=p.name):
         try:
-            sync_flex_migs(lkp)
+            p.fn()
         except Exception:
-            log.exception("failed to sync DWS Flex MIGs")
+            log.exception(p.err_msg)
+            return "failed"
+    return "done"
+
+
+def run_controller_tasks(lkp: util.Lookup) -> None:
+    """
+    Prefetches shared data, then runs phases one by one. Deadline is only checked
+    before starting a phase, started phase always runs to completion, so no phase
+    is left running when slurmsync exits or daemon starts the next cycle.
+    """
+    deadline = monotonic() + cfg_timedelta(lkp.cfg.slurmsync_deadline, SLURMSYNC_DEADLINE).total_seconds()
+    _warm_shared_caches(lkp)
+    prefetch = prefetch_tasks(lkp)
+    with ThreadPoolExecutor(max_workers=len(prefetch)) as exe:
+        status = dict(zip((p.name for p in prefetch), exe.map(_run_phase, prefetch)))
+    for p in controller_phases(lkp):
+        if monotonic() >= deadline:
+            log.warning(f"phase {p.name} was not started before deadline")
+            status[p.name] = "skipped"
+        else:
+            status[p.name] = _run_phase(p)
+    for name, st in status.items():
+        metrics.PHASE_STATUS.inc(phase=name, status=st)
 
-        try:
-            sync_placement_groups()
-        except Exception:
-            log.exception("failed to sync placement groups")
 
+def main():
+    lkp = lookup()
+    if util.should_mount_slurm_bucket() and not lkp.is_controller:
+        return
+    util.init_metrics("slurmsync")
+    with metrics.PHASE_DURATION.time(phase="slurmsync"):
         try:
-            update_topology(lkp)
+            reconfigure_slurm()
         except Exception:
-            log.exception("failed to update topology")
+            log.exception("failed to reconfigure slurm")
+        if lkp.is_controller:
+            run_controller_tasks(lkp)
 
         try:
-            sync_maintenance_reservation(lkp)
+            # served from the same bucket manifest as `_list_config_blobs`
+            install_custom_scripts(check_hash=True)
         except Exception:
-            log.exception("failed to sync slurm reservation for scheduled maintenance")
+            log.exception("failed to sync custom scripts")
+    metrics.flush() # daemon doesn't exit between cycles
+
+
+# Cached data sources kept warm between cycles in daemon mode, with default TTLs.
+# TTLs can be overridden by `slurmsync_cache_ttl.<source>` config (in seconds).
+# Sources that must reflect current state are refreshed every cycle by default,
+# note that `instances` are additionally backed by `InstanceInventory`.
+SLURMSYNC_INTERVAL = timedelta(seconds=30)
+CACHE_SOURCES: Dict[str, Tuple[timedelta, Tuple[Any, ...]]] = {
+    "instances": (timedelta(0), (util.Lookup.instances, get_upcoming_maintenance)),
+    "slurm_nodes": (timedelta(0), (util.Lookup.slurm_node_table, util.Lookup.slurm_nodes)),
+    "jobs": (timedelta(0), (util.Lookup.get_jobs, util.Lookup.job)),
+    "resource_policies": (timedelta(0), (_get_resource_policies, _get_resource_policies_in_region)),
+    "reservations": (timedelta(0), (util.Lookup._get_reservation, util.Lookup._get_future_reservation)),
+    "migs": (timedelta(0), (util.Lookup.get_mig, util.Lookup.get_mig_instances, util.Lookup.get_mig_list)),
+    "templates": (timedelta(hours=1), (util.Lookup.template_info,)),
+    "machine_types": (timedelta(hours=1), (util.Lookup.machine_types,)),
+}
+
+# `Lookup` caches kept as long as config doesn't change: API clients, handles,
+# and values derived only from config or instance metadata.
+# Other `Lookup` caches not listed in `CACHE_SOURCES` are refreshed every cycle.
+LOOKUP_KEPT_CACHES = (
+    "compute", "instance_inventory", "metadata_cache", "cfg_hash",
+    "control_addr", "control_host_addr", "hostname", "hostname_fqdn",
+    "instance_role", "instance_role_safe", "zone",
+)
+# Module-level caches derived from config
+CONFIG_CACHES = (util.rate_limiter,)
 
-        try:
-            sync_opportunistic_maintenance(lkp)
-        except Exception:
-            log.exception("failed to sync opportunistic reservation for scheduled maintenance")
 
+def _lookup_caches() -> Dict[str, Any]:
+    """All cached methods and properties of `Lookup`, by name"""
+    res = {}
+    for name, attr in vars(util.Lookup).items():
+        fn = attr.fget if isinstance(attr, property) else attr
+        if hasattr(fn, "cache_clear"):
+            res[name] = fn
+    return res
 
-    try:
-        # TODO: it performs 1 to 4 GCS list requests,
-        # use cached version, combine with `_list_config_blobs`
-        install_custom_scripts(check_hash=True)
-    except Exception:
-        log.exception("failed to sync custom scripts")
 
+@dataclass
+class WarmCaches:
+    """Expires cached data between cycles of long-running slurmsync"""
+    lkp: Optional[util.Lookup] = None
+    refreshed: Dict[str, float] = field(default_factory=dict)
+
+    def expire(self, lkp: util.Lookup) -> None:
+        lookup_caches = _lookup_caches()
+        if lkp is not self.lkp: # config was updated, drop everything cached for old one
+            self.lkp, self.refreshed = lkp, {}
+            for fn in chain(lookup_caches.values(), CONFIG_CACHES):
+                fn.cache_clear()
+
+        listed = {fn for _, fns in CACHE_SOURCES.values() for fn in fns}
+        for name, fn in lookup_caches.items():
+            if name not in LOOKUP_KEPT_CACHES and fn not in listed:
+                fn.cache_clear()
+
+        ts = monotonic()
+        for name, (default_ttl, fns) in CACHE_SOURCES.items():
+            ttl = cfg_timedelta(lkp.cfg.slurmsync_cache_ttl[name], default_ttl)
+            if name in self.refreshed and ts - self.refreshed[name] < ttl.total_seconds():
+                continue
+            for fn in fns:
+                fn.cache_clear()
+            self.refreshed[name] = ts
+
+        # per-cycle state, never kept between cycles
+        util.bucket_manifest.cache_clear()
+        local_pubsub.reset()
+
+
+def run_daemon() -> None:
+    """Runs sync cycles on a timer, reusing imports, API clients and warm caches"""
+    caches = WarmCaches()
+    while True:
+        start = monotonic()
+        try:
+            caches.expire(lookup())
+            main()
+        except Exception:
+            log.exception("slurmsync cycle failed")
+        interval = cfg_timedelta(lookup().cfg.slurmsync_interval, SLURMSYNC_INTERVAL)
+        sleep(max(interval.total_seconds() - (monotonic() - start), 0))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    _ = util.init_log_and_parse(parser)
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and sync every `slurmsync_interval` seconds (default 30)",
+    )
+    args = util.init_log_and_parse(parser)
 
     pid_file = (Path("/tmp") / Path(__file__).name).with_suffix(".pid")
     with pid_file.open("w") as fp:
         try:
             fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            main()
+            if args.daemon:
+                run_daemon()
+            else:
+                main()
         except BlockingIOError:
             sys.exit(0)
@@ -40,6 +40,8 @@ import uuid
 from typing import List, Optional, Dict
 from collections import OrderedDict
 
+import hostlist
+
 def order(paths: List[List[str]]) -> List[str]:
     """
     Orders the leaves of the tree in a way that minimizes the sum of distance in between 
@@ -102,9 +104,7 @@ def make_path(node_name: str, inst: Optional[Instance]) -> List[str]:
 
 
 def to_hostnames(nodelist: str) -> List[str]:
-    cmd = ["scontrol", "show", "hostnames", nodelist]
-    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
-    return [n.decode("utf-8") for n in out.splitlines()]
+    return hostlist.to_hostnames(nodelist)
 
 
 def get_instances(node_names: List[str]) -> Dict[str, Optional[Instance]]:
@@ -19,6 +19,7 @@ from typing import List, Any
 import argparse
 import logging
 
+import metrics
 import util
 from util import (
     log_api_request,
@@ -71,15 +72,16 @@ def delete_instances(instances):
     requests = {inst: delete_instance_request(inst) for inst in valid}
 
     log.info(f"to delete {len(valid)} instances ({to_hostlist(valid)})")
+    metrics.NODES.inc(len(valid), op="suspend", outcome="requested")
     ops, failed = batch_execute(requests)
     for node, (_, err) in failed.items():
         log.error(f"instance {node} failed to delete: {err}")
+    metrics.NODES.inc(len(failed), op="suspend", outcome="failed")
     
     log.info(f"deleting {len(ops)} instances {to_hostlist(ops.keys())}")
+    lookup().instance_inventory.mark_deleting(ops.keys())
 
-    topic = watch_delete_vm_op.watch_delete_vm_op_topic()
-    for node, op in ops.items():
-        topic.publish(op, node)
+    watch_delete_vm_op.watch_delete_vm_op_topic().publish_many(ops)
 
 
 
@@ -113,7 +115,9 @@ def main(nodelist):
         return
 
     log.info(f"suspend {nodelist}")
-    suspend_nodes(pm_nodes)
+    util.init_metrics("suspend")
+    with metrics.PHASE_DURATION.time(phase="suspend"):
+        suspend_nodes(pm_nodes)
 
 
 if __name__ == "__main__":
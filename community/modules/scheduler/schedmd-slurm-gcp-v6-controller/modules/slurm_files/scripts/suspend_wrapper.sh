@@ -22,6 +22,11 @@ PYTHON_SCRIPT="${SCRIPT_DIR}/suspend.py"
 # Capture all arguments passed by Slurm (the nodelist).
 ALL_ARGS=("$@")
 
+# Hand nodes over to the broker if it's running, see broker.py
+if "${SCRIPT_DIR}/broker_client.py" suspend "${ALL_ARGS[@]}"; then
+	exit 0
+fi
+
 "${PYTHON_SCRIPT}" "${ALL_ARGS[@]}" &
 disown
 
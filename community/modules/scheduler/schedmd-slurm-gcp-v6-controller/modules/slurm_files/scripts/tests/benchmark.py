@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of controller scripts against a synthetic cluster.
+
+Builds config out of `tests/common.py` fixtures (many nodesets, partitions,
+TPU, flex and future reservation nodesets), fake `scontrol` executable
+and fake compute API, then reports wall time, number of API and `scontrol`
+calls and peak memory (tracemalloc) for each entry point.
+
+Usage:
+    python tests/benchmark.py --nodes 50000
+    python tests/benchmark.py --nodes 5000 --only sync_instances,gen_topology
+
+Each entry point runs with a fresh `Lookup` (cold in-memory caches), while
+on-disk caches (e.g. instance inventory) are shared between entry points,
+same as between scripts running on the controller.
+
+Not collected by pytest (name doesn't match `test_*`).
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import argparse
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+from dataclasses import asdict, dataclass
+import json
+import logging
+from pathlib import Path
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest.mock
+
+_TESTS_DIR = Path(__file__).resolve().parent
+for p in (_TESTS_DIR, _TESTS_DIR.parent):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+from common import TstCfg, TstNodeset, TstPartition, SOME_TS # needed to import util
+import util
+import file_cache
+import local_pubsub
+import conf
+import resume
+import slurmsync
+import tpu
+
+CLUSTER = "bench"
+PROJECT = "bench-project"
+REGION = "us-central1"
+ZONE = f"{REGION}-a"
+TEMPLATE = f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/global/instanceTemplates/bench-template"
+SUBNETWORK = f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/regions/{REGION}/subnetworks/default"
+FUTURE_RESERVATION = f"projects/{PROJECT}/zones/{ZONE}/futureReservations/bench-fr"
+PAGE_SIZE = 500 # default `maxResults` of aggregatedList
+
+
+@dataclass(frozen=True)
+class ClusterSpec:
+    nodes: int = 50_000
+    nodesets: int = 50
+    tpu_nodesets: int = 2
+    flex_nodesets: int = 2
+    fr_nodesets: int = 2
+    nodesets_per_partition: int = 5
+    static_fraction: float = 0.5 # fraction of static nodes in each nodeset
+    dynamic_up_fraction: float = 0.2 # fraction of dynamic nodes that are powered up
+    drift_fraction: float = 0.005 # fraction of nodes that require action from slurmsync
+    seed: int = 0
+
+    @property
+    def nodes_per_nodeset(self) -> int:
+        total = self.nodesets + self.tpu_nodesets + self.flex_nodesets + self.fr_nodesets
+        return max(1, self.nodes // total)
+
+
+@dataclass
+class Cluster:
+    spec: ClusterSpec
+    cfg: util.NSDict
+    instances: List[Dict[str, Any]] # as returned by compute API
+    slurm_nodes: List[Dict[str, Any]] # as returned by `scontrol show nodes --json`
+    down_nodes: List[str] # powered down nodes of regular nodesets, candidates for resume
+    jobs: List[resume.ResumeJobData] # exclusive jobs requesting some of `down_nodes`
+
+
+def _gcp_ts(dt) -> str:
+    return dt.isoformat(timespec="milliseconds")
+
+
+def make_cluster(spec: ClusterSpec, root: Path) -> Cluster:
+    rnd = random.Random(spec.seed)
+    cnt = spec.nodes_per_nodeset
+    static = int(cnt * spec.static_fraction)
+
+    def nodeset(name: str, **kwargs) -> TstNodeset:
+        return TstNodeset(
+            nodeset_name=name,
+            node_count_static=static,
+            node_count_dynamic_max=cnt - static,
+            instance_template=TEMPLATE,
+            zone_policy_allow=[ZONE],
+            **kwargs)
+
+    regular = {f"ns{i}": nodeset(f"ns{i}", enable_placement=(i % 2 == 0)) for i in range(spec.nodesets)}
+    flex = {f"flex{i}": nodeset(f"flex{i}", enable_placement=False) for i in range(spec.flex_nodesets)}
+    fr = {f"fr{i}": nodeset(f"fr{i}", future_reservation=FUTURE_RESERVATION) for i in range(spec.fr_nodesets)}
+    tpus = {
+        f"tpu{i}": TstNodeset(f"tpu{i}", node_count_dynamic_max=cnt, zone_policy_allow=[ZONE])
+        for i in range(spec.tpu_nodesets)}
+
+    partitions = {}
+    names = list(regular) + list(flex) + list(fr)
+    for i in range(0, len(names), spec.nodesets_per_partition):
+        p = f"p{i // spec.nodesets_per_partition}"
+        partitions[p] = TstPartition(
+            partition_name=p,
+            partition_nodeset=names[i:i + spec.nodesets_per_partition],
+            enable_job_exclusive=(i // spec.nodesets_per_partition) % 2 == 0)
+    for name in tpus:
+        partitions[f"p_{name}"] = TstPartition(partition_name=f"p_{name}", partition_nodeset_tpu=[name])
+
+    cfg = util.NSDict(asdict(TstCfg(
+        slurm_cluster_name=CLUSTER,
+        partitions=partitions, # type: ignore[arg-type]
+        nodeset={**regular, **flex, **fr}, # type: ignore[arg-type]
+        nodeset_tpu=tpus, # type: ignore[arg-type]
+        output_dir=str(root / "etc"),
+    )))
+    cfg.project = PROJECT
+    cfg.slurm_bin_dir = str(root / "bin")
+    for ns in cfg.nodeset.values():
+        ns.subnetwork = SUBNETWORK
+    for name in flex:
+        cfg.nodeset[name].dws_flex = util.NSDict(enabled=True)
+
+    instances, slurm_nodes, down_nodes = [], [], []
+
+    def add_node(name: str, state: List[str]) -> None:
+        slurm_nodes.append(dict(name=name, state=state))
+
+    def add_instance(name: str, i: int) -> None:
+        instances.append(dict(
+            name=name,
+            zone=f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/zones/{ZONE}",
+            status="RUNNING",
+            creationTimestamp=_gcp_ts(SOME_TS),
+            resourceStatus=dict(physicalHost=f"/c{i % 7}/r{i % 97}/h{i}"),
+            scheduling=dict(),
+            labels=dict(slurm_instance_role="compute"),
+        ))
+
+    for ns_name in [*regular, *flex, *fr]:
+        for i in range(cnt):
+            name = f"{CLUSTER}-{ns_name}-{i}"
+            drift = rnd.random() < spec.drift_fraction
+            if ns_name in fr:
+                add_node(name, ["DOWN", "CLOUD", "POWERED_DOWN"]) # reservation is not active yet
+            elif i < static:
+                add_node(name, ["IDLE", "CLOUD"])
+                if not drift: # drift: unbacked static node
+                    add_instance(name, i)
+            elif rnd.random() < spec.dynamic_up_fraction:
+                add_node(name, ["ALLOCATED", "CLOUD"])
+                add_instance(name, i)
+            else:
+                add_node(name, ["IDLE", "CLOUD", "POWERED_DOWN"])
+                if drift: # drift: orphaned instance
+                    add_instance(name, i)
+                elif ns_name in regular:
+                    down_nodes.append(name)
+    for ns_name in tpus:
+        for i in range(cnt):
+            add_node(f"{CLUSTER}-{ns_name}-{i}", ["IDLE", "CLOUD", "POWERED_DOWN"])
+
+    # exclusive jobs take every 10th of resumable nodes, in groups of 4
+    excl_parts = {
+        ns_name: p.partition_name
+        for p in partitions.values() if p.enable_job_exclusive
+        for ns_name in p.partition_nodeset
+    }
+    by_ns: Dict[str, List[str]] = {}
+    for n in down_nodes[::10]:
+        ns_name = n.split("-")[1]
+        if ns_name in excl_parts:
+            by_ns.setdefault(ns_name, []).append(n)
+    allocs = [
+        (excl_parts[ns_name], ns_nodes[i:i + 4])
+        for ns_name, ns_nodes in by_ns.items()
+        for i in range(0, len(ns_nodes), 4)
+    ]
+    jobs = [
+        resume.ResumeJobData(job_id=job_id, partition=part, nodes_alloc=nodes)
+        for job_id, (part, nodes) in enumerate(allocs, start=1)
+    ]
+
+    return Cluster(spec=spec, cfg=cfg, instances=instances, slurm_nodes=slurm_nodes, down_nodes=down_nodes, jobs=jobs)
+
+
+class ApiCalls:
+    """Thread-safe counter of API calls, batched requests are counted as one HTTP call"""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counter: Counter = Counter()
+
+    def inc(self, method: str) -> None:
+        with self._lock:
+            self.counter[method] += 1
+
+    @property
+    def http(self) -> int:
+        return sum(v for k, v in self.counter.items() if not k.startswith("batch/"))
+
+
+class FakeRequest:
+    def __init__(self, calls: ApiCalls, method: str, resp: Callable[[], Any], **kwargs) -> None:
+        self._calls = calls
+        self.method = method
+        self._resp = resp
+        self.kwargs = kwargs
+        self.uri = f"https://compute.googleapis.com/{method}"
+
+    def execute(self) -> Any:
+        self._calls.inc(self.method)
+        return self._resp()
+
+    def to_json(self) -> str: # used by `util.log_api_request`
+        return json.dumps(dict(method=self.method, kwargs=self.kwargs), default=str)
+
+
+class FakeBatch:
+    def __init__(self, calls: ApiCalls, callback: Callable) -> None:
+        self._calls = calls
+        self._callback = callback
+        self._reqs: Dict[str, FakeRequest] = {}
+
+    def add(self, req: FakeRequest, request_id: str) -> None:
+        self._reqs[request_id] = req
+
+    def execute(self) -> None:
+        self._calls.inc("batch")
+        for rid, req in self._reqs.items():
+            self._calls.inc(f"batch/{req.method}")
+            self._callback(rid, req._resp(), None)
+
+
+def _op(op_type: str, name: str, **kwargs) -> Dict[str, Any]:
+    return dict(
+        name=f"op-{op_type}-{name}",
+        operationType=op_type,
+        status="DONE",
+        selfLink=f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/zones/{ZONE}/operations/op-{op_type}-{name}",
+        **kwargs)
+
+
+class FakeCompute:
+    """Subset of compute API used by benchmarked entry points"""
+    def __init__(self, cluster: Cluster, calls: ApiCalls) -> None:
+        self._instances = cluster.instances
+        self.calls = calls
+
+    def new_batch_http_request(self, callback: Callable) -> FakeBatch:
+        return FakeBatch(self.calls, callback)
+
+    def _req(self, method: str, resp: Callable[[], Any], **kwargs) -> FakeRequest:
+        return FakeRequest(self.calls, method, resp, **kwargs)
+
+    def instances(self) -> "FakeCompute":
+        return self
+
+    def _filter(self, flt: str) -> List[Dict[str, Any]]:
+        """Supports filters used by `util.InstanceInventory`"""
+        insts = self._instances
+        if m := re.search(r'creationTimestamp > "([^"]+)"', flt):
+            since = util.parse_gcp_timestamp(m.group(1))
+            insts = [i for i in insts if util.parse_gcp_timestamp(i["creationTimestamp"]) > since]
+        if "status != RUNNING" in flt:
+            insts = [i for i in insts if i["status"] != "RUNNING"]
+        return insts
+
+    def aggregatedList(self, page: int = 0, filter: str = "", **kwargs) -> FakeRequest:
+        def resp() -> Dict[str, Any]:
+            insts = self._filter(filter)
+            items = insts[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+            res: Dict[str, Any] = {"items": {f"zones/{ZONE}": {"instances": items}}}
+            if (page + 1) * PAGE_SIZE < len(insts):
+                res["nextPageToken"] = str(page + 1)
+            return res
+        return self._req("instances.aggregatedList", resp, page=page, filter=filter, **kwargs)
+
+    def aggregatedList_next(self, prev: FakeRequest, result: Dict[str, Any]) -> Optional[FakeRequest]:
+        if "nextPageToken" not in result:
+            return None
+        return self.aggregatedList(**{**prev.kwargs, "page": int(result["nextPageToken"])})
+
+    def delete(self, instance: str, **kwargs) -> FakeRequest:
+        zone = f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/zones/{ZONE}"
+        return self._req("instances.delete", lambda: _op("delete", instance, zone=zone), instance=instance, **kwargs)
+
+    def start(self, instance: str, **kwargs) -> FakeRequest:
+        return self._req("instances.start", lambda: _op("start", instance), instance=instance, **kwargs)
+
+    def resourcePolicies(self) -> Any:
+        return unittest.mock.Mock(insert=lambda body, **kwargs: self._req(
+            "resourcePolicies.insert", lambda: _op("insert", body["name"]), **kwargs))
+
+    def futureReservations(self) -> Any:
+        fr = dict(
+            timeWindow=dict(startTime="2100-01-01T00:00:00Z", endTime="2100-01-02T00:00:00Z"),
+            status=dict(),
+            specificReservationRequired=True)
+        return unittest.mock.Mock(get=lambda **kwargs: self._req("futureReservations.get", lambda: fr, **kwargs))
+
+
+class FakeTPU:
+    """Stands for `tpu.TPU`, all TPU nodes are powered down"""
+    def __init__(self, calls: ApiCalls) -> None:
+        self._calls = calls
+        self.vmcount = 1
+        self.preemptible = False
+
+    def get_node(self, nodename: str) -> Any:
+        self._calls.inc("tpu.get_node")
+        return None
+
+
+class BenchLookup(util.Lookup):
+    def __init__(self, cluster: Cluster, calls: ApiCalls) -> None:
+        super().__init__(cluster.cfg)
+        self._fake_compute = FakeCompute(cluster, calls)
+
+    @property
+    def compute(self):
+        return self._fake_compute
+
+    def template_info(self, template_link): # type: ignore[override]
+        return util.NSDict(
+            name=util.trim_self_link(template_link),
+            link=template_link,
+            machineType="c2-standard-60",
+            machine_type=util.NSDict(name="c2-standard-60", family="c2"),
+            gpu=None)
+
+
+FAKE_SCONTROL = """#!/bin/sh
+echo "$*" >> "{log}"
+if [ "$1 $2" = "show nodes" ]; then
+  cat "{nodes}"
+fi
+"""
+
+
+@dataclass
+class Env:
+    cluster: Cluster
+    root: Path
+    calls: ApiCalls
+
+    @property
+    def scontrol_log(self) -> Path:
+        return self.root / "scontrol.log"
+
+    def scontrol_calls(self) -> int:
+        if not self.scontrol_log.exists():
+            return 0
+        return len(self.scontrol_log.read_text().splitlines())
+
+    def lookup(self) -> BenchLookup:
+        """Fresh lookup (cold caches), installed as global one"""
+        lkp = BenchLookup(self.cluster, self.calls)
+        util._lkp = lkp
+        return lkp
+
+
+@contextmanager
+def environment(spec: ClusterSpec) -> Iterator[Env]:
+    """Sets up synthetic cluster, all state is kept in temporary directory"""
+    with tempfile.TemporaryDirectory(prefix="slurm_gcp_bench_") as tmp, ExitStack() as stack:
+        root = Path(tmp)
+        cluster = make_cluster(spec, root)
+        env = Env(cluster=cluster, root=root, calls=ApiCalls())
+
+        for d in ("bin", "etc", "state", "cache"):
+            (root / d).mkdir()
+        nodes_json = root / "nodes.json"
+        nodes_json.write_text(json.dumps(dict(nodes=cluster.slurm_nodes)))
+        scontrol = root / "bin" / "scontrol"
+        scontrol.write_text(FAKE_SCONTROL.format(log=env.scontrol_log, nodes=nodes_json))
+        scontrol.chmod(0o755)
+
+        def cache(name: str) -> file_cache.FileCache:
+            (root / "cache" / name).mkdir(exist_ok=True)
+            return file_cache.FileCache(root / "cache" / name)
+
+        stack.enter_context(unittest.mock.patch.dict(util.slurmdirs, state=root / "state"))
+        stack.enter_context(unittest.mock.patch("file_cache.cache", cache))
+        stack.enter_context(unittest.mock.patch("file_cache._chown_slurm"))
+        stack.enter_context(unittest.mock.patch("util.chown_slurm"))
+        stack.enter_context(unittest.mock.patch("tpu.TPU.make", lambda ns, lkp: FakeTPU(env.calls)))
+        stack.enter_context(unittest.mock.patch.dict(local_pubsub._topics, clear=True))
+        stack.enter_context(unittest.mock.patch.dict(local_pubsub._subscriptions, clear=True))
+        stack.enter_context(unittest.mock.patch.object(util, "_lkp", None))
+        yield env
+
+
+def bench_to_hostlist(env: Env) -> None:
+    util.to_hostlist(n["name"] for n in env.cluster.slurm_nodes)
+
+def bench_slurm_nodes(env: Env) -> None:
+    env.lookup().slurm_nodes()
+
+def bench_sync_instances(env: Env) -> None:
+    env.lookup()
+    slurmsync.sync_instances()
+
+def bench_group_nodes_bulk(env: Env) -> None:
+    resume_data = resume.ResumeData(jobs=env.cluster.jobs)
+    resume.group_nodes_bulk(env.cluster.down_nodes, resume_data, env.lookup())
+
+def bench_gen_topology(env: Env) -> None:
+    topo = conf.gen_topology(env.lookup()).compress()
+    for _ in topo.render_conf_lines():
+        pass
+
+
+BENCHMARKS: Dict[str, Callable[[Env], None]] = {
+    "to_hostlist": bench_to_hostlist,
+    "slurm_nodes": bench_slurm_nodes,
+    "sync_instances": bench_sync_instances,
+    "group_nodes_bulk": bench_group_nodes_bulk,
+    "gen_topology": bench_gen_topology,
+}
+
+
+@dataclass(frozen=True)
+class Result:
+    name: str
+    wall_s: float
+    api_calls: Dict[str, int]
+    http_calls: int
+    scontrol_calls: int
+    peak_mib: float
+
+
+def run_benchmark(name: str, env: Env) -> Result:
+    fn = BENCHMARKS[name]
+    env.calls.counter.clear()
+    env.scontrol_log.unlink(missing_ok=True)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn(env)
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        name=name,
+        wall_s=wall,
+        api_calls=dict(env.calls.counter),
+        http_calls=env.calls.http,
+        scontrol_calls=env.scontrol_calls(),
+        peak_mib=peak / 2**20,
+    )
+
+
+def run(spec: ClusterSpec, only: Optional[List[str]] = None) -> List[Result]:
+    names = only or list(BENCHMARKS)
+    with environment(spec) as env:
+        return [run_benchmark(name, env) for name in names]
+
+
+def report(spec: ClusterSpec, results: List[Result]) -> str:
+    lines = [
+        f"cluster: {spec.nodes} nodes, {spec.nodesets} nodesets (+{spec.tpu_nodesets} tpu, {spec.flex_nodesets} flex, {spec.fr_nodesets} fr)",
+        f"{'entry point':<20} {'wall, s':>9} {'http':>7} {'scontrol':>9} {'peak, MiB':>10}  api calls",
+    ]
+    for r in results:
+        api = ", ".join(f"{k}={v}" for k, v in sorted(r.api_calls.items()))
+        lines.append(f"{r.name:<20} {r.wall_s:>9.3f} {r.http_calls:>7} {r.scontrol_calls:>9} {r.peak_mib:>10.1f}  {api}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=ClusterSpec.nodes)
+    parser.add_argument("--nodesets", type=int, default=ClusterSpec.nodesets)
+    parser.add_argument("--seed", type=int, default=ClusterSpec.seed)
+    parser.add_argument("--only", type=lambda s: s.split(","), help=f"comma separated subset of: {','.join(BENCHMARKS)}")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    spec = ClusterSpec(nodes=args.nodes, nodesets=args.nodesets, seed=args.seed)
+    results = run(spec, args.only)
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        print(report(spec, results))
+
+
+if __name__ == "__main__":
+    main()
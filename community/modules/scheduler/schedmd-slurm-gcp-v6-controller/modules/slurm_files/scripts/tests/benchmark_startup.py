@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Startup (import) cost of script entry points, based on `python -X importtime`.
+
+Every entry point is imported in a fresh interpreter `--repeat` times,
+the fastest run is reported along with the heaviest imports it pulls in.
+
+Usage:
+    python tests/benchmark_startup.py
+    python tests/benchmark_startup.py --only resume,suspend --top 10
+
+Not collected by pytest (name doesn't match `test_*`).
+"""
+
+from typing import List, Optional
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+
+# Executed by Slurm or systemd, startup is paid on every invocation
+ENTRY_POINTS = [
+    "resume",
+    "suspend",
+    "slurmsync",
+    "broker",
+    "broker_client",
+    "sort_nodes",
+    "load_bq",
+    "setup",
+]
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass(frozen=True)
+class Import:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclass(frozen=True)
+class Result:
+    entry_point: str
+    total_ms: float
+    heaviest: List[Import]
+    error: Optional[str] = None
+
+
+def parse_importtime(stderr: str) -> List[Import]:
+    res = []
+    for line in stderr.splitlines():
+        if m := _LINE.match(line):
+            res.append(Import(
+                module=m.group(4),
+                self_us=int(m.group(1)),
+                cumulative_us=int(m.group(2)),
+                depth=len(m.group(3)) // 2))
+    return res
+
+
+def measure(entry_point: str, top: int) -> Result:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry_point}"],
+        cwd=SCRIPTS_DIR,
+        env={**os.environ, "PYTHONPATH": str(SCRIPTS_DIR)},
+        capture_output=True,
+        text=True,
+    )
+    imports = parse_importtime(proc.stderr)
+    idx = next((n for n, i in enumerate(imports) if i.module == entry_point and i.depth == 0), None)
+    if proc.returncode != 0 or idx is None:
+        last = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "no output"
+        return Result(entry_point, total_ms=0, heaviest=[], error=last)
+    root = imports[idx]
+    # imports are reported in post-order, entry point's ones precede it up to the previous top level import
+    start = max((n for n in range(idx) if imports[n].depth == 0), default=-1) + 1
+    # direct dependencies of entry point and of its first-party modules
+    children = [i for i in imports[start:idx] if i.depth <= 2]
+    heaviest = sorted(children, key=lambda i: i.cumulative_us, reverse=True)[:top]
+    return Result(entry_point, total_ms=root.cumulative_us / 1000, heaviest=heaviest)
+
+
+def run(entry_points: List[str], repeat: int = 3, top: int = 5) -> List[Result]:
+    results = []
+    for ep in entry_points:
+        runs = [measure(ep, top) for _ in range(repeat)]
+        ok = [r for r in runs if r.error is None]
+        results.append(min(ok, key=lambda r: r.total_ms) if ok else runs[0])
+    return results
+
+
+def report(results: List[Result]) -> str:
+    lines = []
+    for r in results:
+        if r.error:
+            lines.append(f"{r.entry_point:<16} FAILED: {r.error}")
+            continue
+        lines.append(f"{r.entry_point:<16} {r.total_ms:>8.1f} ms")
+        for i in r.heaviest:
+            lines.append(f"    {i.module:<40} {i.cumulative_us / 1000:>8.1f} ms")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", type=lambda s: s.split(","), help=f"comma separated subset of: {','.join(ENTRY_POINTS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="number of heaviest imports to show")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.only or ENTRY_POINTS, repeat=args.repeat, top=args.top)
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        print(report(results))
+
+
+if __name__ == "__main__":
+    main()
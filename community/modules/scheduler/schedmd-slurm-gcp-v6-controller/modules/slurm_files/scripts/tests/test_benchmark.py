@@ -0,0 +1,42 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import benchmark
+import benchmark_startup
+from benchmark import ClusterSpec
+
+
+def test_benchmark_smoke():
+  # keeps benchmark harness in sync with the code it exercises
+  spec = ClusterSpec(nodes=300, nodesets=4, drift_fraction=0.05)
+  results = {r.name: r for r in benchmark.run(spec)}
+
+  assert set(results) == set(benchmark.BENCHMARKS)
+  assert results["slurm_nodes"].scontrol_calls == 1
+  assert results["sync_instances"].api_calls["instances.aggregatedList"] >= 1
+  assert results["sync_instances"].api_calls["batch/instances.delete"] >= 1 # orphans
+
+
+def test_parse_importtime():
+  stderr = "\n".join([
+    "import time: self [us] | cumulative | imported package",
+    "import time:       100 |        100 |     yaml.error",
+    "import time:       200 |        300 |   yaml",
+    "import time:        50 |        350 | util",
+  ])
+  assert benchmark_startup.parse_importtime(stderr) == [
+    benchmark_startup.Import("yaml.error", 100, 100, 2),
+    benchmark_startup.Import("yaml", 200, 300, 1),
+    benchmark_startup.Import("util", 50, 350, 0),
+  ]
@@ -0,0 +1,117 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import queue
+import threading
+import pytest
+import unittest.mock
+from datetime import timedelta
+
+import common # needed to import util
+import broker
+import broker_client
+from broker import Request, coalesce
+from resume import ResumeData, ResumeJobData
+
+
+def rq(op: str, nodes: str, *jobs: ResumeJobData) -> Request:
+  return Request(op=op, nodes=nodes.split(","), resume_data=ResumeData(jobs=list(jobs)) if jobs else None)
+
+def job(job_id: int, nodes: str) -> ResumeJobData:
+  return ResumeJobData(job_id=job_id, partition="p", nodes_alloc=nodes.split(","))
+
+
+@pytest.mark.parametrize(
+  "requests,expected",
+  [
+    ([], []),
+    ([rq("resume", "a"), rq("resume", "b,a")], [rq("resume", "a,b")]),
+    (
+      [rq("resume", "a"), rq("suspend", "b"), rq("resume", "c"), rq("suspend", "a")],
+      [rq("resume", "a,c"), rq("suspend", "b,a")],
+    ),
+    ( # order of operations on the same node is preserved
+      [rq("resume", "a"), rq("suspend", "a"), rq("resume", "a,b")],
+      [rq("resume", "a"), rq("suspend", "a"), rq("resume", "a,b")],
+    ),
+    ( # resume data is merged
+      [rq("resume", "a,b", job(1, "a,b")), rq("resume", "c"), rq("resume", "d,e", job(1, "d"), job(2, "e"))],
+      [rq("resume", "a,b,c,d,e", job(1, "a,b,d"), job(2, "e"))],
+    ),
+  ],
+)
+def test_coalesce(requests, expected):
+  assert coalesce(requests) == expected
+
+
+def test_request_decode(tmp_path):
+  rf = tmp_path / "resume.json"
+  rf.write_text(json.dumps({"jobs": [{"job_id": 1, "partition": "p", "nodes_alloc": "a-[1-2]"}]}))
+  line = broker_client.encode("resume", "a-[1-3]", str(rf))
+  assert Request.decode(line) == Request(
+    op="resume", nodes=["a-1", "a-2", "a-3"],
+    resume_data=ResumeData(jobs=[ResumeJobData(job_id=1, partition="p", nodes_alloc=["a-1", "a-2"])]))
+  assert rf.exists() # deleted by wrapper once request is accepted, or used by fallback
+  assert Request.decode(broker_client.encode("suspend", "a-1", None)) == Request(op="suspend", nodes=["a-1"])
+  with pytest.raises(ValueError):
+    Request.decode(broker_client.encode("reboot", "a-1", None))
+
+
+@unittest.mock.patch.object(broker.Broker, "_refresh")
+def test_broker_round_trip(_, tmp_path):
+  sock = tmp_path / "broker.sock"
+  assert not broker_client.submit("resume", "a-1", path=sock) # not running
+
+  processed: queue.Queue = queue.Queue()
+  b = broker.Broker(window=timedelta(seconds=0.2), handler=lambda req, _: processed.put(req))
+  threading.Thread(target=broker.serve, args=(b, sock), daemon=True).start()
+  for _ in range(100): # wait for server to start listening
+    if sock.exists():
+      break
+    threading.Event().wait(0.01)
+
+  assert broker_client.submit("resume", "a-[1-2]", path=sock)
+  assert broker_client.submit("suspend", "b-1", path=sock)
+  assert not broker_client.submit("reboot", "b-1", path=sock)
+  # both requests are handed over, once window has passed
+  assert processed.get(timeout=5) == Request(op="resume", nodes=["a-1", "a-2"])
+  assert processed.get(timeout=5) == Request(op="suspend", nodes=["b-1"])
+  assert sock.stat().st_mode & 0o777 == 0o600
+
+
+@unittest.mock.patch.object(broker.Broker, "_refresh")
+def test_broker_waits_only_for_overlapping_nodes(refresh):
+  release = threading.Event()
+  processed: queue.Queue = queue.Queue()
+  def handler(req, submitted):
+    processed.put(req)
+    submitted.set()
+    if req.op == "resume":
+      release.wait(5) # waiting for bulkInsert operations
+
+  b = broker.Broker(window=timedelta(seconds=0.05), handler=handler)
+  b.add(Request(op="resume", nodes=["a-1", "a-2"]))
+  assert processed.get(timeout=5) == Request(op="resume", nodes=["a-1", "a-2"])
+  # next windows don't wait for operations of unrelated nodes
+  b.add(Request(op="suspend", nodes=["a-2"]))
+  b.add(Request(op="suspend", nodes=["b-1"]))
+  assert processed.get(timeout=5) == Request(op="suspend", nodes=["b-1"])
+  b.add(Request(op="suspend", nodes=["b-2"]))
+  assert processed.get(timeout=5) == Request(op="suspend", nodes=["b-2"])
+  assert refresh.call_count == 3
+  # operation on the same node is deferred until previous one is done
+  assert processed.empty()
+  release.set()
+  assert processed.get(timeout=5) == Request(op="suspend", nodes=["a-2"])
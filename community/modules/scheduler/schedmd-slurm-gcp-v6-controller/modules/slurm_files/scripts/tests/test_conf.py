@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import pytest
+import mock
 from mock import Mock
 from common import TstNodeset, TstCfg, TstMachineConf, TstTemplateInfo, Placeholder
 
@@ -190,3 +191,25 @@ def test_conflines(cfg, want):
 
     cfg.cloud_parameters = addict.Dict(cfg.cloud_parameters)
     assert conf.conflines(util.Lookup(cfg)) == want
+
+
+def test_gen_cloud_conf_action(tmp_path):
+    lkp = util.Lookup(TstCfg(output_dir=str(tmp_path)))
+    sections = {"preamble": "#", "conf": "A=1", "nodeset/a": "NodeName=a", "partition/p": "PartitionName=p"}
+
+    def gen(**upd) -> conf.ConfAction:
+        sections.update(upd)
+        with mock.patch("conf.cloud_conf_sections", return_value={k: v for k, v in sections.items() if v}):
+            return conf.gen_cloud_conf(lkp)
+
+    assert gen() == conf.ConfAction.RESTART # no previous state
+    assert (tmp_path / "cloud.conf").read_text() == "#\n\nA=1\n\nNodeName=a\n\nPartitionName=p"
+    mtime = (tmp_path / "cloud.conf").stat().st_mtime_ns
+
+    assert gen() == conf.ConfAction.NONE
+    assert (tmp_path / "cloud.conf").stat().st_mtime_ns == mtime # not re-written
+
+    assert gen(**{"nodeset/b": "NodeName=b"}) == conf.ConfAction.RECONFIGURE # added nodeset
+    assert gen(**{"nodeset/a": ""}) == conf.ConfAction.RECONFIGURE # removed nodeset
+    assert gen(conf="A=2") == conf.ConfAction.RESTART
+    assert gen() == conf.ConfAction.NONE
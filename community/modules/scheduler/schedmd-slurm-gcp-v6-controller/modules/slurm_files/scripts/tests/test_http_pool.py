@@ -0,0 +1,86 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+
+from http_pool import HttpPool, PooledHttp, PoolStats
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1" # keep-alive
+  connections: set = set()
+
+  def do_GET(self):
+    Handler.connections.add(self.client_address)
+    if self.path == "/slow":
+      threading.Event().wait(0.05)
+    self.send_response(200)
+    self.send_header("Content-Length", "2")
+    self.end_headers()
+    self.wfile.write(b"ok")
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def server():
+  Handler.connections = set()
+  srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+  threading.Thread(target=srv.serve_forever, daemon=True).start()
+  yield f"http://127.0.0.1:{srv.server_address[1]}"
+  srv.shutdown()
+  srv.server_close()
+
+
+def test_pool_reuses_connections(server):
+  pool = HttpPool(httplib2.Http)
+  http = PooledHttp(pool)
+  for _ in range(10):
+    resp, content = http.request(f"{server}/", "GET")
+    assert resp.status == 200 and content == b"ok"
+  assert pool.stats() == PoolStats(created=1, requests=10, reused=9)
+  assert len(Handler.connections) == 1
+
+
+def test_pool_concurrent(server):
+  pool = HttpPool(httplib2.Http, max_idle=4)
+  http = PooledHttp(pool)
+  with ThreadPoolExecutor(max_workers=4) as exe:
+    for _ in range(2): # second wave reuses connections of the first one
+      list(exe.map(lambda _: http.request(f"{server}/slow"), range(4)))
+  stats = pool.stats()
+  assert stats.requests == 8
+  assert stats.created <= 4
+  assert stats.reused == 8 - stats.created
+  assert len(Handler.connections) == stats.created
+
+
+def test_pool_discards_failed():
+  class Failing:
+    connections: dict = {}
+    def request(self, uri, *args, **kwargs):
+      raise ConnectionResetError()
+
+  pool = HttpPool(Failing)
+  with pytest.raises(ConnectionResetError):
+    PooledHttp(pool).request("http://nowhere/")
+  with pytest.raises(ConnectionResetError):
+    PooledHttp(pool).request("http://nowhere/")
+  assert pool.stats() == PoolStats(created=2, discarded=2, requests=2)
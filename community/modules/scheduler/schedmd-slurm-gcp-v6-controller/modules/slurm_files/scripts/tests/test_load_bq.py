@@ -0,0 +1,255 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import pytest
+import re
+import shelve
+import unittest.mock
+from datetime import datetime, timedelta
+from google.api_core import exceptions
+from google.cloud import bigquery as bq
+
+import common # needed to import util
+import util
+import load_bq
+
+T0 = datetime(2025, 1, 1)
+TABLE = bq.TableReference.from_string("p.d.jobs")
+
+
+def test_shard_window():
+  assert load_bq.shard_window(T0, T0 + timedelta(hours=36)) == [
+    (T0, T0 + timedelta(days=1)),
+    (T0 + timedelta(days=1), T0 + timedelta(hours=36)),
+  ]
+  # first run from epoch doesn't run thousands of sacct
+  shards = load_bq.shard_window(datetime.fromtimestamp(1), T0)
+  assert len(shards) == load_bq.SACCT_MAX_SHARDS
+  assert shards[-1][1] == T0
+  assert load_bq.shard_window(T0, T0) == []
+
+
+def sacct_line(idx: int, state: str = "COMPLETED") -> str:
+  job = {f: "" for f in load_bq.slurm_field_map}
+  job.update(job_db_uuid=str(idx), job_id_raw=str(idx), job_id=str(idx), state=state,
+             submit_time="None", start_time="2025-01-01T00:00:00", end_time="None")
+  return "|".join(job[f] for f in load_bq.slurm_field_map) + "\n"
+
+
+class FakeJob:
+  def __init__(self, error=None, errors=None):
+    self.error = error
+    self.errors = errors # of skipped rows
+
+  @property
+  def error_result(self):
+    return self.error and {"reason": "backendError", "message": str(self.error)}
+
+  def done(self):
+    return True
+
+  def result(self):
+    if self.error:
+      raise self.error
+    return self
+
+
+class FakeBigQuery:
+  """Local stand-in for BigQuery client, rejects rows with missing required fields"""
+  def __init__(self):
+    self.rows: list = [] # committed rows
+    self.insert_ids: set = set()
+    self.staging: dict = {} # table id -> rows
+    self.jobs: dict = {}
+    self.calls = 0
+    self.fail_at = None # number of call to fail with server error
+    self.fail_job = None # error of the next load job
+
+  def _call(self):
+    self.calls += 1
+    if self.calls == self.fail_at:
+      raise exceptions.ServiceUnavailable("down")
+
+  @staticmethod
+  def missing(row) -> list:
+    return [f.name for f in load_bq.schema_fields if f.mode == "REQUIRED" and row.get(f.name) in (None, "")]
+
+  def insert_rows(self, table, rows, row_ids, skip_invalid_rows):
+    assert skip_invalid_rows
+    self._call()
+    errors = []
+    for i, (row, row_id) in enumerate(zip(rows, row_ids)):
+      if missing := self.missing(row):
+        errors.append({"index": i, "errors": [{"reason": "invalid", "message": f"missing {missing}"}]})
+      elif row_id not in self.insert_ids:
+        self.insert_ids.add(row_id)
+        self.rows.append(row)
+    return errors
+
+  def create_table(self, table, exists_ok):
+    assert table.expires
+    self.staging.setdefault(table.table_id, [])
+
+  def delete_table(self, table, not_found_ok):
+    self.staging.pop(table.table_id, None)
+
+  def list_rows(self, table, selected_fields):
+    return list(self.staging[table.table_id])
+
+  def load_table_from_file(self, f, table, rewind, job_id, job_config):
+    if job_id in self.jobs:
+      raise exceptions.Conflict(job_id)
+    self._call()
+    assert rewind and job_config.write_disposition == bq.WriteDisposition.WRITE_TRUNCATE
+    f.seek(0)
+    rows = [json.loads(line) for line in f]
+    invalid = [r for r in rows if self.missing(r)]
+    job = FakeJob(errors=[{"reason": "invalid", "message": "missing fields"}] if invalid else None)
+    if self.fail_job:
+      job.error, self.fail_job = self.fail_job, None
+    elif len(invalid) > job_config.max_bad_records:
+      job.error = exceptions.BadRequest("invalid rows")
+    else: # load job is atomic
+      self.staging[table.table_id] = [r for r in rows if not self.missing(r)]
+    self.jobs[job_id] = job
+    return job
+
+  def query(self, sql, job_id):
+    if job_id in self.jobs:
+      raise exceptions.Conflict(job_id)
+    m = re.fullmatch(r"MERGE `p\.d\.jobs` T USING `p\.d\.(\w+)` S ON T.entry_uuid = S.entry_uuid WHEN NOT MATCHED THEN INSERT ROW", sql)
+    assert m, sql
+    known = {r["entry_uuid"] for r in self.rows}
+    self.rows.extend(r for r in self.staging[m[1]] if r["entry_uuid"] not in known)
+    self.jobs[job_id] = FakeJob()
+    return self.jobs[job_id]
+
+  def get_job(self, job_id):
+    return self.jobs[job_id]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+  monkeypatch.setattr(load_bq, "job_idx_db_path", tmp_path / "job_idx.sqlite3")
+  monkeypatch.setattr(load_bq, "job_idx_cache_path", tmp_path / "cache")
+  monkeypatch.setattr(load_bq, "timestamp_file", tmp_path / "ts")
+  monkeypatch.setattr(load_bq, "BQ_ROW_BATCH_SIZE", 2)
+  monkeypatch.setattr(load_bq, "BQ_LOAD_JOB_BATCH_SIZE", 2)
+  lkp = util.Lookup(util.NSDict(slurm_cluster_name="c", cluster_id="id"))
+  fake = FakeBigQuery()
+  invalid: set = set()
+  # day `d` of window has jobs d*10, d*10+1, d*10+2; job of previous day is reported again
+  def sacct(start, end):
+    d = (start - T0).days
+    lines = [sacct_line(d * 10 + i, "" if d * 10 + i in invalid else "COMPLETED") for i in range(3)]
+    if d:
+      lines.append(sacct_line(d * 10 - 8))
+    return io.StringIO("".join(lines))
+  with (
+    unittest.mock.patch("load_bq.lookup", return_value=lkp),
+    unittest.mock.patch("load_bq._spool_sacct", side_effect=sacct),
+    unittest.mock.patch("load_bq.client", return_value=fake),
+  ):
+    yield tmp_path, fake, invalid
+
+
+def loaded_ids(fake) -> list:
+  return [r["job_db_uuid"] for r in fake.rows]
+
+
+@pytest.mark.parametrize("backend", list(load_bq.SUBMIT_BACKENDS))
+def test_load_slurm_jobs(env, backend):
+  path, fake, _ = env
+  assert load_bq.load_slurm_jobs(load_bq.SUBMIT_BACKENDS[backend](), TABLE, T0, T0 + timedelta(days=3)) == 9
+  assert fake.calls == 5 # batches of up to 2 rows
+  assert loaded_ids(fake) == ["0", "1", "2", "10", "11", "12", "20", "21", "22"] # in order, without duplicates
+  assert fake.rows[0]["cluster_name"] == "c"
+  assert (path / "ts").read_text() == (T0 + timedelta(days=3)).isoformat()
+
+
+@pytest.mark.parametrize("backend", list(load_bq.SUBMIT_BACKENDS))
+def test_invalid_rows_are_isolated(env, backend):
+  path, fake, invalid = env
+  invalid.update({11, 12})
+  assert load_bq.load_slurm_jobs(load_bq.SUBMIT_BACKENDS[backend](), TABLE, T0, T0 + timedelta(days=3)) == 7
+  assert loaded_ids(fake) == ["0", "1", "2", "10", "20", "21", "22"]
+  assert (path / "ts").read_text() == (T0 + timedelta(days=3)).isoformat()
+
+
+def test_load_slurm_jobs_resumes(env):
+  path, fake, _ = env
+  fake.fail_at = 4
+  with pytest.raises(exceptions.ServiceUnavailable):
+    load_bq.load_slurm_jobs(load_bq.StreamingBackend(), TABLE, T0, T0 + timedelta(days=3))
+  # batches [0, 1], [2, 10], [11, 12] are in, but day 1 ends with job 2 reported again,
+  # it's filtered out only with the next batch, which failed
+  assert (path / "ts").read_text() == (T0 + timedelta(days=1)).isoformat()
+
+  start, _ = load_bq.get_time_window()
+  assert start < T0 + timedelta(days=1)
+  with load_bq.open_job_index() as index: # as in `main`, however long ago the failed run was
+    index.purge(start)
+    assert index.known(["11", "12"]) == {"11", "12"}
+  # jobs submitted before failure are filtered out by job index
+  load_bq.load_slurm_jobs(load_bq.StreamingBackend(), TABLE, T0 + timedelta(days=1), T0 + timedelta(days=3))
+  assert loaded_ids(fake) == ["0", "1", "2", "10", "11", "12", "20", "21", "22"]
+
+
+def job_row(idx: int) -> dict:
+  return load_bq.make_job_row(dict(zip(load_bq.slurm_field_map, sacct_line(idx).rstrip().split("|"))))
+
+
+def test_load_job_is_committed_once(env):
+  _, fake, _ = env
+  rows = [job_row(i) for i in range(4)]
+  assert rows[0]["entry_uuid"] == load_bq.make_job_row({"job_db_uuid": "0"})["entry_uuid"]
+  backend = load_bq.LoadJobBackend()
+  assert backend.submit(TABLE, rows[:3]) == []
+  assert backend.submit(TABLE, rows[:3]) == [] # e.g. failed to record batch as submitted
+  # rows already loaded, but batch is different, e.g. jobs finished since
+  assert backend.submit(TABLE, rows[1:]) == []
+  assert loaded_ids(fake) == ["0", "1", "2", "3"]
+  assert fake.rows[0]["start_time"] == "2025-01-01T00:00:00"
+  assert not fake.staging # dropped once merged
+
+
+def test_failed_load_job_is_retried(env):
+  _, fake, _ = env
+  rows = [job_row(i) for i in range(2)]
+  backend = load_bq.LoadJobBackend()
+  fake.fail_job = exceptions.InternalServerError("oops")
+  with pytest.raises(exceptions.InternalServerError):
+    backend.submit(TABLE, rows)
+  assert backend.submit(TABLE, rows) == [] # job with the same id failed, retried with another one
+  assert loaded_ids(fake) == ["0", "1"]
+  assert sorted(fake.jobs) == sorted(f"{backend.job_id(rows)}{s}" for s in ("_load", "_load_1", "_merge"))
+
+
+def test_job_index(env, monkeypatch):
+  path, _, _ = env
+  monkeypatch.setattr(load_bq.JobIndex, "QUERY_CHUNK", 2)
+  with shelve.open(str(path / "cache")) as cache: # written by earlier versions
+    cache["7"] = T0
+
+  with load_bq.open_job_index() as index:
+    index.add(["1", "2", "3"], T0 + timedelta(hours=1))
+    assert index.known(["0", "1", "3", "7", "8"]) == {"1", "3", "7"}
+    assert index.purge(T0 + timedelta(minutes=30)) == 1
+    assert index.known(["1", "7"]) == {"1"}
+  assert not list(path.glob("cache*"))
+
+  with load_bq.open_job_index() as index: # persisted
+    assert index.known(["1", "2", "7"]) == {"1", "2"}
@@ -0,0 +1,138 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pytest
+import unittest.mock
+
+import common # needed to import util
+import util
+import local_pubsub
+
+
+@pytest.fixture
+def state(tmp_path):
+  with (
+    unittest.mock.patch.dict(util.slurmdirs, state=tmp_path),
+    unittest.mock.patch("util.chown_slurm"),
+    unittest.mock.patch.dict(local_pubsub._topics, clear=True),
+    unittest.mock.patch.dict(local_pubsub._subscriptions, clear=True),
+  ):
+    yield tmp_path / "pubsub"
+
+
+def data(msgs) -> list:
+  return [m.data for m in msgs]
+
+
+def test_publish_pull_ack(state):
+  t = local_pubsub.topic("t")
+  t.publish("a")
+  assert t.publish_batch(["b", "c", "d"]) == ["000000000001", "000000000002", "000000000003"]
+
+  sub = local_pubsub.subscription("t")
+  got = sub.pull(max_messages=2)
+  assert data(got) == ["a", "b"]
+  assert data(sub.pull(max_messages=10)) == ["c", "d"]
+  assert sub.pull(max_messages=10) == [] # no double delivery within lifetime
+
+  sub.ack([got[0].id, "000000000003"])
+  sub.modify_ack_deadline([got[1].id], deadline=0)
+  t.publish("e")
+  assert data(sub.pull(max_messages=10)) == ["e"]
+
+  local_pubsub.reset()
+  sub = local_pubsub.subscription("t")
+  assert data(sub.pull(max_messages=10)) == ["b", "c", "e"] # NACKed are re-delivered, acked are not
+
+
+def test_partial_write_is_not_read(state):
+  t = local_pubsub.topic("t")
+  t.publish("a")
+  [(_, seg)] = local_pubsub._segments(state / "t")
+  with open(seg, "ab") as f:
+    f.write(b'{"id": "000000000001", "cre') # crashed publisher
+
+  sub = local_pubsub.subscription("t")
+  assert data(sub.pull(max_messages=10)) == ["a"]
+  t.publish("b") # truncates torn tail
+  assert data(sub.pull(max_messages=10)) == ["b"]
+  assert sub.pull(max_messages=10) == []
+
+
+def test_segments_are_compacted(state, monkeypatch):
+  monkeypatch.setattr(local_pubsub, "SEGMENT_MAX_BYTES", 200)
+  t = local_pubsub.topic("t")
+  for i in range(20):
+    t.publish_batch([i, i])
+  path = state / "t"
+  before = len(local_pubsub._segments(path))
+  assert before > 5
+
+  sub = local_pubsub.subscription("t")
+  msgs = sub.pull(max_messages=100)
+  assert data(msgs) == [i for i in range(20) for _ in range(2)]
+  keep = {msgs[5].id, msgs[30].id} # NACKed
+  sub.ack([m.id for m in msgs if m.id not in keep])
+
+  segs = local_pubsub._segments(path)
+  assert 0 < segs[0][0] <= int(msgs[5].id) # segments below watermark are deleted
+  assert len(segs) < before
+  lines = sum(len(seg.read_text().splitlines()) for _, seg in segs[:-1])
+  assert lines <= 4 # sealed segments are rewritten without acked messages
+
+  local_pubsub.reset()
+  sub = local_pubsub.subscription("t")
+  got = sub.pull(max_messages=100)
+  assert [m.id for m in got] == sorted(keep)
+  sub.ack([m.id for m in got])
+  t.publish("next")
+  assert data(local_pubsub.Subscription(path).pull(max_messages=100)) == ["next"]
+
+
+def test_legacy_messages_are_migrated(state):
+  path = state / "t"
+  path.mkdir(parents=True)
+  for i, ts in enumerate(["2025_01_01-00_00_01", "2025_01_01-00_00_00"]):
+    msg = local_pubsub.Message(id=f"{ts}-abcd", created=util.now(), data=i)
+    (path / msg.id).write_text(json.dumps(msg.to_json()))
+
+  sub = local_pubsub.subscription("t")
+  assert data(sub.pull(max_messages=10)) == [1, 0]
+  assert [p.name for p in path.iterdir() if not p.name.startswith(".")] == ["segment-000000000000.log"]
+
+
+def test_crash_during_compaction_keeps_unacked(state, monkeypatch):
+  monkeypatch.setattr(local_pubsub, "SEGMENT_MAX_BYTES", 200)
+  t = local_pubsub.topic("t")
+  for i in range(20):
+    t.publish_batch([i, i])
+  path = state / "t"
+
+  sub = local_pubsub.subscription("t")
+  msgs = sub.pull(max_messages=100)
+  sub.ack([m.id for m in msgs[:5]]) # saved position is inside a segment
+  keep = {msgs[6].id, msgs[30].id}
+
+  rewrite = local_pubsub.Subscription._rewrite
+  def crash(self, seg):
+    rewrite(self, seg)
+    raise RuntimeError("crash")
+  monkeypatch.setattr(local_pubsub.Subscription, "_rewrite", crash)
+  with pytest.raises(RuntimeError):
+    sub.ack([m.id for m in msgs[5:] if m.id not in keep])
+
+  local_pubsub.reset()
+  got = local_pubsub.Subscription(path).pull(max_messages=100)
+  assert keep <= {m.id for m in got}
@@ -0,0 +1,122 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import httplib2
+import pytest
+import socket
+import unittest.mock
+from googleapiclient.errors import HttpError # type: ignore
+
+import common # needed to import util
+import util
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+  monkeypatch.setattr(metrics, "_registry", {})
+  monkeypatch.setattr(metrics, "_exporter", None)
+  monkeypatch.setattr(metrics.atexit, "register", lambda fn: None)
+  return metrics._registry
+
+
+def test_render(registry, tmp_path):
+  c = metrics.Counter("t_requests_total", "Requests", labels=("method", "outcome"))
+  g = metrics.Gauge("t_depth", "Depth", labels=("topic",))
+  h = metrics.Histogram("t_seconds", "Duration", labels=("phase",), buckets=(1, 5))
+
+  c.inc(method="a.get", outcome="ok")
+  c.inc(2, method="a.get", outcome="ok")
+  g.set(7, topic='x"y')
+  for v in (0.5, 3, 100):
+    h.observe(v, phase="p")
+  with pytest.raises(ValueError):
+    c.inc(method="a.get")
+
+  metrics.configure(tmp_path / "textfile", tmp_path / "state", service="resume")
+  (tmp_path / "textfile").mkdir()
+  metrics.flush()
+  assert (tmp_path / "textfile" / "slurm_gcp_resume.prom").read_text() == "\n".join([
+    "# HELP t_depth Depth",
+    "# TYPE t_depth gauge",
+    't_depth{script="resume",topic="x\\"y"} 7',
+    "# HELP t_requests_total Requests",
+    "# TYPE t_requests_total counter",
+    't_requests_total{script="resume",method="a.get",outcome="ok"} 3',
+    "# HELP t_seconds Duration",
+    "# TYPE t_seconds histogram",
+    't_seconds_bucket{script="resume",phase="p",le="1"} 1',
+    't_seconds_bucket{script="resume",phase="p",le="5"} 2',
+    't_seconds_bucket{script="resume",phase="p",le="+Inf"} 3',
+    't_seconds_sum{script="resume",phase="p"} 103.5',
+    't_seconds_count{script="resume",phase="p"} 3',
+  ]) + "\n"
+
+
+def test_flush_accumulates_across_processes(registry, tmp_path):
+  c = metrics.Counter("t_total", "Total")
+  g = metrics.Gauge("t_gauge", "Gauge")
+  prom = tmp_path / "slurm_gcp_suspend.prom"
+
+  metrics.configure(tmp_path, tmp_path / "state", service="suspend")
+  c.inc(2)
+  g.set(5)
+  metrics.flush()
+  # next invocation of the script starts with empty registry
+  c.inc()
+  g.set(1)
+  metrics.flush()
+  metrics.flush() # nothing new recorded
+
+  assert 't_total{script="suspend"} 3' in prom.read_text()
+  assert 't_gauge{script="suspend"} 1' in prom.read_text()
+  assert [p.name for p in tmp_path.iterdir() if p.is_file()] == [prom.name] # no leftovers of atomic write
+
+
+def test_flush_never_raises(registry, tmp_path):
+  metrics.Counter("t_total", "Total").inc()
+  metrics.configure(tmp_path / "missing", tmp_path / "state", service="resume")
+  metrics.flush()
+
+
+def test_ensure_execute_counts_requests():
+  req = unittest.mock.Mock(methodId="compute.instances.get")
+  req.execute.return_value = {"name": "x"}
+  with unittest.mock.patch.object(metrics.API_REQUESTS, "inc") as inc:
+    assert util.ensure_execute(req) == {"name": "x"}
+  inc.assert_called_once_with(method="compute.instances.get", outcome="ok")
+
+
+def test_ensure_execute_counts_retries():
+  req = unittest.mock.Mock(methodId="compute.instances.get")
+  limited = HttpError(httplib2.Response({"status": 403}), b'{"error": {"message": "Rate Limit Exceeded"}}')
+  req.execute.side_effect = [limited, {"name": "x"}]
+  with (
+    unittest.mock.patch.object(metrics.API_RETRIES, "inc") as inc,
+    unittest.mock.patch("util.sleep"),
+  ):
+    assert util.ensure_execute(req) == {"name": "x"}
+  inc.assert_called_once_with(method="compute.instances.get", reason="rate_limited")
+
+
+def test_ensure_execute_gives_up_on_timeout():
+  req = unittest.mock.Mock(methodId="compute.instances.get")
+  req.execute.side_effect = [socket.timeout("slow"), {"name": "x"}]
+  with (
+    unittest.mock.patch.object(metrics.API_RETRIES, "inc") as retries,
+    unittest.mock.patch.object(metrics.API_REQUESTS, "inc") as requests,
+  ):
+    assert util.ensure_execute(req) is None # not sent again, it may be not idempotent
+  requests.assert_called_once_with(method="compute.instances.get", outcome="timeout")
+  retries.assert_not_called()
@@ -0,0 +1,126 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import unittest.mock
+
+from common import TstCfg, TstNodeset # needed to import util
+import util
+import op_tracker
+from op_tracker import OperationRef, OperationTracker
+import watch_delete_vm_op
+
+ZONE = "https://www.googleapis.com/compute/v1/projects/pj/zones/us-a1"
+
+def op(name: str, status: str="RUNNING", **kwargs) -> dict:
+  return dict(name=name, zone=ZONE, status=status, **kwargs)
+
+
+def test_operation_ref_of():
+  assert OperationRef.of(op("a")) == OperationRef(name="a", zone="us-a1")
+  assert OperationRef.of(dict(name="b", region=ZONE.replace("zones", "regions"))) == OperationRef(name="b", region="us-a1")
+
+
+@unittest.mock.patch("op_tracker.poll")
+def test_tracker(mock_poll, monkeypatch):
+  monkeypatch.setattr(OperationTracker, "MIN_INTERVAL", 0.01)
+  monkeypatch.setattr(OperationTracker, "MAX_INTERVAL", 0.01)
+  # consecutive poll results per operation
+  results = {
+    "a": iter([op("a"), Exception("flaky"), op("a", "DONE", error="boom")]),
+    "b": iter([op("b", "DONE")]),
+  }
+  mock_poll.side_effect = lambda lkp, refs: {r: next(results[r.name]) for r in refs}
+
+  tracker = OperationTracker(lkp=None) # type: ignore
+  done = tracker.track(op("c", "DONE"))
+  assert done.result() == op("c", "DONE")
+
+  fa, fb = tracker.track(op("a")), tracker.track(op("b"))
+  assert tracker.track(op("a")) is fa # same operation is not tracked twice
+  assert fb.result(timeout=5) == op("b", "DONE")
+  assert fa.result(timeout=5) == op("a", "DONE", error="boom")
+
+
+@unittest.mock.patch("op_tracker.poll")
+def test_tracker_poll_failures(mock_poll, monkeypatch):
+  monkeypatch.setattr(OperationTracker, "MIN_INTERVAL", 0.01)
+  monkeypatch.setattr(OperationTracker, "MAX_INTERVAL", 0.01)
+  mock_poll.side_effect = lambda lkp, refs: {r: Exception("gone") for r in refs}
+
+  tracker = OperationTracker(lkp=None) # type: ignore
+  with pytest.raises(Exception, match="gone"):
+    tracker.track(op("a")).result(timeout=5)
+  assert mock_poll.call_count == OperationTracker.MAX_POLL_FAILURES
+
+
+def test_watch_vm_delete_ops():
+  lkp = util.Lookup(TstCfg())
+  statuses = {"n-1": None, "n-2": "STOPPING", "n-3": "RUNNING", "n-4": "RUNNING", "n-5": "RUNNING"}
+  lkp.instance = lambda node: unittest.mock.Mock(status=statuses[node]) if statuses[node] else None # type: ignore
+  ops = {
+    "op-3": op("op-3"),
+    "op-4": op("op-4", "DONE"),
+    "op-5": Exception("gone"),
+  }
+  msgs = [
+    unittest.mock.Mock(id=f"m-{i}", data=dict(op_name=f"op-{i}", zone=ZONE, node=f"n-{i}"))
+    for i in range(1, 6)
+  ]
+  sub = unittest.mock.Mock()
+  sub.pull.return_value = msgs
+
+  with (
+    unittest.mock.patch("local_pubsub.subscription", return_value=sub),
+    unittest.mock.patch("op_tracker.poll") as mock_poll,
+  ):
+    mock_poll.side_effect = lambda lkp, refs: {r: ops[r.name] for r in refs}
+    watch_delete_vm_op.watch_vm_delete_ops(lkp)
+
+  # single batched poll for ops of VMs that still exist
+  mock_poll.assert_called_once_with(lkp, [
+    OperationRef("op-3", "us-a1"), OperationRef("op-4", "us-a1"), OperationRef("op-5", "us-a1")])
+  sub.ack.assert_called_once_with(["m-1", "m-4", "m-5"])
+  sub.modify_ack_deadline.assert_called_once_with(["m-2", "m-3"], deadline=0)
+
+
+def test_watch_vm_delete_ops_poll_failure():
+  lkp = util.Lookup(TstCfg())
+  lkp.instance = lambda node: unittest.mock.Mock(status="RUNNING") # type: ignore
+  msgs = [
+    unittest.mock.Mock(id=f"m-{i}", data=dict(op_name=f"op-{i}", zone=ZONE, node=f"n-{i}"))
+    for i in range(1, 3)
+  ]
+  sub = unittest.mock.Mock()
+  sub.pull.return_value = msgs
+
+  with (
+    unittest.mock.patch("local_pubsub.subscription", return_value=sub),
+    unittest.mock.patch("op_tracker.poll", side_effect=Exception("batch failed")),
+  ):
+    watch_delete_vm_op.watch_vm_delete_ops(lkp)
+
+  # nothing is acked, messages are delivered again
+  sub.ack.assert_not_called()
+  sub.modify_ack_deadline.assert_called_once_with(["m-1", "m-2"], deadline=0)
+
+
+def test_tracker_follows_lookup():
+  lkp, new_lkp = util.Lookup(TstCfg()), util.Lookup(TstCfg())
+  with unittest.mock.patch("util.lookup", return_value=lkp) as lookup:
+    tr = op_tracker.tracker()
+    assert op_tracker.tracker() is tr
+    lookup.return_value = new_lkp # config reloaded
+    assert op_tracker.tracker() is not tr
+    assert op_tracker.tracker()._lkp is new_lkp
@@ -0,0 +1,103 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import unittest.mock
+from concurrent.futures import Future
+
+import common # needed to import util
+import util
+import placement_pool
+import resume
+from resume import PlacementAndNodes
+
+
+def done_future(res) -> Future:
+  f: Future = Future()
+  f.set_result(res)
+  return f
+
+
+@pytest.fixture
+def lkp(tmp_path):
+  cfg = util.NSDict(
+    slurm_cluster_name="c",
+    project="p",
+    nodeset={"ns": dict(
+      nodeset_name="ns",
+      enable_placement=True,
+      placement_pool_size=2,
+      placement_max_distance=1,
+      subnetwork="projects/p/regions/us-central1/subnetworks/default",
+    )},
+  )
+  lkp = util.Lookup(cfg)
+  tracker = unittest.mock.Mock()
+  tracker.track.side_effect = lambda op: done_future({"name": "op"})
+  with (
+    unittest.mock.patch.object(placement_pool, "state_path", return_value=tmp_path / "pool.json"),
+    unittest.mock.patch("util.chown_slurm"),
+    unittest.mock.patch.object(util.Lookup, "compute", create=True),
+    unittest.mock.patch("placement_pool.batch_execute", side_effect=lambda reqs: (dict(reqs), {})),
+    unittest.mock.patch("op_tracker.tracker", return_value=tracker),
+  ):
+    yield lkp
+
+
+def policies(*names: str) -> list:
+  return [{"name": n, "selfLink": f"link/{n}"} for n in names]
+
+
+def test_pool_lifecycle(lkp):
+  ns = lkp.cfg.nodeset.ns
+  assert placement_pool.refill(lkp) == 2
+  assert placement_pool.refill(lkp) == 0 # already full
+
+  claimed = placement_pool.claim(lkp, ns, job_id=7, count=3)
+  assert len(claimed) == 2 # pool is exhausted
+  assert all(placement_pool.is_pool_policy(lkp, n) for n in claimed)
+  assert placement_pool.claim(lkp, ns, job_id=8, count=1) == []
+
+  assert placement_pool.refill(lkp) == 2
+  with placement_pool._locked() as st:
+    free = [e.name for e in st.free["ns"]]
+  stray = "c-slurmgcp-managed-ns-pool-dead"
+
+  # job 7 is running
+  assert placement_pool.collect_garbage(lkp, policies(*claimed, *free, stray), keep_jobs={"0", "7"}) == [f"link/{stray}"]
+  # job 7 is over
+  got = placement_pool.collect_garbage(lkp, policies(*claimed, *free), keep_jobs={"0"})
+  assert sorted(got) == sorted(f"link/{n}" for n in claimed)
+
+  # pool is shrunk
+  ns.placement_pool_size = 1
+  assert placement_pool.collect_garbage(lkp, policies(*free), keep_jobs={"0"}) == [f"link/{free[1]}"]
+  # config change makes pooled policies unusable
+  ns.placement_max_distance = 2
+  assert placement_pool.claim(lkp, ns, job_id=9, count=1) == []
+  assert placement_pool.collect_garbage(lkp, policies(free[0]), keep_jobs={"0"}) == [f"link/{free[0]}"]
+
+
+def test_resume_claims_pooled_placements(lkp):
+  placement_pool.refill(lkp)
+  placements = [
+    PlacementAndNodes(placement="c-slurmgcp-managed-ns-5-0", nodes=["c-ns-0", "c-ns-1"]),
+    PlacementAndNodes(placement="c-slurmgcp-managed-ns-5-1", nodes=["c-ns-2", "c-ns-3"]),
+    PlacementAndNodes(placement="c-slurmgcp-managed-ns-5-2", nodes=["c-ns-4"]),
+  ]
+  with unittest.mock.patch("resume.lookup", return_value=lkp):
+    pooled = resume._claim_pooled_placements(placements, 5, lkp)
+  assert len(pooled) == 2
+  assert {p.placement for p in placements[:2]} == pooled
+  assert placements[2].placement == "c-slurmgcp-managed-ns-5-2" # to be created on demand
@@ -0,0 +1,115 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import unittest.mock
+
+import rate_limit
+from rate_limit import Limit, RateLimiter, READ, MUTATE, OPERATIONS
+
+
+class Clock:
+  def __init__(self):
+    self.now = 1000.0
+    self.slept = []
+
+  def time(self):
+    return self.now
+
+  def sleep(self, s):
+    self.slept.append(s)
+    self.now += s
+
+
+@pytest.fixture
+def clock():
+  c = Clock()
+  with unittest.mock.patch.object(rate_limit, "time", c.time), unittest.mock.patch.object(rate_limit, "sleep", c.sleep):
+    yield c
+
+
+@pytest.mark.parametrize(
+  "method_id,expected",
+  [
+    ("compute.instances.get", READ),
+    ("compute.instances.list", READ),
+    ("compute.instances.aggregatedList", READ),
+    ("compute.instances.bulkInsert", MUTATE),
+    ("compute.instances.delete", MUTATE),
+    ("compute.resourcePolicies.insert", MUTATE),
+    ("compute.zoneOperations.get", OPERATIONS),
+    ("compute.globalOperations.wait", OPERATIONS),
+    ("", READ),
+  ],
+)
+def test_method_class(method_id, expected):
+  assert rate_limit.method_class(method_id) == expected
+
+
+def test_acquire_waits_for_refill(tmp_path, clock):
+  limiter = RateLimiter(tmp_path, {MUTATE: Limit(rate=10, burst=5)})
+  assert limiter.acquire(["compute.instances.insert"] * 5) == 0 # burst
+  assert limiter.acquire(["compute.instances.insert"] * 2) == pytest.approx(0.2)
+  # requests are served in order, next one waits for debt of previous to be paid
+  assert limiter.acquire(["compute.instances.insert"]) == pytest.approx(0.1)
+  clock.now += 10 # refilled up to burst
+  assert limiter.acquire(["compute.instances.insert"] * 5) == 0
+  # classes without limit are not throttled
+  assert limiter.acquire(["compute.instances.get"] * 100) == 0
+  stats = limiter.stats()
+  assert stats.acquired == {MUTATE: 13, READ: 100}
+  assert stats.wait_s[MUTATE] == pytest.approx(0.3)
+
+
+def test_bucket_shared_between_processes(tmp_path, clock):
+  a = RateLimiter(tmp_path, {READ: Limit(rate=1, burst=2)})
+  b = RateLimiter(tmp_path, {READ: Limit(rate=1, burst=2)})
+  assert a.acquire(["compute.instances.get"] * 2) == 0
+  assert b.acquire(["compute.instances.get"]) == pytest.approx(1)
+
+
+def test_penalize_and_recover(tmp_path, clock):
+  limit = Limit(rate=10, burst=10)
+  limiter = RateLimiter(tmp_path, {MUTATE: limit})
+  limiter.penalize("compute.instances.insert")
+  # no tokens left, rate is halved
+  assert limiter.acquire(["compute.instances.insert"]) == pytest.approx(1 / 5)
+  for _ in range(10):
+    limiter.penalize("compute.instances.insert")
+  assert limiter.acquire(["compute.instances.insert"]) == pytest.approx(1 / (limit.rate * rate_limit.MIN_RATE_FRACTION))
+  assert limiter.stats().penalties == {MUTATE: 11}
+
+  clock.now += rate_limit.RECOVERY + 10 # back to configured rate, burst refilled
+  limiter.acquire(["compute.instances.insert"] * 10)
+  assert limiter.acquire(["compute.instances.insert"]) == pytest.approx(1 / limit.rate)
+
+
+def test_acquire_wait_is_capped(tmp_path, clock):
+  limit = Limit(rate=10, burst=10)
+  limiter = RateLimiter(tmp_path, {MUTATE: limit})
+  for _ in range(10):
+    limiter.penalize("compute.instances.insert") # at the floor: 1 request per second
+  # batch of 1000 requests doesn't wait for 1000s
+  assert limiter.acquire(["compute.instances.insert"] * 1000) == pytest.approx(rate_limit.MAX_WAIT)
+  # debt beyond the ceiling is not charged, so it's paid off by that wait
+  assert limiter.acquire(["compute.instances.insert"]) <= 1
+
+
+def test_no_directory_no_throttling(tmp_path):
+  limiter = RateLimiter(None)
+  assert limiter.acquire(["compute.instances.insert"] * 10_000) == 0
+  limiter.penalize("compute.instances.insert")
+
+  limiter = RateLimiter(tmp_path / "missing", {READ: Limit(rate=1, burst=1)})
+  assert limiter.acquire(["compute.instances.get"] * 10) == 0
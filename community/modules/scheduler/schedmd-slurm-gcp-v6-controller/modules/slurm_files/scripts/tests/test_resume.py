@@ -173,3 +173,57 @@ def test_allocate_nodes_to_placements(nodes: list[str], excl_job_id: Optional[in
     lkp.template_info = unittest.mock.Mock(return_value=unittest.mock.Mock(machine_type=unittest.mock.Mock(family="n1")))
 
     assert resume._allocate_nodes_to_placements(nodes, excl_job_id, lkp) == expected
+
+
+@unittest.mock.patch("resume.down_nodes_notify_jobs")
+@unittest.mock.patch("resume._handle_bulk_insert_op")
+@unittest.mock.patch("op_tracker.wait_for_operation")
+@unittest.mock.patch("resume.ensure_execute")
+def test_resume_bulk_chunk(mock_execute, mock_wait, mock_handle, mock_down):
+  chunk = BulkChunk(nodes=["c-n-0", "c-n-1"], prefix="c-n", chunk_idx=0, excl_job_id=None)
+  op = {"name": "op-1", "operationGroupId": "g-1"}
+  mock_execute.return_value = op
+  mock_wait.return_value = {**op, "status": "DONE"}
+
+  resume._resume_bulk_chunk(chunk, "req", None)
+  mock_execute.assert_called_once_with("req")
+  mock_wait.assert_called_once_with(op)
+  mock_handle.assert_called_once_with({**op, "status": "DONE"}, chunk.nodes, None)
+  mock_down.assert_not_called()
+
+
+@unittest.mock.patch("resume.down_nodes_notify_jobs")
+@unittest.mock.patch("resume._handle_bulk_insert_op")
+@unittest.mock.patch("op_tracker.wait_for_operation")
+@unittest.mock.patch("resume.ensure_execute")
+def test_resume_bulk_chunk_submit_failure(mock_execute, mock_wait, mock_handle, mock_down):
+  chunk = BulkChunk(nodes=["c-n-0", "c-n-1"], prefix="c-n", chunk_idx=0, excl_job_id=None)
+  mock_execute.side_effect = Exception("quota")
+
+  resume._resume_bulk_chunk(chunk, "req", None)
+  mock_down.assert_called_once_with(chunk.nodes, "GCP Error: quota", None)
+  mock_wait.assert_not_called()
+  mock_handle.assert_not_called()
+
+
+def test_resume_nodes_starts_tpu_after_bulk_chunks():
+  lkp = unittest.mock.Mock()
+  lkp.is_dormant_fr_node.return_value = False
+  lkp.is_provisioning_flex_node.return_value = False
+  lkp.is_flex_node.return_value = False
+  lkp.node_prefix.side_effect = lambda n: n.rsplit("-", 1)[0]
+  lkp.node_is_tpu.side_effect = lambda n: n.startswith("c-t")
+  grouped = {
+    "c-n-0": BulkChunk(nodes=["c-n-0"], prefix="c-n", chunk_idx=0, excl_job_id=None),
+    "c-t-0": BulkChunk(nodes=["c-t-0"], prefix="c-t", chunk_idx=0, excl_job_id=None),
+  }
+  calls = []
+  with (
+    unittest.mock.patch("resume.lookup", return_value=lkp),
+    unittest.mock.patch("resume.group_nodes_bulk", return_value=grouped),
+    unittest.mock.patch("resume.create_instances_request"),
+    unittest.mock.patch("resume._resume_bulk_chunk", side_effect=lambda chunk, *_: calls.append(chunk.name)),
+    unittest.mock.patch("tpu.start_tpu", side_effect=lambda nodes: calls.append(nodes)),
+  ):
+    resume.resume_nodes(["c-t-0", "c-n-0"], None)
+  assert calls == [grouped["c-n-0"].name, ["c-t-0"]]
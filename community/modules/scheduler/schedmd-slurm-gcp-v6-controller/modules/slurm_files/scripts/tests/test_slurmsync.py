@@ -0,0 +1,186 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import asdict
+from datetime import timedelta
+from functools import lru_cache
+import pytest
+import unittest.mock
+
+from common import TstCfg # needed to import util
+import benchmark
+import util
+import slurmsync
+from util import NodeState
+from slurmsync import _decide_node_action as decide
+from slurmsync import NodeActionDelete, NodeActionDown, NodeActionIdle, NodeActionPowerDown, NodeActionPowerUp, NodeActionPrempt, NodeActionUnchanged, NodeActionUnknown
+
+
+def test_warm_caches_expire(monkeypatch):
+  calls = []
+
+  @lru_cache
+  def fast():
+    calls.append("fast")
+
+  @lru_cache
+  def slow():
+    calls.append("slow")
+
+  monkeypatch.setattr(slurmsync, "CACHE_SOURCES", {
+    "fast": (timedelta(0), (fast,)),
+    "slow": (timedelta(seconds=60), (slow,)),
+  })
+  clock = [100.0]
+  monkeypatch.setattr(slurmsync, "monotonic", lambda: clock[0])
+
+  def cycle(lkp, dt=10.0):
+    clock[0] += dt
+    caches.expire(lkp)
+    fast(), slow()
+
+  def make_lkp():
+    return util.Lookup(util.NSDict(asdict(TstCfg())))
+
+  caches = slurmsync.WarmCaches()
+  lkp = make_lkp()
+  with unittest.mock.patch("local_pubsub.reset") as reset:
+    cycle(lkp)
+    cycle(lkp)
+    assert calls == ["fast", "slow", "fast"]
+    assert reset.call_count == 2
+
+    cycle(lkp, dt=60)
+    assert calls[3:] == ["fast", "slow"]
+
+    lkp.cfg.slurmsync_cache_ttl.fast = 30 # TTL is configurable
+    cycle(lkp)
+    assert calls[5:] == []
+
+    cycle(make_lkp()) # config update drops everything
+    assert calls[5:] == ["fast", "slow"]
+
+
+def test_run_controller_tasks(monkeypatch):
+  lkp = util.Lookup(util.NSDict(asdict(TstCfg())))
+  assert len({p.name for p in slurmsync.controller_phases(lkp)}) == len(slurmsync.controller_phases(lkp))
+  clock = [0.0]
+  monkeypatch.setattr(slurmsync, "monotonic", lambda: clock[0])
+  order = []
+
+  def phase(name, dt=0.0, fail=False):
+    def fn():
+      clock[0] += dt # past deadline, but runs to completion
+      order.append(name)
+      if fail:
+        raise Exception("boom")
+    return slurmsync.Phase(name, fn, f"failed {name}")
+
+  monkeypatch.setattr(slurmsync, "prefetch_tasks", lambda lkp: [phase("p1"), phase("p2", fail=True)])
+  monkeypatch.setattr(slurmsync, "controller_phases", lambda lkp: [
+    phase("a", fail=True), phase("b", dt=301), phase("c")])
+  with (
+    unittest.mock.patch("slurmsync._warm_shared_caches"),
+    unittest.mock.patch("metrics.PHASE_STATUS.inc") as inc,
+  ):
+    slurmsync.run_controller_tasks(lkp)
+  assert sorted(order[:2]) == ["p1", "p2"]
+  assert order[2:] == ["a", "b"] # failed phase doesn't block the next one
+  assert {c.kwargs["phase"]: c.kwargs["status"] for c in inc.call_args_list} == {
+    "p1": "done", "p2": "failed", "a": "failed", "b": "done", "c": "skipped"}
+
+
+def test_warm_caches_expire_unlisted(monkeypatch):
+  @lru_cache
+  def from_config():
+    pass
+
+  monkeypatch.setattr(slurmsync, "CONFIG_CACHES", (from_config,))
+  def make_lkp():
+    return util.Lookup(util.NSDict(asdict(TstCfg())))
+
+  lkp = make_lkp()
+  caches = slurmsync.WarmCaches()
+
+  def cycle(lkp):
+    caches.expire(lkp)
+    lkp._node_desc("m22-n-0"), lkp.cfg_hash, from_config()
+    return [f.cache_info().hits for f in (util.Lookup._node_desc, util.Lookup.cfg_hash.fget, from_config)] # type: ignore[attr-defined]
+
+  with unittest.mock.patch("local_pubsub.reset"):
+    cycle(lkp)
+    hits = cycle(lkp)
+    assert cycle(lkp) == [hits[0], hits[1] + 1, hits[2] + 1] # only derived from config are kept
+    assert cycle(make_lkp()) == [0, 0, 0] # new config drops everything
+
+
+def st(base: str, *flags: str) -> NodeState:
+  return NodeState(base=base, flags=frozenset(flags))
+
+
+@pytest.mark.parametrize(
+  "args,expected",
+  [
+    ((None, None, False, False), NodeActionUnknown(None, None)),
+    ((st("IDLE", "POWERING_UP"), None, False, False), NodeActionUnchanged()),
+    ((st("DOWN", "POWERED_DOWN"), None, False, True), NodeActionIdle()),
+    ((st("IDLE", "POWERED_DOWN"), None, False, True), NodeActionPowerUp()),
+    ((st("IDLE", "POWERED_DOWN"), None, False, False), NodeActionUnchanged()),
+    ((st("ALLOCATED"), None, False, False), NodeActionDown(reason="Unbacked instance")),
+    ((st("DOWN"), None, False, False), NodeActionPowerDown()),
+    ((st("ALLOCATED"), "TERMINATED", True, True), NodeActionPrempt()),
+    ((st("ALLOCATED"), "TERMINATED", False, True), NodeActionDown(reason="Instance terminated")),
+    ((st("IDLE", "POWERED_DOWN"), "RUNNING", False, True), None), # potential orphan
+    ((None, "RUNNING", False, False), None),
+    ((None, "STOPPING", False, False), NodeActionUnknown(slurm_state=None, instance_state="STOPPING")),
+    ((st("IDLE"), "RUNNING", False, True), NodeActionUnchanged()),
+  ],
+)
+def test_decide_node_action(args, expected):
+  assert decide(*args) == expected
+
+
+@pytest.mark.parametrize(
+  "text,js,expected",
+  [
+    ("IDLE+CLOUD+POWERED_DOWN", ["IDLE", "CLOUD", "POWERED_DOWN"], st("IDLE", "CLOUD", "POWERED_DOWN")),
+    ("IDLE~+CLOUD", ["IDLE", "CLOUD", "POWERED_DOWN"], st("IDLE", "CLOUD", "POWERED_DOWN")),
+    ("DOWN*+CLOUD", ["DOWN", "CLOUD", "NOT_RESPONDING"], st("DOWN", "CLOUD", "NOT_RESPONDING")),
+    ("DOWN*~+CLOUD", ["DOWN", "CLOUD", "NOT_RESPONDING", "POWERED_DOWN"], st("DOWN", "CLOUD", "NOT_RESPONDING", "POWERED_DOWN")),
+    ("IDLE#+CLOUD", ["IDLE", "CLOUD", "POWERING_UP"], st("IDLE", "CLOUD", "POWERING_UP")),
+    ("IDLE%+CLOUD", ["IDLE", "CLOUD", "POWERING_DOWN"], st("IDLE", "CLOUD", "POWERING_DOWN")),
+    ("MIXED+CLOUD+COMPLETING", ["MIXED", "CLOUD", "COMPLETING"], st("MIXED", "CLOUD", "COMPLETING")),
+    ("ALLOCATED+DYNAMIC_NORM", ["ALLOCATED", "DYNAMIC_NORM"], st("ALLOCATED", "DYNAMIC_NORM")),
+  ],
+)
+def test_text_and_json_node_states_agree(text, js, expected):
+  from_text = util.NodeStateTable.from_text(f"NodeName=c-n-0 Arch=x86_64 State={text} ThreadsPerCore=1").get("c-n-0")
+  from_json = util.NodeStateTable.from_json({"nodes": [{"name": "c-n-0", "state": js}]}).get("c-n-0")
+  assert from_text == from_json == expected
+
+  for inst_status in (None, "RUNNING", "TERMINATED"):
+    for preemptible in (False, True):
+      for is_static in (False, True):
+        assert decide(from_text, inst_status, preemptible, is_static) == decide(from_json, inst_status, preemptible, is_static)
+
+
+def test_classify_nodes_matches_get_node_action():
+  spec = benchmark.ClusterSpec(nodes=2000, nodesets=6, drift_fraction=0.05)
+  with benchmark.environment(spec) as env:
+    lkp = env.lookup()
+    nodes = list({n for n, i in lkp.instances().items() if i.role == "compute"} | set(lkp.slurm_nodes()))
+    expected = {a: sorted(ns) for a, ns in util.groupby_unsorted(nodes, slurmsync.get_node_action)}
+    got = {a: sorted(ns) for a, ns in slurmsync.classify_nodes(lkp, nodes).items()}
+  assert got == expected
+  assert len(expected) >= 3 # exercises variety of actions
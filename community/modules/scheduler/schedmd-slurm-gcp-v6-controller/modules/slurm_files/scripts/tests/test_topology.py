@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import pytest
+import hashlib
 import json
 import mock
 from pytest_unordered import unordered
@@ -143,8 +144,16 @@ def test_gen_topology_conf(tpu_mock):
             'm22-blue-2': '/a/b/a',
             'm22-blue-3': '/b/a/a',
             'm22-green-3': '/a/a/c'},
+        "conf_hash": hashlib.sha256(want_written.encode()).hexdigest(),
     }
 
+    # TPU topology is taken from index while TPU nodesets don't change
+    tpu_mock.reset_mock()
+    upd, summary = conf.gen_topology_conf(lkp)
+    assert upd == False
+    tpu_mock.assert_not_called()
+    assert open(output_dir + "/cloud_topology.conf").read() == want_written
+
 
 
 def test_gen_topology_conf_update():
@@ -190,10 +199,19 @@ def test_gen_topology_conf_update():
     assert upd == True
     sum.dump(lkp)
 
-    # change physicalHost - reconfigure
+    # change physicalHost within the same block - topology.conf is the same, no reconfigure
     lkp.instances = lambda: { # type: ignore[assignment]
         n.name: n for n in [tstInstance("m22-green-0", physical_host="/a/b/z")]}
     upd, sum = conf.gen_topology_conf(lkp)
+    assert upd == False
+    # don't dump
+
+    # change physicalHost to another block - reconfigure
+    lkp.instances = lambda: { # type: ignore[assignment]
+        n.name: n for n in [
+            tstInstance("m22-green-0", physical_host="/a/b/z"),
+            tstInstance("m22-green-1", physical_host="/a/c/z")]}
+    upd, sum = conf.gen_topology_conf(lkp)
     assert upd == True
     sum.dump(lkp)
 
@@ -204,6 +222,57 @@ def test_gen_topology_conf_update():
     # don't dump
 
 
+def test_gen_topology_conf_incremental():
+    cfg = TstCfg(
+        nodeset={
+            "c": TstNodeset("green", node_count_static=4, node_count_dynamic_max=2),
+            "d": TstNodeset("blue", node_count_static=3),
+        },
+        output_dir=tempfile.mkdtemp(),
+    )
+    lkp = util.Lookup(cfg)
+    conf_file = lkp.etc_dir / "cloud_topology.conf"
+    steps = [
+        {"m22-green-0": "/a/a/a", "m22-green-1": "/a/b/a", "m22-blue-2": "/b/a/a"},
+        {"m22-green-0": "/a/a/a", "m22-green-1": "/c/a/a", "m22-green-4": "/a/b/b"}, # move, add, gone
+        {"m22-green-0": "/a/a/b", "m22-green-1": "/c/a/a", "m22-green-4": "/a/b/b"},
+        {},
+    ]
+    for hosts in steps:
+        lkp.instances = lambda: { # type: ignore[assignment]
+            n: tstInstance(n, physical_host=h) for n, h in hosts.items()}
+        conf.gen_topology_conf(lkp)
+        want = list(conf.gen_topology(lkp).compress().render_conf_lines())
+        assert conf_file.read_text() == PRELUDE + "\n".join(want) + "\n\n"
+
+    conf._tree_cache.clear() # e.g. slurmsync restart, tree is rebuilt from index
+    lkp.instances = lambda: { # type: ignore[assignment]
+        "m22-blue-1": tstInstance("m22-blue-1", physical_host="/a/a/a")}
+    conf.gen_topology_conf(lkp)
+    want = list(conf.gen_topology(lkp).compress().render_conf_lines())
+    assert conf_file.read_text() == PRELUDE + "\n".join(want) + "\n\n"
+
+
+def test_gen_topology_conf_failed_write_keeps_cache():
+    cfg = TstCfg(
+        nodeset={"c": TstNodeset("green", node_count_static=2)},
+        output_dir=tempfile.mkdtemp(),
+    )
+    lkp = util.Lookup(cfg)
+    conf_file = lkp.etc_dir / "cloud_topology.conf"
+    lkp.instances = lambda: {} # type: ignore[assignment]
+    conf.gen_topology_conf(lkp)
+
+    lkp.instances = lambda: { # type: ignore[assignment]
+        "m22-green-0": tstInstance("m22-green-0", physical_host="/a/a/a")}
+    with mock.patch("conf._render", side_effect=OSError("disk full")), pytest.raises(OSError):
+        conf.gen_topology_conf(lkp)
+
+    conf.gen_topology_conf(lkp) # same change is applied again
+    want = list(conf.gen_topology(lkp).compress().render_conf_lines())
+    assert conf_file.read_text() == PRELUDE + "\n".join(want) + "\n\n"
+
+
 @pytest.mark.parametrize(
     "paths,expected",
     [
@@ -0,0 +1,95 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pytest
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+import common # needed to import util
+import util
+import resume
+import tracing
+from tracing import SpanContext
+
+
+@pytest.fixture
+def spans(tmp_path, monkeypatch):
+  path = tmp_path / "traces.jsonl"
+  monkeypatch.setattr(tracing, "_exporter", tracing._NoExporter())
+  tracing.configure(path, service="test")
+
+  def read():
+    lines = path.read_text().splitlines() if path.exists() else []
+    return {s["name"]: s for s in map(json.loads, lines)}
+  return read
+
+
+def test_traceparent():
+  ctx = SpanContext(trace_id="a" * 32, span_id="b" * 16)
+  assert ctx.traceparent == f"00-{'a' * 32}-{'b' * 16}-01"
+  assert SpanContext.from_traceparent(ctx.traceparent) == ctx
+  assert SpanContext.from_traceparent("garbage") is None
+  assert SpanContext.from_traceparent(None) is None
+
+
+def test_disabled_is_noop(monkeypatch):
+  monkeypatch.setattr(tracing, "_exporter", tracing._NoExporter())
+  assert not tracing.enabled()
+  with tracing.span("x") as s:
+    pass
+  assert s.end_ns is not None
+
+
+def test_spans_exported(spans):
+  def child():
+    with tracing.span("child"):
+      pass
+
+  remote = SpanContext(trace_id="a" * 32, span_id="b" * 16)
+  with tracing.span("root", parent=remote, nodes="n-[1-2]", count=2):
+    with ThreadPoolExecutor() as exe:
+      exe.submit(tracing.propagate(child)).result()
+    with pytest.raises(ValueError):
+      with tracing.span("failed"):
+        raise ValueError("boom")
+
+  got = spans()
+  assert set(got) == {"root", "child", "failed"}
+  assert {s["traceId"] for s in got.values()} == {"a" * 32}
+  assert got["root"]["parentSpanId"] == "b" * 16
+  assert got["child"]["parentSpanId"] == got["root"]["spanId"] # crossed thread boundary
+  assert got["failed"]["status"] == {"code": 2, "message": "ValueError: boom"}
+  assert got["root"]["attributes"] == [
+    {"key": "nodes", "value": {"stringValue": "n-[1-2]"}},
+    {"key": "count", "value": {"intValue": "2"}},
+  ]
+  assert got["root"]["resource"]["service.name"] == "test"
+  assert int(got["root"]["startTimeUnixNano"]) <= int(got["child"]["startTimeUnixNano"])
+
+
+def test_traceparent_in_instance_metadata():
+  template = util.NSDict(metadata={"items": [{"key": "startup-script", "value": "x"}]})
+  lkp = unittest.mock.Mock()
+  lkp.template_info.return_value = template
+  props = util.NSDict()
+  with unittest.mock.patch("resume.lookup", return_value=lkp):
+    resume._add_metadata(props, "t", tracing.TRACEPARENT_METADATA_KEY, "00-tp")
+    assert props.metadata == {"items": [
+      {"key": "startup-script", "value": "x"},
+      {"key": tracing.TRACEPARENT_METADATA_KEY, "value": "00-tp"},
+    ]}
+    resume._add_metadata(props, "t", tracing.TRACEPARENT_METADATA_KEY, "00-tp2") # replaces
+    assert props.metadata["items"][-1] == {"key": tracing.TRACEPARENT_METADATA_KEY, "value": "00-tp2"}
+    assert len(props.metadata["items"]) == 2
@@ -15,12 +15,21 @@
 from typing import Optional, Type
 
 import pytest
+import mock
 from mock import Mock
 from datetime import datetime, timezone, timedelta
 import unittest
+import json
+import random
+import threading
+from itertools import islice
 
-from common import TstNodeset, TstCfg # needed to import util
+from dataclasses import replace
+from common import TstNodeset, TstCfg, tstInstance # needed to import util
 import util
+import file_cache
+import hostlist
+import httplib2
 from util import NodeState, MachineType, AcceleratorInfo, UpcomingMaintenance, InstanceResourceStatus, FutureReservation, ReservationDetails
 from google.api_core.client_options import ClientOptions  # noqa: E402
 
@@ -117,6 +126,54 @@ def test_to_hostlist(names, expected):
     assert util.to_hostlist(names.split(",")) == expected
 
 
+@pytest.mark.parametrize(
+    "nodelist,expected",
+    [
+        ("", []),
+        ("pedro", ["pedro"]),
+        ("pedro,pedro-[1-2,01-02]", ["pedro", "pedro-1", "pedro-2", "pedro-01", "pedro-02"]),
+        ("pedro-[8-9,10-11]", ["pedro-8", "pedro-9", "pedro-10", "pedro-11"]),
+        ("pedro-[08-11]", ["pedro-08", "pedro-09", "pedro-10", "pedro-11"]),
+        ("pedro-[8-10]", ["pedro-8", "pedro-9", "pedro-10"]),
+        ("juan-[10-11],pedro-9", ["juan-10", "juan-11", "pedro-9"]),
+        ("seas7-[0-1]", ["seas7-0", "seas7-1"]),
+        ("r[1-2]-n[01-02]", ["r1-n01", "r1-n02", "r2-n01", "r2-n02"]),
+        ("a[1-2]b,c", ["a1b", "a2b", "c"]),
+        (["a[1-2]", "b"], ["a1", "a2", "b"]),
+    ],
+)
+def test_to_hostnames(nodelist, expected):
+    assert util.to_hostnames(nodelist) == expected
+
+
+@pytest.mark.parametrize(
+    "nodelist", ["a[1-2", "a1-2]", "a[[1-2]]", "a[x]", "a[2-1]", "a[1-]"]
+)
+def test_to_hostnames_invalid(nodelist):
+    with pytest.raises(ValueError):
+        util.to_hostnames(nodelist)
+
+
+def test_hostlist_expand_lazy():
+    it = hostlist.expand("a-[0-999999999999]")
+    assert list(islice(it, 3)) == ["a-0", "a-1", "a-2"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_hostlist_round_trip(seed):
+    rnd = random.Random(seed)
+    names = set()
+    for _ in range(rnd.randint(1, 200)):
+        prefix = rnd.choice(["a", "a-", "b1-", "cl-ns-", "x9y"])
+        suffix = str(rnd.randint(0, 120)).zfill(rnd.choice([0, 0, 2, 3]))
+        names.add(prefix + rnd.choice([suffix, suffix, ""]))
+    hostlist_expr = util.to_hostlist(names)
+    expanded = util.to_hostnames(hostlist_expr)
+    assert len(expanded) == len(names)
+    assert set(expanded) == names
+    assert util.to_hostlist(expanded) == hostlist_expr
+
+
 @pytest.mark.parametrize(
     "api,ep_ver,expected",
     [
@@ -584,3 +641,353 @@ def test_future_reservation_inactive(_):
     
     lkp._get_future_reservation.assert_called_once_with("manhattan", "danger", "zebra")
     lkp._get_reservation.assert_not_called()
+
+
+def _inventory(tmp_path, lkp, **kwargs) -> util.InstanceInventory:
+    with mock.patch("file_cache.cache", return_value=file_cache.FileCache(tmp_path)):
+        return util.InstanceInventory(lkp, max_age=timedelta(seconds=30), reconcile_interval=timedelta(minutes=5))
+
+@mock.patch("file_cache._chown_slurm")
+@mock.patch("util._list_instances")
+def test_instance_inventory(list_mock, _, tmp_path):
+    lkp = util.Lookup(TstCfg())
+    inv = _inventory(tmp_path, lkp)
+    t0 = datetime(2025, 2, 13, 0, 0, tzinfo=timezone.utc)
+
+    # no snapshot - full listing
+    list_mock.return_value = {"c-n-0": tstInstance("c-n-0"), "c-n-1": tstInstance("c-n-1")}
+    with mock.patch("util.now", return_value=t0):
+        assert inv.get().keys() == {"c-n-0", "c-n-1"}
+    list_mock.assert_called_once_with(lkp)
+
+    # fresh snapshot - no listing
+    list_mock.reset_mock()
+    with mock.patch("util.now", return_value=t0 + timedelta(seconds=10)):
+        assert inv.get().keys() == {"c-n-0", "c-n-1"}
+    list_mock.assert_not_called()
+
+    # stale snapshot - incremental refresh
+    stopping = replace(tstInstance("c-n-1"), status="STOPPING")
+    def list_se(lkp, flt=None):
+        if flt.startswith("creationTimestamp"):
+            return {"c-n-2": tstInstance("c-n-2")}
+        assert flt == "status != RUNNING"
+        return {"c-n-1": stopping}
+
+    list_mock.side_effect = list_se
+    with mock.patch("util.now", return_value=t0 + timedelta(minutes=1)):
+        got = inv.get()
+    assert got.keys() == {"c-n-0", "c-n-1", "c-n-2"}
+    assert got["c-n-1"].status == "STOPPING"
+    assert list_mock.call_args_list[0].args[1] == 'creationTimestamp > "2025-02-12T22:55:00+00:00"'
+
+    # previously STOPPING instance is not listed anymore - resolve individually
+    list_mock.side_effect = lambda lkp, flt=None: {}
+    with (mock.patch("util.now", return_value=t0 + timedelta(minutes=2)),
+          mock.patch.object(inv, "_resolve", return_value={"c-n-1": None}) as resolve_mock):
+        assert inv.get().keys() == {"c-n-0", "c-n-2"}
+    resolve_mock.assert_called_once_with([stopping])
+
+    # reconcile interval has passed - full listing
+    list_mock.side_effect = None
+    list_mock.reset_mock()
+    list_mock.return_value = {"c-n-0": tstInstance("c-n-0")}
+    with mock.patch("util.now", return_value=t0 + timedelta(minutes=5)):
+        assert inv.get().keys() == {"c-n-0"}
+    list_mock.assert_called_once_with(lkp)
+
+
+@mock.patch("file_cache._chown_slurm")
+@mock.patch("util._list_instances")
+def test_instance_inventory_mark_deleting(list_mock, _, tmp_path):
+    inv = _inventory(tmp_path, util.Lookup(TstCfg()))
+    list_mock.return_value = {"c-n-0": tstInstance("c-n-0"), "c-n-1": tstInstance("c-n-1")}
+    inv.get()
+
+    inv.mark_deleting(["c-n-1", "c-n-7"])
+    got = inv.get()
+    assert got["c-n-0"].status == "RUNNING"
+    assert got["c-n-1"].status == "STOPPING"
+    list_mock.assert_called_once()
+
+
+@mock.patch("file_cache._chown_slurm")
+@mock.patch("util._list_instances")
+def test_instance_inventory_mark_deleting_during_refresh(list_mock, _, tmp_path):
+    lkp = util.Lookup(TstCfg())
+    inv, other = _inventory(tmp_path, lkp), _inventory(tmp_path, lkp) # e.g. slurmsync and suspend
+    marker = threading.Thread(target=other.mark_deleting, args=(["c-n-0"],))
+
+    def list_se(lkp):
+        if not marker.is_alive():
+            marker.start()
+            marker.join(timeout=0.2)
+            assert marker.is_alive() # waits for refresh to finish
+        return {"c-n-0": tstInstance("c-n-0")}
+
+    list_mock.side_effect = list_se
+    assert inv.get()["c-n-0"].status == "RUNNING"
+    marker.join()
+    assert inv.get()["c-n-0"].status == "STOPPING"
+
+
+def test_node_state_table_from_json():
+    tbl = util.NodeStateTable.from_json({"nodes": [
+        {"name": "c-n-0", "state": ["IDLE", "CLOUD", "POWERED_DOWN"]},
+        {"name": "c-n-1", "state": ["ALLOCATED", "CLOUD"]},
+        {"name": "c-n-2", "state": ["DOWN", "CLOUD", "POWERED_DOWN"]},
+        {"name": "c-d-vodoo", "state": ["IDLE", "DYNAMIC_NORM"]},
+        {"name": "c-static-0", "state": ["IDLE"]}, # not power-managed, skipped
+        {"name": "c-t-4", "state": "mixed", "state_flags": ["CLOUD", "COMPLETING"]}, # Slurm 23.02
+    ]})
+
+    assert len(tbl) == 5
+    assert "c-static-0" not in tbl
+    assert tbl.get("c-n-0") == NodeState("IDLE", frozenset(["CLOUD", "POWERED_DOWN"]))
+    assert tbl.get("c-t-4") == NodeState("MIXED", frozenset(["CLOUD", "COMPLETING"]))
+    assert tbl.get("c-n-7") is None
+    # states are interned
+    assert tbl.get("c-n-0") is tbl.to_dict()["c-n-0"]
+
+    assert tbl.by_suffix("c-n") == {
+        0: NodeState("IDLE", frozenset(["CLOUD", "POWERED_DOWN"])),
+        1: NodeState("ALLOCATED", frozenset(["CLOUD"])),
+        2: NodeState("DOWN", frozenset(["CLOUD", "POWERED_DOWN"])),
+    }
+
+
+def test_slurm_node_table_falls_back_to_text():
+    lkp = util.Lookup(TstCfg())
+    out = "NodeName=c-n-0 Arch=x86_64 State=DOWN*+CLOUD ThreadsPerCore=1\nNodeName=c-static-0 State=IDLE\n"
+    with (
+        mock.patch("util.run") as run,
+        mock.patch.object(util.Lookup, "scontrol", "scontrol"),
+    ):
+        run.side_effect = [
+            util.subprocess.CalledProcessError(1, "scontrol"),
+            mock.Mock(stdout=out),
+        ]
+        tbl = lkp.slurm_node_table()
+    assert [c.args[0] for c in run.call_args_list] == [
+        "scontrol show nodes --json", "scontrol --oneliner show nodes"]
+    assert tbl.to_dict() == {"c-n-0": NodeState("DOWN", frozenset(["CLOUD", "NOT_RESPONDING"]))}
+
+
+def _blob(name: str, generation: int, content: bytes = b"#!/bin/bash"):
+    blob = mock.Mock(spec=util.storage.Blob)
+    blob.name = name
+    blob.generation = generation
+    blob.download_to_file.side_effect = lambda f: f.write(content)
+    return blob
+
+
+def test_bucket_manifest_list():
+    blobs = [_blob("pre/config.yaml", 1), _blob("pre/slurm-prolog-script-a_sh", 2), _blob("pre/slurm-controller-script-b_sh", 3)]
+    manifest = util.BucketManifest(prefix="pre", blobs=blobs)
+    assert manifest.list() == blobs
+    assert manifest.list("slurm-prolog-script") == [blobs[1]]
+    assert manifest.list("nope") == []
+
+
+def test_install_custom_scripts_generations(tmp_path):
+    blobs = [_blob("pre/slurm-controller-script-setup_sh", 7), _blob("pre/slurm-prolog-script-pro_sh", 3)]
+    manifest = util.BucketManifest(prefix="pre", blobs=blobs)
+
+    with (
+        mock.patch.dict(util.dirs, custom_scripts=tmp_path / "custom"),
+        mock.patch("util.lookup", return_value=Mock(instance_role="controller")),
+        mock.patch("util.should_mount_slurm_bucket", return_value=False),
+        mock.patch("util.bucket_manifest", return_value=manifest),
+        mock.patch("util.chown_slurm"),
+        mock.patch("file_cache._chown_slurm"),
+        mock.patch.dict(util.slurmdirs, state=tmp_path / "state"),
+    ):
+        util.install_custom_scripts(check_hash=True)
+        assert (tmp_path / "custom" / "controller.d" / "setup.sh").read_bytes() == b"#!/bin/bash"
+        assert (tmp_path / "custom" / "prolog.d" / "pro.sh").exists()
+        assert all(b.download_to_file.call_count == 1 for b in blobs)
+
+        # unchanged generations -> no downloads
+        util.install_custom_scripts(check_hash=True)
+        assert all(b.download_to_file.call_count == 1 for b in blobs)
+
+        # updated blob -> download only it
+        blobs[1].generation = 4
+        util.install_custom_scripts(check_hash=True)
+        assert [b.download_to_file.call_count for b in blobs] == [1, 2]
+
+
+def test_fetch_config_parsed_cache(tmp_path):
+    def blob(name: str, generation: int, content: str):
+        b = _blob(name, generation)
+        b.md5_hash = f"{name}:{generation}"
+        b.download_as_text.return_value = content
+        return b
+
+    core = blob("pre/config.yaml", 1, "slurm_cluster_name: m22\nslurm_control_host: ctrl\nslurm_log_dir: /l\nslurm_bin_dir: /b\n")
+    part = blob("pre/partition_configs/p.yaml", 1, "partition_name: p\npartition_nodeset: [ns]\n")
+    ns = blob("pre/nodeset_configs/ns.yaml", 1, "nodeset_name: ns\nnode_count_static: 2\n")
+    blobs = util._ConfigBlobs(core=core, controller_addr=None, partition=[part], nodeset=[ns])
+
+    with (
+        mock.patch("util._list_config_blobs", return_value=blobs),
+        mock.patch("util.instance_role", return_value="controller"),
+        mock.patch("file_cache._chown_slurm"),
+        mock.patch.dict(util.slurmdirs, state=tmp_path),
+    ):
+        assert util._fetch_config(old_hash=blobs.hash) is None
+
+        cfg, hsh = util._fetch_config(old_hash=None) # type: ignore[misc]
+        assert hsh == blobs.hash
+        assert cfg.nodeset["ns"].node_count_static == 2
+        assert cfg.partitions["p"].partition_nodeset == ["ns"]
+
+        # only changed blob gets downloaded again
+        ns.generation, ns.md5_hash = 2, "new"
+        ns.download_as_text.return_value = "nodeset_name: ns\nnode_count_static: 5\n"
+        cfg, _ = util._fetch_config(old_hash=hsh) # type: ignore[misc]
+        assert cfg.nodeset["ns"].node_count_static == 5
+        assert [b.download_as_text.call_count for b in (core, part, ns)] == [1, 1, 2]
+
+    cache_dir = tmp_path / "cache" / "config_blobs"
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+    assert (cache_dir / "parsed").stat().st_mode & 0o777 == 0o600
+    assert json.loads((cache_dir / "parsed").read_text())["pre/nodeset_configs/ns.yaml"] == [
+        2, {"nodeset_name": "ns", "node_count_static": 5}]
+
+
+
+def test_discovery_document(tmp_path):
+    url = "https://www.googleapis.com/discovery/v1/apis/{api}/{apiVersion}/rest"
+    doc = '{"name": "compute", "rootUrl": "https://compute.googleapis.com/"}'
+    http = Mock()
+    http.request.return_value = (httplib2.Response({"status": 200}), doc.encode())
+    ts = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    with (
+        mock.patch("util.now", return_value=ts) as now,
+        mock.patch("file_cache._chown_slurm"),
+        mock.patch.dict(util.slurmdirs, state=tmp_path),
+    ):
+        assert util.discovery_document("compute", "beta", url, http=http, developer_key="k") == doc
+        http.request.assert_called_once()
+        assert http.request.call_args.args[0] == "https://www.googleapis.com/discovery/v1/apis/compute/beta/rest?key=k"
+
+        # served from cache
+        assert util.discovery_document("compute", "beta", url, http=http) == doc
+        assert http.request.call_count == 1
+
+        # expired, stale document is used if refresh fails
+        now.return_value = ts + util.DISCOVERY_CACHE_TTL
+        http.request.side_effect = Exception("no network")
+        assert util.discovery_document("compute", "beta", url, http=http) == doc
+        assert http.request.call_count == 2
+
+        with pytest.raises(Exception, match="no network"): # nothing cached
+            util.discovery_document("compute", "v1", url, http=http)
+
+        # tampered document is not trusted
+        [entry] = (tmp_path / "cache" / "discovery").glob("compute.beta.*")
+        entry.write_text(json.dumps([ts.isoformat(), doc.replace("compute.googleapis.com", "evil.example.com")]))
+        with pytest.raises(Exception, match="no network"):
+            util.discovery_document("compute", "beta", url, http=http)
+
+
+def test_lazy_import():
+    import sys
+    name = "json.tool" # light module, that is not imported by tests otherwise
+    sys.modules.pop(name, None)
+    mod = util.lazy_import(name)
+    assert util.lazy_import(name) is mod
+    assert callable(mod.main) # loaded on attribute access
+
+    with pytest.raises(ModuleNotFoundError):
+        util.lazy_import("no_such_module_xyz")
+
+
+def test_lazy_import_concurrent():
+    import sys
+    name = "json.tool"
+    sys.modules.pop(name, None)
+    start = threading.Barrier(8)
+    def imp(_):
+        start.wait()
+        return util.lazy_import(name)
+    with util.ThreadPoolExecutor(8) as exe:
+        mods = list(exe.map(imp, range(8)))
+    assert all(m is sys.modules[name] for m in mods) # single module, others didn't replace it
+
+
+@mock.patch("file_cache._chown_slurm")
+def test_versioned_cache(_, tmp_path):
+    fc = file_cache.FileCache(tmp_path)
+    ttl, max_stale = timedelta(hours=1), timedelta(days=1)
+    cache = file_cache.VersionedCache(fc, version="v1", ttl=ttl, max_stale=max_stale)
+    fetch = Mock(return_value="a")
+    t0 = 1_000_000.0
+
+    with mock.patch("file_cache.time", return_value=t0):
+        assert cache.get("k", fetch) == "a"
+    fetch.assert_called_once()
+
+    # fresh, shared with other instances of the same version
+    fetch.reset_mock()
+    other = file_cache.VersionedCache(fc, version="v1", ttl=ttl, max_stale=max_stale)
+    with mock.patch("file_cache.time", return_value=t0 + 60):
+        assert other.get("k", fetch) == "a"
+    fetch.assert_not_called()
+
+    # stale - old value is returned, refreshed in background
+    fetch.return_value = "b"
+    with (mock.patch("file_cache.time", return_value=t0 + 2 * 3600),
+          mock.patch("file_cache._revalidate_executor") as executor):
+        assert cache.get("k", fetch) == "a"
+        executor.return_value.submit.assert_called_once()
+        fetch.assert_not_called()
+        executor.return_value.submit.call_args.args[0]() # run refresh
+        fetch.assert_called_once()
+        assert cache.get("k", fetch) == "b"
+
+    # too stale - refetched in place
+    fetch.reset_mock()
+    fetch.return_value = "c"
+    with mock.patch("file_cache.time", return_value=t0 + 3 * 86400):
+        assert cache.get("k", fetch) == "c"
+    fetch.assert_called_once()
+
+    # other version (e.g. config has changed) - refetched in place
+    fetch.reset_mock()
+    fetch.return_value = "d"
+    v2 = file_cache.VersionedCache(fc, version="v2", ttl=ttl, max_stale=max_stale)
+    with mock.patch("file_cache.time", return_value=t0 + 3 * 86400):
+        assert v2.get("k", fetch) == "d"
+    fetch.assert_called_once()
+
+
+@mock.patch("file_cache._chown_slurm")
+def test_template_info_cached_on_disk(_, tmp_path):
+    cfg = util.NSDict(project="p")
+    template = {"machineType": "n1-standard-2", "labels": {"a": "b"}}
+    machines = {"n1-standard-2": {"z": {"name": "n1-standard-2", "guestCpus": 2, "memoryMb": 7680}}}
+
+    with (mock.patch("file_cache.cache", return_value=file_cache.FileCache(tmp_path)),
+          mock.patch("util.ensure_execute", return_value={"properties": template}) as ex,
+          mock.patch.object(util.Lookup, "machine_types", Mock(return_value=machines)) as mt,
+          mock.patch.object(util.Lookup, "compute", create=True)):
+        lkp = util.Lookup(cfg)
+        info = lkp.template_info("projects/p/global/instanceTemplates/t1")
+        assert info.name == "t1" and info.labels == {"a": "b"} and info.gpu is None
+        assert info.machine_type.guest_cpus == 2
+        ex.assert_called_once()
+
+        # another process, no API calls
+        ex.reset_mock()
+        mt.reset_mock()
+        assert util.Lookup(cfg).template_info("projects/p/global/instanceTemplates/t1") == info
+        ex.assert_not_called()
+        mt.assert_not_called()
+
+        # config has changed
+        cfg.project = "q"
+        util.Lookup(cfg).template_info("projects/p/global/instanceTemplates/t1")
+        ex.assert_called_once()
@@ -15,7 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import socket
 import logging
@@ -25,8 +25,13 @@ import yaml
 import util
 from util import create_client_options, ApiEndpoint
 
-from google.cloud import tpu_v2 as tpu  # noqa: E402
-import google.api_core.exceptions as gExceptions  # noqa: E402
+# Loaded on first use, so code paths without TPU nodes don't pay for import
+if TYPE_CHECKING:
+    from google.cloud import tpu_v2 as tpu  # noqa: E402
+    import google.api_core.exceptions as gExceptions  # noqa: E402
+else:
+    tpu = util.lazy_import("google.cloud.tpu_v2")
+    gExceptions = util.lazy_import("google.api_core.exceptions")
 
 log = logging.getLogger()
 
@@ -35,19 +40,20 @@ _tpu_cache = {}
 class TPU:
     """Class for handling the TPU-vm nodes"""
 
-    State = tpu.types.cloud_tpu.Node.State
     TPUS_PER_VM = 4
     __expected_states = {
-        "create": State.READY,
-        "start": State.READY,
-        "stop": State.STOPPED,
+        "create": "READY",
+        "start": "READY",
+        "stop": "STOPPED",
     }
 
-    __tpu_version_mapping = {
-        "V2": tpu.AcceleratorConfig().Type.V2,
-        "V3": tpu.AcceleratorConfig().Type.V3,
-        "V4": tpu.AcceleratorConfig().Type.V4,
-    }
+    __tpu_versions = ("V2", "V3", "V4")
+
+    class _StateDescriptor:
+        def __get__(self, obj, owner):
+            return tpu.types.cloud_tpu.Node.State
+
+    State = _StateDescriptor() # resolved on access to avoid loading `tpu_v2` on import
 
     @classmethod
     def make(cls, nodeset_name: str, lkp: util.Lookup) -> "TPU":
@@ -74,7 +80,9 @@ class TPU:
         if ns_ac.topology != "" and ns_ac.version != "":
             ac = tpu.AcceleratorConfig()
             ac.topology = ns_ac.topology
-            ac.type_ = self.__tpu_version_mapping[ns_ac.version]
+            if ns_ac.version not in self.__tpu_versions:
+                raise KeyError(ns_ac.version)
+            ac.type_ = tpu.AcceleratorConfig.Type[ns_ac.version]
             self.ac = ac
         else:
             req = tpu.GetAcceleratorTypeRequest(
@@ -153,7 +161,7 @@ class TPU:
             return False
         if response.__class__.__name__ != "Node":  # If the response is not a node fail
             return False
-        if response.state == des_state:
+        if response.state == self.State[des_state]:
             return True
         return False
 
@@ -0,0 +1,202 @@
+# Copyright 2025 "Google LLC"
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Minimal span tracing, compatible with OpenTelemetry data model.
+
+Spans are appended to a JSON-lines file as they end, one span per line
+in OTLP/JSON span layout (`traceId`, `spanId`, `parentSpanId`, `startTimeUnixNano`, ...),
+so they can be inspected offline or shipped to any OTLP-capable backend.
+
+Trace context crosses process and host boundaries as W3C `traceparent`, e.g.
+resume puts it into metadata of created instances and `setup.py` on compute node
+continues the same trace.
+
+Tracing is off until `configure` is called, spans are no-op then.
+"""
+
+from typing import Any, Callable, Dict, Iterator, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+import contextvars
+import functools
+import json
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+
+import logging
+log = logging.getLogger()
+
+# Instance metadata attribute that carries `traceparent` of resume to compute node
+TRACEPARENT_METADATA_KEY = "slurm_traceparent"
+TRACE_FILE_NAME = "traces.jsonl"
+
+_TRACEPARENT = re.compile(r"^00-(?P<trace_id>[0-9a-f]{32})-(?P<span_id>[0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @classmethod
+    def from_traceparent(cls, value: Optional[str]) -> Optional["SpanContext"]:
+        if not value or not (m := _TRACEPARENT.match(value.strip())):
+            return None
+        return cls(trace_id=m["trace_id"], span_id=m["span_id"])
+
+
+@dataclass
+class Span:
+    name: str
+    context: SpanContext
+    parent_id: Optional[str]
+    start_ns: int
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is not None:
+            return # already ended
+        self.end_ns = end_ns or time.time_ns()
+        _exporter.export(self)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": k, "value": _any_value(v)} for k, v in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+            "resource": _exporter.resource,
+        }
+
+
+def _any_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+class _NoExporter:
+    resource: Dict[str, Any] = {}
+
+    def export(self, span: Span) -> None:
+        pass
+
+
+class JsonLinesExporter:
+    """Appends spans to file, safe to share by concurrent processes"""
+    def __init__(self, path: Path, service: str) -> None:
+        self.path = path
+        self.resource = {
+            "service.name": service,
+            "host.name": socket.gethostname(),
+            "process.pid": os.getpid(),
+        }
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        # one `write` of whole line with O_APPEND, so lines of concurrent writers don't interleave
+        line = (json.dumps(span.to_json()) + "\n").encode()
+        try:
+            with self._lock:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+        except OSError:
+            log.debug(f"failed to export span {span.name}", exc_info=True)
+
+
+_exporter: Any = _NoExporter()
+_current: contextvars.ContextVar[Optional[SpanContext]] = contextvars.ContextVar("slurm_gcp_span", default=None)
+
+
+def configure(path: Path, service: str, parent: Optional[SpanContext] = None) -> None:
+    """Enables tracing, spans are appended to `path`. `parent` continues trace started elsewhere."""
+    global _exporter
+    _exporter = JsonLinesExporter(path, service)
+    if parent is not None:
+        _current.set(parent)
+
+
+def enabled() -> bool:
+    return not isinstance(_exporter, _NoExporter)
+
+
+def current() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def start_span(
+        name: str,
+        parent: Optional[SpanContext] = None,
+        start_ns: Optional[int] = None,
+        **attributes: Any) -> Span:
+    """Span that is not made current, has to be ended explicitly"""
+    parent = parent or _current.get()
+    ctx = SpanContext(
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+    )
+    return Span(name=name, context=ctx, parent_id=parent.span_id if parent else None,
+                start_ns=start_ns or time.time_ns(), attributes=dict(attributes))
+
+
+@contextmanager
+def use_span(s: Span) -> Iterator[Span]:
+    """Makes started span current for the block, records raised exception and ends it"""
+    token = _current.set(s.context)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def span(name: str, parent: Optional[SpanContext] = None, **attributes: Any):
+    """Span around the block, e.g. `with tracing.span("wait", operation=name): ...`"""
+    return use_span(start_span(name, parent, **attributes))
+
+
+def propagate(fn: Callable) -> Callable:
+    """Makes `fn` run in current trace context, e.g. when submitted to thread pool"""
+    return functools.partial(contextvars.copy_context().run, fn)
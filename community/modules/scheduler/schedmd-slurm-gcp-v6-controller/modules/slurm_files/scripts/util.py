@@ -14,12 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Iterable, List, Tuple, Optional, Any, Dict, Sequence, Type, Callable, Union
+from typing import Iterable, List, Tuple, Optional, Any, Dict, Sequence, Type, Callable, Union, TYPE_CHECKING
 import argparse
-import base64
-from dataclasses import dataclass, field
+from array import array
+from dataclasses import dataclass, field, replace
 from datetime import timedelta, datetime, timezone
 import hashlib
+import importlib.util
 import inspect
 import json
 import logging
@@ -33,6 +34,8 @@ import shutil
 import socket
 import subprocess
 import sys
+import threading
+import urllib.parse
 from enum import Enum
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -40,27 +43,59 @@ from contextlib import contextmanager
 from functools import lru_cache, reduce, wraps
 from itertools import chain, islice
 from pathlib import Path
-from time import sleep, time
+from time import sleep
+from types import ModuleType
+
+
+_lazy_import_lock = threading.Lock()
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Returns module that is loaded on first access to its attributes.
+    For heavy modules used only by some code paths, to keep startup of scripts cheap,
+    e.g. `suspend.py` doesn't need `google.cloud.storage`.
+    """
+    # serialized, so concurrent callers never get a module that is only partially set up
+    with _lazy_import_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        spec = importlib.util.find_spec(name)
+        if spec is None or spec.loader is None:
+            raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
+
 
 # TODO: remove "type: ignore" once moved to newer version of libraries
-from google.cloud import secretmanager
-from google.cloud import storage # type: ignore
+if TYPE_CHECKING:
+    from google.cloud import secretmanager
+    from google.cloud import storage # type: ignore
+    import google.api_core.exceptions as gExceptions
+else:
+    secretmanager = lazy_import("google.cloud.secretmanager")
+    storage = lazy_import("google.cloud.storage")
+    gExceptions = lazy_import("google.api_core.exceptions")
 
 import google.auth # type: ignore
 from google.oauth2 import service_account # type: ignore
 import googleapiclient.discovery # type: ignore
-import google_auth_httplib2 # type: ignore
-from googleapiclient.http import set_user_agent # type: ignore
 from google.api_core.client_options import ClientOptions
-import httplib2
 
-import google.api_core.exceptions as gExceptions
 
 import requests as requests_lib
 
 import yaml
 from addict import Dict as NSDict # type: ignore
 import file_cache
+import hostlist
+import http_pool
+import metrics
+import rate_limit
+import tracing
 
 USER_AGENT = "Slurm_GCP_Scripts/1.5 (GPN:SchedMD)"
 ENV_CONFIG_YAML = os.getenv("SLURM_CONFIG_YAML")
@@ -69,6 +104,11 @@ if ENV_CONFIG_YAML:
 else:
     CONFIG_FILE = Path(__file__).with_name("config.yaml")
 API_REQ_LIMIT = 2000
+DISCOVERY_CACHE_TTL = timedelta(days=1)
+# Instance templates and machine types cached on disk, see `Lookup.metadata_cache`
+METADATA_CACHE_VERSION = 1 # bump when format of cached values changes
+METADATA_CACHE_TTL = timedelta(hours=6)
+METADATA_CACHE_MAX_STALE = timedelta(days=7)
 
 
 def mkdirp(path: Path) -> None:
@@ -107,6 +147,13 @@ yaml.SafeDumper.yaml_representers[
     None # type: ignore
 ] = lambda self, data: yaml.representer.SafeRepresenter.represent_str(self, str(data)) # type: ignore
 
+# libyaml based loader is order of magnitude faster, fallback to pure-python one if libyaml is not available
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def yaml_load(stream: Any) -> Any:
+    """Same as `yaml.safe_load`, but uses libyaml if available"""
+    return yaml.load(stream, Loader=_YamlLoader)
+
 
 class ApiEndpoint(Enum):
     COMPUTE = "compute"
@@ -452,6 +499,33 @@ def blob_list(prefix="", delimiter=None):
     )
     return [blob for blob in blobs]
 
+
+@dataclass(frozen=True)
+class BucketManifest:
+    """
+    All blobs under common prefix of the slurm bucket, obtained with a single list call.
+    Listed blobs carry `name`, `generation` and `crc32c`, so they can be compared
+    against local state and downloaded without further metadata requests.
+    """
+    prefix: str
+    blobs: List["storage.Blob"]
+
+    def list(self, prefix: str = "") -> List["storage.Blob"]:
+        """Same as `blob_list(prefix)`, but served from the manifest"""
+        blob_prefix = f"{self.prefix}/{prefix}"
+        return [b for b in self.blobs if b.name.startswith(blob_prefix)]
+
+
+@lru_cache(maxsize=1)
+def bucket_manifest() -> BucketManifest:
+    """
+    Manifest shared by all consumers during run of the script (e.g. one slurmsync cycle).
+    Use `bucket_manifest.cache_clear()` to re-list the bucket.
+    """
+    _, path = _get_bucket_and_common_prefix()
+    return BucketManifest(prefix=path, blobs=blob_list(prefix=""))
+
+
 def file_list(prefix="", subpath="") -> List[os.DirEntry]:
     path = dirs.slurm_bucket_mount
     file_prefix = f"{path}/{subpath}"
@@ -463,18 +537,11 @@ def file_list(prefix="", subpath="") -> List[os.DirEntry]:
      # Not considering lack of file's existence as fatal (we may check for files we know don't exist).
      # Responsibility of callee to determine if it is fatal or not, blob_list returns empty iterator in similar cases.
 
-def hash_file(fullpath: Path) -> str:
-    with open(fullpath, "rb") as f:
-        file_hash = hashlib.md5()
-        chunk = f.read(8192)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(8192)
-    return base64.b64encode(file_hash.digest()).decode("utf-8")
-
-
 def install_custom_scripts(check_hash:bool=False):
-    """download custom scripts from gcs bucket"""
+    """
+    download custom scripts from gcs bucket
+    If check_hash is set, skip scripts whose blob generation matches the installed one.
+    """
     role, tokens = lookup().instance_role, []
 
     mounted_scripts=False
@@ -491,11 +558,16 @@ def install_custom_scripts(check_hash:bool=False):
 
     prefixes = [f"slurm-{tok}-script" for tok in tokens]
 
-    # TODO: use single `blob_list`, to reduce ~4x number of GCS requests
     if mounted_scripts:
         source_collection = list(chain.from_iterable(file_list(prefix=p) for p in prefixes))
     else:
-        source_collection = list(chain.from_iterable(blob_list(prefix=p) for p in prefixes))
+        manifest = bucket_manifest()
+        source_collection = list(chain.from_iterable(manifest.list(prefix=p) for p in prefixes))
+
+    # full path of installed script -> generation of the blob it was downloaded from
+    gen_cache = file_cache.private_cache(slurmdirs.state / "cache" / "custom_scripts")
+    installed: Dict[str, int] = gen_cache.get("generations") or {}
+    installed_upd = False
 
     script_pattern = re.compile(r"^slurm-(?P<path>\S+)-script-(?P<name>\S+)")
     for source in source_collection:
@@ -521,33 +593,41 @@ def install_custom_scripts(check_hash:bool=False):
         need_update = True
 
         if check_hash and fullpath.exists() and isinstance(source,storage.Blob):
-            # TODO: MD5 reported by gcloud may differ from the one calculated here (e.g. if blob got gzipped),
-            # consider using gCRC32C
-            need_update = hash_file(fullpath) != source.md5_hash
-
-        log.info(f"installing custom script: {path} from {source.name}")
+            # Generation changes on every overwrite of the blob,
+            # unlike MD5 it doesn't depend on encoding of stored blob (e.g. gzip).
+            need_update = installed.get(str(fullpath)) != source.generation
 
         if isinstance(source,os.DirEntry):
+            log.info(f"installing custom script: {path} from {source.name}")
             shutil.copy(source.path, fullpath) #Needs to be copied since mounted nfs is read-only
             chown_slurm(fullpath, mode=0o755)
 
         elif need_update:
+            log.info(f"installing custom script: {path} from {source.name}")
             with fullpath.open("wb") as f:
                 source.download_to_file(f)
             chown_slurm(fullpath, mode=0o755)
+            installed[str(fullpath)] = source.generation
+            installed_upd = True
+
+    if installed_upd:
+        gen_cache.set("generations", installed)
+
+@lru_cache(maxsize=None)
+def http_pool_for(credentials: Any) -> http_pool.HttpPool:
+    """Pool of keep-alive connections, shared by all API clients with the same credentials"""
+    return http_pool.HttpPool.authorized(credentials, USER_AGENT)
 
 def compute_service(version="beta"):
     """Make thread-safe compute service handle
-    creates a new Http for each request
+    requests are sent over pooled keep-alive connections, see `http_pool`
     """
     credentials = get_credentials()
     dev_key = get_dev_key()
+    pooled = http_pool.PooledHttp(http_pool_for(credentials), credentials=credentials)
 
     def build_request(http, *args, **kwargs):
-        new_http = set_user_agent(httplib2.Http(), USER_AGENT)
-        if credentials is not None:
-            new_http = google_auth_httplib2.AuthorizedHttp(credentials, http=new_http)
-        return googleapiclient.http.HttpRequest(new_http, *args, **kwargs)
+        return googleapiclient.http.HttpRequest(pooled, *args, **kwargs)
 
     ver = endpoint_version(ApiEndpoint.COMPUTE)
     disc_url = googleapiclient.discovery.DISCOVERY_URI
@@ -556,17 +636,61 @@ def compute_service(version="beta"):
         disc_url = disc_url.replace(DEFAULT_UNIVERSE_DOMAIN, universe_domain())
 
     log.debug(f"Using version={version} of Google Compute Engine API")
-    return googleapiclient.discovery.build(
-        "compute",
-        version,
+    return googleapiclient.discovery.build_from_document(
+        discovery_document("compute", version, disc_url, http=pooled, developer_key=dev_key),
         requestBuilder=build_request,
         credentials=credentials,
         developerKey=dev_key,
-        discoveryServiceUrl=disc_url,
-        cache_discovery=False, # See https://github.com/googleapis/google-api-python-client/issues/299
     )
 
-def storage_client() -> storage.Client:
+def discovery_document(api: str, version: str, disc_url: str, http: Any = None, developer_key: Optional[str] = None) -> str:
+    """
+    Returns discovery document of API, cached on disk and shared by all scripts on the host,
+    so scripts don't fetch it on every start. Stale document is used if refresh fails.
+    Document is fetched the way `googleapiclient.discovery.build` does it, over given `http`
+    and with `developer_key`, and is rejected unless it points to the expected universe.
+    NOTE: `googleapiclient` own cache is not used, see https://github.com/googleapis/google-api-python-client/issues/299
+    """
+    url = disc_url.format(api=api, apiVersion=version)
+    key = f"{api}.{version}.{hashlib.md5(url.encode()).hexdigest()}"
+    cache = file_cache.private_cache(slurmdirs.state / "cache" / "discovery")
+    cached = None
+    if entry := cache.get(key): # [fetched at (ISO), document]
+        try:
+            cached = (datetime.fromisoformat(entry[0]), _checked_discovery_document(entry[1], disc_url))
+        except Exception:
+            log.warning(f"Ignoring invalid cached discovery document of {url}", exc_info=True)
+    if cached is not None and now() - cached[0] < DISCOVERY_CACHE_TTL:
+        return cached[1]
+
+    try:
+        req_url = url
+        if developer_key:
+            parts = urllib.parse.urlsplit(url)
+            query = {**dict(urllib.parse.parse_qsl(parts.query)), "key": developer_key}
+            req_url = urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+        _, content = googleapiclient.http.HttpRequest(
+            http or googleapiclient.http.build_http(), googleapiclient.http.HttpRequest.null_postproc, req_url
+        ).execute(num_retries=1)
+        doc = _checked_discovery_document(
+            content.decode() if isinstance(content, bytes) else content, disc_url)
+    except Exception:
+        if cached is None:
+            raise
+        log.warning(f"Failed to refresh discovery document {url}, using cached one", exc_info=True)
+        return cached[1]
+    cache.set(key, [now().isoformat(), doc])
+    return doc
+
+def _checked_discovery_document(doc: str, disc_url: str) -> str:
+    """Makes sure that API requests built from `doc` go to the domain discovery document is served from"""
+    root = urllib.parse.urlparse(json.loads(doc)["rootUrl"]).hostname or ""
+    domain = (urllib.parse.urlparse(disc_url).hostname or "").removeprefix("www.")
+    if not domain or not (root == domain or root.endswith(f".{domain}")):
+        raise ValueError(f"discovery document points to unexpected host {root}, expected *.{domain}")
+    return doc
+
+def storage_client() -> "storage.Client":
     """
     Config-independent storage client
     """
@@ -604,13 +728,13 @@ class _ConfigBlobs:
     """
     "Private" class that represent a collection of GCS blobs for configuration
     """
-    core: storage.Blob
-    controller_addr: Optional[storage.Blob]
-    partition: List[storage.Blob] = field(default_factory=list)
-    nodeset: List[storage.Blob] = field(default_factory=list)
-    nodeset_dyn: List[storage.Blob] = field(default_factory=list)
-    nodeset_tpu: List[storage.Blob] = field(default_factory=list)
-    login_group: List[storage.Blob] = field(default_factory=list)
+    core: "storage.Blob"
+    controller_addr: Optional["storage.Blob"]
+    partition: List["storage.Blob"] = field(default_factory=list)
+    nodeset: List["storage.Blob"] = field(default_factory=list)
+    nodeset_dyn: List["storage.Blob"] = field(default_factory=list)
+    nodeset_tpu: List["storage.Blob"] = field(default_factory=list)
+    login_group: List["storage.Blob"] = field(default_factory=list)
 
     @property
     def hash(self) -> str:
@@ -646,7 +770,7 @@ def _list_config_blobs() -> _ConfigBlobs:
 
     is_controller = instance_role() == "controller"
 
-    for blob in blob_list(prefix=""):
+    for blob in bucket_manifest().list():
         if blob.name == f"{common_prefix}/config.yaml":
             core = blob
         if blob.name == f"{common_prefix}/controller_addr.yaml" and not is_controller:
@@ -683,14 +807,42 @@ def _list_config_files() -> _ConfigFiles:
     
     return _ConfigFiles(core=core, controller_addr=None, **rest)
 
+CONFIG_DOWNLOAD_WORKERS = 16
+
 def _fetch_config(old_hash: Optional[str]) -> Optional[Tuple[NSDict, str]]:
     """Fetch config from bucket, returns None if no changes are detected."""
     blobs = _list_config_blobs()
     if old_hash == blobs.hash:
         return None
 
+    all_blobs = [blobs.core, *blobs.partition, *blobs.nodeset, *blobs.nodeset_dyn, *blobs.nodeset_tpu, *blobs.login_group]
+    if blobs.controller_addr:
+        all_blobs.append(blobs.controller_addr)
+
+    # Parsed content of blobs from previous fetch, keyed by blob generation,
+    # only blobs that changed since then need to be downloaded and parsed.
+    cache = file_cache.private_cache(slurmdirs.state / "cache" / "config_blobs")
+    parsed: Dict[str, List[Any]] = cache.get("parsed") or {} # name -> [generation, content]
+
+    def _load(b: storage.Blob) -> Tuple[Any, bool]:
+        if (hit := parsed.get(b.name)) and hit[0] == b.generation:
+            return hit[1], True
+        content = yaml_load(b.download_as_text())
+        # Only cache content that survives JSON as is (e.g. no dates or non-string keys)
+        try:
+            cacheable = json.loads(json.dumps(content)) == content
+        except (TypeError, ValueError):
+            cacheable = False
+        return content, cacheable
+
+    with ThreadPoolExecutor(max_workers=CONFIG_DOWNLOAD_WORKERS) as exe:
+        results = dict(zip([b.name for b in all_blobs], exe.map(_load, all_blobs)))
+    loaded = {name: content for name, (content, _) in results.items()}
+    cache.set("parsed", {
+        b.name: [b.generation, results[b.name][0]] for b in all_blobs if results[b.name][1]})
+
     def _download(bs) -> List[Any]:
-        return [yaml.safe_load(b.download_as_text()) for b in bs]
+        return [loaded[b.name] for b in bs]
 
     return _assemble_config(
         core=_download([blobs.core])[0],
@@ -712,7 +864,7 @@ def _fetch_mounted_config() -> Optional[Tuple[NSDict, str]]:
         file_yaml=[]
         for file in files:
             with open(file, "r") as f:
-                file_yaml.append(yaml.safe_load(f))
+                file_yaml.append(yaml_load(f))
         return file_yaml
 
     return _assemble_config(
@@ -822,6 +974,32 @@ def fetch_config() -> Tuple[bool, NSDict]:
     chown_slurm(CONFIG_FILE)
     return True, cfg
 
+def init_tracing(service: str, parent: Optional[tracing.SpanContext] = None) -> bool:
+    """Enables tracing if `enable_tracing` is set in config, spans are appended to file in log dir"""
+    if not lookup().cfg.enable_tracing:
+        return False
+    path = dirs.log / tracing.TRACE_FILE_NAME
+    if not path.exists():
+        chown_slurm(path, mode=0o644) # shared by scripts running as root and slurm
+    tracing.configure(path, service, parent)
+    return True
+
+
+def init_metrics(service: str) -> bool:
+    """
+    Enables export of metrics if `metrics_textfile_dir` is set in config,
+    it should be the directory of node_exporter textfile collector, writable by slurm user.
+    """
+    textfile_dir = lookup().cfg.metrics_textfile_dir
+    if not textfile_dir:
+        return False
+    state_dir = slurmdirs.state / "metrics"
+    if not (state_dir / f"{service}.json").exists():
+        chown_slurm(state_dir / f"{service}.json", mode=0o664) # resume runs as slurm, but can be run by root too
+    metrics.configure(Path(textfile_dir), state_dir, service)
+    return True
+
+
 def owned_file_handler(filename):
     """create file handler"""
     chown_slurm(filename)
@@ -1260,17 +1438,15 @@ def to_hostlist(names: Iterable[str]) -> str:
             res.append(f"{p}[{','.join(cs)}]")
     return ",".join(res)
 
-@lru_cache(maxsize=None)
 def to_hostnames(nodelist: str) -> List[str]:
     """make list of hostnames from hostlist expression"""
     if not nodelist:
-        return []  # avoid degenerate invocation of scontrol
+        return []
     if isinstance(nodelist, str):
-        hostlist = nodelist
+        hostlist_expr = nodelist
     else:
-        hostlist = ",".join(nodelist)
-    hostnames = run(f"{lookup().scontrol} show hostnames {hostlist}").stdout.splitlines()
-    return hostnames
+        hostlist_expr = ",".join(nodelist)
+    return hostlist.to_hostnames(hostlist_expr)
 
 
 def retry_exception(exc) -> bool:
@@ -1284,24 +1460,71 @@ def retry_exception(exc) -> bool:
     return any(err in msg for err in retry_errors)
 
 
+def is_rate_limited(exc) -> bool:
+    if retry_exception(exc):
+        return True
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    return status == 429 or "rateLimitExceeded" in str(exc)
+
+
+@lru_cache(maxsize=1)
+def rate_limiter() -> rate_limit.RateLimiter:
+    """
+    Token buckets shared by all scripts on this host, see `rate_limit`.
+    Limits can be overridden with `cfg.api_rate_limits.<read|mutate|operations>` (requests per minute).
+    """
+    cache = file_cache.cache("rate_limit")
+    directory = cache.path if isinstance(cache, file_cache.FileCache) else None
+    overrides = lookup().cfg.api_rate_limits or {}
+    limits = {
+        cls: rate_limit.Limit.per_minute(overrides[cls]) if overrides.get(cls) else limit
+        for cls, limit in rate_limit.DEFAULT_LIMITS.items()
+    }
+    return rate_limit.RateLimiter(directory, limits)
+
+
+def _request_methods(request) -> List[str]:
+    """methodId of request, or of every request in the batch"""
+    if isinstance(request, googleapiclient.http.BatchHttpRequest):
+        return [getattr(r, "methodId", "") or "" for r in request._requests.values()]
+    return [getattr(request, "methodId", "") or ""]
+
+
 def ensure_execute(request):
     """Handle rate limits and socket time outs"""
+    limiter = rate_limiter()
+    methods = _request_methods(request)
+    # outcome of requests in batch is counted by `batch_execute`
+    method = "batch" if isinstance(request, googleapiclient.http.BatchHttpRequest) else methods[0]
+    reason = ""
 
     for retry, wait in enumerate(backoff_delay(0.5, timeout=10 * 60, count=20)):
+        if reason:
+            metrics.API_RETRIES.inc(method=method, reason=reason)
+        metrics.API_THROTTLE_SECONDS.inc(limiter.acquire(methods))
         try:
-            return request.execute()
+            res = request.execute()
+            metrics.API_REQUESTS.inc(method=method, outcome="ok")
+            return res
         except googleapiclient.errors.HttpError as e:
+            limited = is_rate_limited(e)
+            metrics.API_REQUESTS.inc(method=method, outcome="rate_limited" if limited else "error")
+            if limited:
+                limiter.penalize(methods[0] if methods else "")
             if retry_exception(e):
                 log.error(f"retry:{retry} '{e}'")
+                reason = "rate_limited" # only quota and rate limit errors are retried
                 sleep(wait)
                 continue
             raise
 
         except socket.timeout as e:
             # socket timed out, try again
+            metrics.API_REQUESTS.inc(method=method, outcome="timeout")
             log.debug(e)
 
         except Exception as e:
+            metrics.API_REQUESTS.inc(method=method, outcome="error")
             log.error(e, exc_info=True)
             raise
 
@@ -1317,23 +1540,29 @@ def batch_execute(requests, retry_cb=None, log_err=log.error):
         requests = {str(k): v for k, v in enumerate(requests)}  # rid generated here
     done = {}
     failed = {}
-    timestamps: List[float] = []
-    rate_limited = False
+    throttled: Dict[str, str] = {} # method class -> method rate limited in the last round
 
     def batch_callback(rid, resp, exc):
-        nonlocal rate_limited
+        method = getattr(requests[rid], "methodId", "") or ""
         if exc is not None:
             log_err(f"compute request exception {rid}: {exc}")
-            if retry_exception(exc):
-                rate_limited = True
-            else:
+            limited = is_rate_limited(exc)
+            metrics.API_REQUESTS.inc(method=method, outcome="rate_limited" if limited else "error")
+            if limited:
+                throttled[rate_limit.method_class(method)] = method
+            if not retry_exception(exc):
                 req = requests.pop(rid)
                 failed[rid] = (req, exc)
+            else:
+                metrics.API_RETRIES.inc(method=method, reason="rate_limited")
         else:
+            metrics.API_REQUESTS.inc(method=method, outcome="ok")
             # if retry_cb is set, don't move to done until it returns false
             if retry_cb is None or not retry_cb(resp):
                 requests.pop(rid)
                 done[rid] = resp
+            else:
+                metrics.API_RETRIES.inc(method=method, reason="retry_cb")
 
     def batch_request(reqs):
         batch = lookup().compute.new_batch_http_request(callback=batch_callback)
@@ -1342,19 +1571,13 @@ def batch_execute(requests, retry_cb=None, log_err=log.error):
         return batch
 
     while requests:
-        if timestamps:
-            timestamps = [stamp for stamp in timestamps if stamp > time()]
-        if rate_limited and timestamps:
-            stamp = next(iter(timestamps))
-            sleep(max(stamp - time(), 0))
-            rate_limited = False
+        # pace is set by `rate_limiter` in `ensure_execute`
         # up to API_REQ_LIMIT (2000) requests
         # in chunks of up to BATCH_LIMIT (1000)
         batches = [
             batch_request(chunk)
             for chunk in chunked(islice(requests.items(), API_REQ_LIMIT), BATCH_LIMIT)
         ]
-        timestamps.append(time() + 100)
         with ThreadPoolExecutor() as exe:
             futures = []
             for batch in batches:
@@ -1364,6 +1587,10 @@ def batch_execute(requests, retry_cb=None, log_err=log.error):
                 result = future.exception()
                 if result is not None:
                     raise result
+        # slow down once per round, not per every rejected request
+        for method in throttled.values():
+            rate_limiter().penalize(method)
+        throttled.clear()
 
     return done, failed
 
@@ -1491,6 +1718,319 @@ class NodeState:
     base: str
     flags: frozenset
 
+
+class NodeStateTable:
+    """
+    Compact, array-backed table of Slurm node states.
+
+    Base states are interned to small integers and state flags are packed into bitmasks,
+    so equal states of many nodes share a single NodeState object.
+    Rows are indexed by node name and by (prefix, suffix),
+    e.g. "cluster-nodeset" and 7 for "cluster-nodeset-7", so states of a whole nodeset
+    are resolved at once.
+    """
+    _node_name_regex = re.compile(r"^(?P<prefix>.+)-(?P<suffix>\d+)$")
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self._base = array("H")
+        self._flags = array("Q")
+        self._rows: Dict[str, int] = {}
+        self._by_prefix: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._base_ids: Dict[str, int] = {}
+        self._bases: List[str] = []
+        self._flag_bits: Dict[str, int] = {}
+        self._states: Dict[Tuple[int, int], NodeState] = {} # interned NodeStates
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._rows
+
+    def _base_id(self, base: str) -> int:
+        if (bid := self._base_ids.get(base)) is None:
+            bid = self._base_ids[base] = len(self._bases)
+            self._bases.append(base)
+        return bid
+
+    def flag_mask(self, flags: Iterable[str]) -> int:
+        """Bitmask for given flags, unseen flags are registered"""
+        mask = 0
+        for f in flags:
+            if (bit := self._flag_bits.get(f)) is None:
+                assert len(self._flag_bits) < 64, "too many distinct node state flags"
+                bit = self._flag_bits[f] = 1 << len(self._flag_bits)
+            mask |= bit
+        return mask
+
+    def add(self, name: str, base: str, flags: Iterable[str]) -> None:
+        assert name not in self._rows, f"duplicate node {name}"
+        row = len(self.names)
+        self.names.append(name)
+        self._base.append(self._base_id(base))
+        self._flags.append(self.flag_mask(flags))
+        self._rows[name] = row
+        if m := self._node_name_regex.match(name):
+            self._by_prefix[m["prefix"]][int(m["suffix"])] = row
+
+    def _state(self, row: int) -> NodeState:
+        key = (self._base[row], self._flags[row])
+        if (st := self._states.get(key)) is None:
+            flags = frozenset(f for f, bit in self._flag_bits.items() if key[1] & bit)
+            st = self._states[key] = NodeState(base=self._bases[key[0]], flags=flags)
+        return st
+
+    def get(self, name: str) -> Optional[NodeState]:
+        row = self._rows.get(name)
+        return None if row is None else self._state(row)
+
+    def by_suffix(self, prefix: str) -> Dict[int, NodeState]:
+        """States of nodes with given prefix (<cluster>-<nodeset>), keyed by numeric suffix"""
+        return {sfx: self._state(row) for sfx, row in self._by_prefix.get(prefix, {}).items()}
+
+    def to_dict(self) -> Dict[str, NodeState]:
+        return {name: self._state(row) for name, row in self._rows.items()}
+
+    # Compact form of state flags, appended to base state, e.g. "IDLE~" (see `man sinfo`)
+    SUFFIX_FLAGS = {
+        "*": "NOT_RESPONDING",
+        "~": "POWERED_DOWN",
+        "#": "POWERING_UP",
+        "%": "POWERING_DOWN",
+        "!": "POWER_DOWN",
+        "@": "REBOOT_REQUESTED",
+        "^": "REBOOT_ISSUED",
+        "$": "MAINTENANCE",
+        "-": "PLANNED",
+    }
+
+    def _add_power_managed(self, name: str, base: str, flags: Iterable[str]) -> None:
+        """
+        Adds node if it's power-managed (CLOUD) or dynamic.
+        State is normalized, so text and JSON output give the same NodeState:
+        base state is upper case and suffixes are turned into flags,
+        e.g. "DOWN*" -> base="DOWN", flags={"NOT_RESPONDING"}.
+        """
+        base, flags = base.upper(), set(flags)
+        while base[-1:] in self.SUFFIX_FLAGS:
+            flags.add(self.SUFFIX_FLAGS[base[-1]])
+            base = base[:-1]
+        if self.flag_mask(flags) & self.flag_mask(["CLOUD", "DYNAMIC_NORM"]):
+            self.add(name, base or "UNKNOWN", flags)
+
+    @classmethod
+    def from_json(cls, jo: dict) -> "NodeStateTable":
+        """
+        Builds table from output of `scontrol show nodes --json`,
+        only keeps power-managed (CLOUD) and dynamic nodes.
+        """
+        tbl = cls()
+        for node in jo.get("nodes", []):
+            state = node.get("state")
+            if isinstance(state, list): # Slurm >= 23.11: ["IDLE", "CLOUD", ...]
+                base = state[0] if state else "UNKNOWN"
+                flags = state[1:]
+            else: # Slurm 23.02: "idle" + "state_flags"
+                base = str(state or "UNKNOWN")
+                flags = node.get("state_flags", [])
+            tbl._add_power_managed(node["name"], base, flags)
+        return tbl
+
+    @classmethod
+    def from_text(cls, out: str) -> "NodeStateTable":
+        """
+        Builds table from output of `scontrol --oneliner show nodes`,
+        e.g. "NodeName=c-n-0 ... State=IDLE+CLOUD+POWERED_DOWN ...",
+        only keeps power-managed (CLOUD) and dynamic nodes.
+        """
+        tbl = cls()
+        for line in out.splitlines():
+            name = re.search(r"^NodeName=(\S+)", line)
+            state = re.search(r"\sState=(\S+)", line)
+            if name and state:
+                base, *flags = state[1].split("+")
+                tbl._add_power_managed(name[1], base, flags)
+        return tbl
+
+
+def cfg_timedelta(val: Any, default: timedelta) -> timedelta:
+    """
+    Interprets optional config value as a number of seconds.
+    NOTE: can't use `val or default` since `0` is a legit value.
+    """
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return timedelta(seconds=val)
+    return default
+
+
+_INSTANCE_FIELDS = ",".join(sorted([
+    "creationTimestamp",
+    "name",
+    "resourceStatus",
+    "scheduling",
+    "status",
+    "labels.slurm_instance_role",
+    "zone",
+    "metadata",
+]))
+
+
+def _list_instances(lkp: "Lookup", extra_filter: Optional[str] = None) -> Dict[str, Instance]:
+    """Lists instances of the cluster across all zones, optionally narrowed by `extra_filter`"""
+    fields = f"items.zones.instances({_INSTANCE_FIELDS}),nextPageToken"
+    flt = f"labels.slurm_cluster_name={lkp.cfg.slurm_cluster_name} AND name:{lkp.cfg.slurm_cluster_name}-*"
+    if extra_filter:
+        flt = f"{flt} AND {extra_filter}"
+    act = lkp.compute.instances()
+    op = act.aggregatedList(project=lkp.project, fields=fields, filter=flt)
+
+    instances = {}
+    while op is not None:
+        result = ensure_execute(op)
+        for zone in result.get("items", {}).values():
+            for jo in zone.get("instances", []):
+                inst = Instance.from_json(jo)
+                if inst.name in instances:
+                    log.error(f"Duplicate VM name {inst.name} across multiple zones")
+                instances[inst.name] = inst
+        op = act.aggregatedList_next(op, result)
+    return instances
+
+
+@dataclass(frozen=True)
+class _InventorySnapshot:
+    instances: Dict[str, Instance]
+    refreshed_at: datetime # last refresh, either full or incremental
+    reconciled_at: datetime # last full listing
+
+
+class InstanceInventory:
+    """
+    On-disk snapshot of cluster instances, shared by all scripts running on the same host.
+
+    Full listing of instances is expensive on large clusters, instead:
+    * snapshot is used as is if it's not older than `max_age`;
+    * otherwise it's refreshed incrementally, by listing only instances that
+      were created since the last refresh or are not RUNNING;
+    * once per `reconcile_interval` snapshot is rebuilt from scratch, to account
+      for changes invisible to incremental refresh (e.g. RUNNING instance got deleted).
+    """
+    CACHE_KEY = "instances.v1"
+    # `creationTimestamp` filter is applied to strings in timezone of GCP API (Pacific Time),
+    # step back by more than one hour so switch to/from daylight saving time can't cause a miss.
+    TIMESTAMP_SKEW = timedelta(hours=1, minutes=5)
+
+    def __init__(self, lkp: "Lookup", max_age: timedelta, reconcile_interval: timedelta) -> None:
+        self._lkp = lkp
+        self._cache = file_cache.cache("instance_inventory")
+        self.max_age = max_age
+        self.reconcile_interval = reconcile_interval
+
+    def _load(self) -> Optional[_InventorySnapshot]:
+        snap = self._cache.get(self.CACHE_KEY)
+        if not isinstance(snap, _InventorySnapshot):
+            return None
+        return snap
+
+    def _fresh(self, snap: Optional[_InventorySnapshot], ts: datetime, max_age: timedelta) -> bool:
+        return (
+            snap is not None
+            and ts - snap.reconciled_at < self.reconcile_interval
+            and ts - snap.refreshed_at <= max_age)
+
+    def get(self, max_age: Optional[timedelta] = None) -> Dict[str, Instance]:
+        max_age = self.max_age if max_age is None else max_age
+        snap = self._load()
+        if snap is not None and self._fresh(snap, now(), max_age):
+            log.debug(f"Using inventory of {len(snap.instances)} instances refreshed at {snap.refreshed_at}")
+            return snap.instances
+
+        # Refresh under lock, so concurrent `mark_deleting` is not overwritten
+        # and concurrent scripts don't refresh the same snapshot twice.
+        with self._cache.lock(self.CACHE_KEY):
+            ts = now()
+            snap = self._load()
+            if snap is not None and self._fresh(snap, ts, max_age):
+                return snap.instances
+            if snap is None or ts - snap.reconciled_at >= self.reconcile_interval:
+                snap = self._reconcile(ts)
+            else:
+                snap = self._refresh(snap, ts)
+            self._cache.set(self.CACHE_KEY, snap)
+        return snap.instances
+
+    def _reconcile(self, ts: datetime) -> _InventorySnapshot:
+        instances = _list_instances(self._lkp)
+        log.debug(f"Full listing of instances, got {len(instances)}")
+        return _InventorySnapshot(instances=instances, refreshed_at=ts, reconciled_at=ts)
+
+    def _refresh(self, snap: _InventorySnapshot, ts: datetime) -> _InventorySnapshot:
+        # use timezone of already observed timestamps to avoid lexicographical mismatches
+        tz = max(
+            (i.creation_timestamp for i in snap.instances.values()),
+            default=snap.refreshed_at).tzinfo
+        since = (snap.refreshed_at - self.TIMESTAMP_SKEW).astimezone(tz).isoformat(timespec="seconds")
+
+        created = _list_instances(self._lkp, f'creationTimestamp > "{since}"')
+        unsettled = _list_instances(self._lkp, "status != RUNNING")
+        instances = {**snap.instances, **created, **unsettled}
+
+        # Instances that were not RUNNING previously and are not listed now,
+        # either became RUNNING or got deleted, query them individually to tell.
+        vanished = [
+            inst for name, inst in snap.instances.items()
+            if inst.status != "RUNNING" and name not in unsettled and name not in created
+        ]
+        for name, inst in self._resolve(vanished).items():
+            if inst is None:
+                instances.pop(name, None)
+            else:
+                instances[name] = inst
+
+        log.debug(
+            f"Incremental refresh of instances since {since}: {len(created)} created, "
+            f"{len(unsettled)} not running, {len(vanished)} changed state")
+        return _InventorySnapshot(instances=instances, refreshed_at=ts, reconciled_at=snap.reconciled_at)
+
+    def _resolve(self, insts: List[Instance]) -> Dict[str, Optional[Instance]]:
+        """Gets current state of given instances, None for deleted ones"""
+        if not insts:
+            return {}
+        lkp = self._lkp
+        requests = {
+            inst.name: lkp.compute.instances().get(
+                project=lkp.project, zone=inst.zone, instance=inst.name, fields=_INSTANCE_FIELDS)
+            for inst in insts
+        }
+        done, failed = batch_execute(requests, log_err=log.debug)
+        res: Dict[str, Optional[Instance]] = {name: Instance.from_json(jo) for name, jo in done.items()}
+
+        prev = {inst.name: inst for inst in insts}
+        for name, (_, err) in failed.items():
+            if getattr(getattr(err, "resp", None), "status", None) == 404:
+                res[name] = None
+            else:
+                log.warning(f"Failed to get state of instance {name}, keep it as is: {err}")
+                res[name] = prev[name]
+        return res
+
+    def mark_deleting(self, names: Iterable[str]) -> None:
+        """
+        Marks instances with delete requests in-flight as STOPPING,
+        so incremental refresh keeps track of them until they are gone.
+        """
+        with self._cache.lock(self.CACHE_KEY):
+            snap = self._load()
+            if snap is None:
+                return
+            instances = dict(snap.instances)
+            for name in names:
+                if (inst := instances.get(name)) is not None:
+                    instances[name] = replace(inst, status="STOPPING")
+            self._cache.set(self.CACHE_KEY, replace(snap, instances=instances))
+
+
 class Lookup:
     """Wrapper class for cached data access"""
 
@@ -1685,29 +2225,20 @@ class Lookup:
         idx = int(self._node_desc(node_name)["suffix"])
         return idx < self.node_nodeset(node_name).node_count_static
 
+    @lru_cache(maxsize=1)
+    def slurm_node_table(self) -> NodeStateTable:
+        try:
+            res = run(f"{self.scontrol} show nodes --json", timeout=60)
+            return NodeStateTable.from_json(json.loads(res.stdout))
+        except (subprocess.CalledProcessError, json.JSONDecodeError):
+            # JSON output requires data_parser plugin, fall back to text
+            log.warning("Failed to get nodes as JSON, using text output of scontrol")
+        res = run(f"{self.scontrol} --oneliner show nodes", timeout=60)
+        return NodeStateTable.from_text(res.stdout)
+
     @lru_cache(maxsize=None)
     def slurm_nodes(self) -> Dict[str, NodeState]:
-        def parse_line(node_line) -> Tuple[str, NodeState]:
-            """turn node,state line to (node, NodeState)"""
-            # state flags include: CLOUD, COMPLETING, DRAIN, FAIL, POWERED_DOWN,
-            #   POWERING_DOWN
-            node, fullstate = node_line.split(",")
-            state = fullstate.split("+")
-            state_tuple = NodeState(base=state[0], flags=frozenset(state[1:]))
-            return (node, state_tuple)
-
-        cmd = (
-            f"{self.scontrol} show nodes | "
-            r"grep -oP '^NodeName=\K(\S+)|\s+State=\K(\S+)' | "
-            r"paste -sd',\n'"
-        )
-        node_lines = run(cmd, shell=True).stdout.rstrip().splitlines()
-        nodes = {
-            node: state
-            for node, state in map(parse_line, node_lines)
-            if "CLOUD" in state.flags or "DYNAMIC_NORM" in state.flags
-        }
-        return nodes
+        return self.slurm_node_table().to_dict()
 
     def node_state(self, nodename: str) -> Optional[NodeState]:
         state = self.slurm_nodes().get(nodename)
@@ -1722,8 +2253,7 @@ class Lookup:
         #   * dynamic node that didn't register itself
         # * unhappy:
         #   * there is a drift in Slurm and SlurmGCP configurations
-        #   * `slurm_nodes` function failed to handle `scontrol show nodes`,
-        #      TODO: make `slurm_nodes` robust by using `scontrol show nodes --json`
+        #   * `slurm_nodes` function failed to handle `scontrol show nodes --json`
         # In either of "unhappy" cases it's too dangerous to proceed - abort slurmsync.
         try:
             ns = self.node_nodeset(nodename)
@@ -1743,36 +2273,17 @@ class Lookup:
         raise RuntimeError(f"Slurm does not recognize node {nodename}, potential misconfiguration.")
 
 
+    @cached_property
+    def instance_inventory(self) -> InstanceInventory:
+        return InstanceInventory(
+            self,
+            max_age=cfg_timedelta(self.cfg.instance_inventory_max_age, timedelta(seconds=15)),
+            reconcile_interval=cfg_timedelta(self.cfg.instance_inventory_reconcile_interval, timedelta(minutes=5)),
+        )
+
     @lru_cache(maxsize=1)
     def instances(self) -> Dict[str, Instance]:
-        instance_information_fields = [
-            "creationTimestamp",
-            "name",
-            "resourceStatus",
-            "scheduling",
-            "status",
-            "labels.slurm_instance_role",
-            "zone",
-            "metadata",
-        ]
-
-        instance_fields = ",".join(sorted(instance_information_fields))
-        fields = f"items.zones.instances({instance_fields}),nextPageToken"
-        flt = f"labels.slurm_cluster_name={self.cfg.slurm_cluster_name} AND name:{self.cfg.slurm_cluster_name}-*"
-        act = self.compute.instances()
-        op = act.aggregatedList(project=self.project, fields=fields, filter=flt)
-
-        instances = {}
-        while op is not None:
-            result = ensure_execute(op)
-            for zone in result.get("items", {}).values():
-                for jo in zone.get("instances", []):
-                    inst = Instance.from_json(jo)
-                    if inst.name in instances:
-                        log.error(f"Duplicate VM name {inst.name} across multiple zones")
-                    instances[inst.name] = inst
-            op = act.aggregatedList_next(op, result)
-        return instances
+        return self.instance_inventory.get()
 
     def instance(self, instance_name: str) -> Optional[Instance]:
         return self.instances().get(instance_name)
@@ -1888,6 +2399,23 @@ class Lookup:
             op = act.aggregatedList_next(op, result)
         return machines
 
+    @cached_property
+    def cfg_hash(self) -> str:
+        return hashlib.md5(json.dumps(self.cfg, sort_keys=True, default=str).encode()).hexdigest()
+
+    @cached_property
+    def metadata_cache(self) -> file_cache.VersionedCache:
+        """
+        On-disk cache of instance templates and machine types, shared by all scripts.
+        Invalidated once config changes, revalidated in background once TTL has passed.
+        """
+        return file_cache.VersionedCache(
+            file_cache.cache("metadata"),
+            version=f"{METADATA_CACHE_VERSION}.{self.cfg_hash}",
+            ttl=cfg_timedelta(self.cfg.metadata_cache_ttl, METADATA_CACHE_TTL),
+            max_stale=METADATA_CACHE_MAX_STALE,
+        )
+
     def machine_type(self, name: str) -> MachineType:
         custom_patt = re.compile(
             r"((?P<family>\w+)-)?custom-(?P<cpus>\d+)-(?P<mem>\d+)"
@@ -1900,10 +2428,13 @@ class Lookup:
                 accelerators=[],
             )
 
-        machines = self.machine_types()
-        if name not in machines:
-            raise Exception(f"machine type {name} not found")
-        per_zone = machines[name]
+        def fetch() -> Dict[str, Any]:
+            machines = self.machine_types()
+            if name not in machines:
+                raise Exception(f"machine type {name} not found")
+            return machines[name]
+
+        per_zone = self.metadata_cache.get(f"machine_type.{name}", fetch)
         assert per_zone
         return MachineType.from_json(
             next(iter(per_zone.values())) # pick the first/any zone
@@ -1935,11 +2466,13 @@ class Lookup:
     @lru_cache(maxsize=None)
     def template_info(self, template_link):
         template_name = trim_self_link(template_link)
-        cache = file_cache.cache("template_cache")
-
-        if cached := cache.get(template_name):
-            return NSDict(cached)
+        link_hash = hashlib.md5(template_link.encode()).hexdigest()
+        return NSDict(self.metadata_cache.get(
+            f"template.{template_name}.{link_hash}",
+            lambda: self._fetch_template_info(template_link)))
 
+    def _fetch_template_info(self, template_link) -> dict:
+        template_name = trim_self_link(template_link)
         template = ensure_execute(
             self.compute.instanceTemplates().get(
                 project=self.project, instanceTemplate=template_name
@@ -1963,9 +2496,7 @@ class Lookup:
                 count=tga.acceleratorCount)
         else:
             template.gpu = None
-
-        cache.set(template_name, template.to_dict())
-        return template
+        return template.to_dict()
 
 
     def _parse_job_info(self, job_info: str) -> Job:
@@ -2126,7 +2657,7 @@ class Lookup:
 _lkp: Optional[Lookup] = None
 
 def _load_config() -> NSDict:
-    return NSDict(yaml.safe_load(CONFIG_FILE.read_text()))
+    return NSDict(yaml_load(CONFIG_FILE.read_text()))
 
 def lookup() -> Lookup:
     global _lkp
@@ -12,12 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any
+from typing import Any, Optional, Union
 
 
 from dataclasses import dataclass, asdict
 import util
 import local_pubsub 
+import op_tracker
 
 import logging
 log = logging.getLogger()
@@ -36,34 +37,32 @@ class WatchDeleteVmOp_Topic:
         self._t = topic
 
     def publish(self, op: dict[str, Any], node: str) -> None:
-        assert op.get("operationType") == "delete"
-        assert op.get("zone")
-        assert node
+        self.publish_many({node: op})
 
-        msg = WatchDeleteVmOp_Message(op_name=op["name"], zone=op["zone"], node=node)
-        self._t.publish(data=asdict(msg))
+    def publish_many(self, ops: dict[str, dict[str, Any]]) -> None:
+        """Publishes ops of nodes as one batch"""
+        msgs = []
+        for node, op in ops.items():
+            assert op.get("operationType") == "delete"
+            assert op.get("zone")
+            assert node
+            msgs.append(asdict(WatchDeleteVmOp_Message(op_name=op["name"], zone=op["zone"], node=node)))
+        self._t.publish_batch(msgs)
 
 
 def watch_delete_vm_op_topic() -> WatchDeleteVmOp_Topic:
     return WatchDeleteVmOp_Topic(local_pubsub.topic(TOPIC))
 
 
-def _watch_op(lkp: util.Lookup, m: WatchDeleteVmOp_Message) -> bool:
+def _precheck_op(lkp: util.Lookup, m: WatchDeleteVmOp_Message) -> Optional[bool]:
     """
-    Processes VM delete-operation.
-    If operation is still running - do nothing
-    If operation failed - log error & remove op from watch list
-    If operation is done - remove op from watch list do nothing
-    
-    To avoid querying status for each op individually, use list of VM instances as 
-    a source of data. Don't query op for instance X if instance X is not present 
-    (presumably deleted).
+    To avoid querying status of op for instance X if instance X is not present
+    (presumably deleted), use list of VM instances as a source of data.
     NOTE: This optimization can lead to false-positives -
     absence of error-logs in case op failed, but VM got deleted by other means.
 
-    Returns True if message should be marked as processed (ack).
+    Returns ack decision, or None if op status needs to be queried.
     """
-
     inst = lkp.instance(m.node)
     
     if not inst:
@@ -77,12 +76,21 @@ def _watch_op(lkp: util.Lookup, m: WatchDeleteVmOp_Message) -> bool:
     if inst.status == "STOPPING":
         log.debug(f"Skipping op {m.op_name}, VM {m.node} is STOPPING")
         return False # try later
+    return None
 
-    try:
-        op = util.get_operation_req(lkp, m.op_name, zone=m.zone).execute()
-    except:
+
+def _handle_op(m: WatchDeleteVmOp_Message, op: Union[dict[str, Any], Exception]) -> bool:
+    """
+    Processes VM delete-operation.
+    If operation is still running - do nothing
+    If operation failed - log error & remove op from watch list
+    If operation is done - remove op from watch list do nothing
+
+    Returns True if message should be marked as processed (ack).
+    """
+    if isinstance(op, Exception):
         # TODO: consider less conservative handling, but be careful not to cause deadlettering.
-        log.exception(f"Failed to get operation {m.op_name}, will not retry")
+        log.error(f"Failed to get operation {m.op_name}, will not retry: {op}")
         return True # ack (remove)
 
     if op["status"] != "DONE":
@@ -96,29 +104,49 @@ def _watch_op(lkp: util.Lookup, m: WatchDeleteVmOp_Message) -> bool:
     return True # ack
 
 
+def _op_ref(m: WatchDeleteVmOp_Message) -> op_tracker.OperationRef:
+    return op_tracker.OperationRef(name=m.op_name, zone=util.trim_self_link(m.zone))
+
+
 def watch_vm_delete_ops(lkp: util.Lookup) -> None:
     sub = local_pubsub.subscription(TOPIC)
 
     # Pull once instead of "pulling until empty", motivation:
-    # Bulk of cases processed by `_watch_op` relies on freshness of `lkp.instances`,
+    # Bulk of cases processed by `_precheck_op` relies on freshness of `lkp.instances`,
     # `lkp.instances` are fetched once during run of `slurmsync`.
     # Therefore we shouldn't try to re-process messages that has been already NACKed in this run,
     # since they will be handled with the same `lkp.instance` as a previous attempt.
     msgs = sub.pull(max_messages=1000) # 1000 is arbitrary number to be adjusted if needed.
     log.debug(f"Processing {len(msgs)} delete VM operations")
-    # TODO: handle messages in butches to improve latency
+
+    acks: dict[str, bool] = {}
+    to_query: dict[str, tuple[WatchDeleteVmOp_Message, op_tracker.OperationRef]] = {}
     for m in msgs:
         try:
             dm = WatchDeleteVmOp_Message(**m.data)
-            ack = _watch_op(lkp, dm)
+            ack = _precheck_op(lkp, dm)
+            if ack is None:
+                to_query[m.id] = (dm, _op_ref(dm))
+                continue
         except Exception:
             log.exception(f"Failed to process the message {m.id}, removing")
             ack = True
-        if ack:
-            sub.ack([m.id])
-        else:
-            sub.modify_ack_deadline([m.id], deadline=0) # NACK
-        
-
-        
-        
+        acks[m.id] = ack
+
+    # Query all remaining ops at once, using batch requests
+    refs = [ref for _, ref in to_query.values()]
+    try:
+        ops = op_tracker.poll(lkp, refs)
+    except Exception:
+        # unlike failure to get a single operation, nothing is known about any of them, try later
+        log.exception("Failed to get delete VM operations, will retry")
+        ops = {}
+    for mid, (dm, ref) in to_query.items():
+        acks[mid] = _handle_op(dm, ops[ref]) if ref in ops else False
+
+    ack_ids = [mid for mid, ack in acks.items() if ack]
+    nack_ids = [mid for mid, ack in acks.items() if not ack]
+    if ack_ids:
+        sub.ack(ack_ids)
+    if nack_ids:
+        sub.modify_ack_deadline(nack_ids, deadline=0) # NACK
@@ -93,6 +93,57 @@ EOD
   default     = false
 }
 
+variable "bigquery_load_backend" {
+  description = <<EOD
+How job usage is written to big query, if enable_bigquery_load is set:
+- streaming: streaming inserts;
+- load_job: batched load jobs, which are free and write every job once.
+EOD
+  type        = string
+  default     = "streaming"
+
+  validation {
+    condition     = contains(["streaming", "load_job"], var.bigquery_load_backend)
+    error_message = "bigquery_load_backend must be one of: streaming, load_job."
+  }
+}
+
+variable "enable_resume_broker" {
+  description = <<EOD
+Runs a broker service on the controller, which merges ResumeProgram and
+SuspendProgram requests received within a short window, so nodes are
+created and deleted with fewer and larger bulk API calls.
+EOD
+  type        = bool
+  default     = false
+}
+
+variable "slurmsync_interval" {
+  description = <<EOD
+Interval between sync cycles of slurmsync running in daemon mode
+(`slurmsync.py --daemon`), in seconds. Defaults to 30 seconds if not set.
+EOD
+  type        = number
+  default     = null
+
+  validation {
+    condition     = coalesce(var.slurmsync_interval, 1) > 0
+    error_message = "slurmsync_interval must be positive."
+  }
+}
+
+variable "slurmsync_cache_ttl" {
+  description = <<EOD
+How long slurmsync running in daemon mode keeps cached data between sync cycles,
+in seconds, by data source. Sources are: instances, slurm_nodes, jobs,
+resource_policies, reservations, migs, templates and machine_types.
+By default templates and machine_types are kept for an hour, others are refetched every cycle.
+EOD
+  type        = map(number)
+  default     = {}
+  nullable    = false
+}
+
 variable "slurmdbd_conf_tpl" {
   type        = string
   description = "Slurm slurmdbd.conf template file path."
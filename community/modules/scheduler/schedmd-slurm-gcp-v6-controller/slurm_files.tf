@@ -155,9 +155,14 @@ module "slurm_files" {
   enable_debug_logging = var.enable_debug_logging
   extra_logging_flags  = var.extra_logging_flags
 
-  enable_slurm_auth = var.enable_slurm_auth
+  enable_slurm_auth    = var.enable_slurm_auth
+  enable_resume_broker = var.enable_resume_broker
+
+  slurmsync_interval  = var.slurmsync_interval
+  slurmsync_cache_ttl = var.slurmsync_cache_ttl
 
   enable_bigquery_load               = var.enable_bigquery_load
+  bigquery_load_backend              = var.bigquery_load_backend
   enable_external_prolog_epilog      = var.enable_external_prolog_epilog
   enable_chs_gpu_health_check_prolog = var.enable_chs_gpu_health_check_prolog
   enable_chs_gpu_health_check_epilog = var.enable_chs_gpu_health_check_epilog